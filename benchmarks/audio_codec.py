@@ -0,0 +1,149 @@
+"""
+Measure event loop latency while decoding many voice streams on a CodecPool.
+
+Feeds packets for a number of concurrent transmitters into a DecodeStage at
+the SRS frame rate and reports how late a timer on the loop fires, alongside
+how long frames take to come out decoded. Uses Opus if opuslib is installed,
+otherwise a passthrough codec that burns --work-us of CPU per frame to stand
+in for a real decoder.
+
+Run from the repository root:
+
+    python -m benchmarks.audio_codec --streams 50 --seconds 10 --processes
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+from dcs_srs.audio_codec import CodecPool, DecodeStage, OpusCodec, PcmCodec
+from dcs_srs.client_info import Modulation
+from dcs_srs.pacing import AUDIO_FRAME_DURATION, FramePacer
+from dcs_srs.utils import make_short_guid
+from dcs_srs.voice_packet import Frequency, VoicePacket
+
+TIMER_PERIOD = 0.005
+
+
+class _BusyDecoder:
+    def __init__(self, work_us: float):
+        self.work_s = work_us / 1e6
+
+    def decode(self, frame: bytes) -> bytes:
+        end = time.perf_counter() + self.work_s
+        while time.perf_counter() < end:
+            pass
+        return frame
+
+
+class BusyCodec(PcmCodec):
+    """Passthrough that costs about as much CPU as decoding Opus"""
+
+    def __init__(self, work_us: float):
+        self.work_us = work_us
+
+    def decoder(self):
+        return _BusyDecoder(self.work_us)
+
+
+def make_codec(work_us: float):
+    try:
+        return OpusCodec(), True
+    except ImportError:
+        return BusyCodec(work_us), False
+
+
+def percentiles(values: list[float]) -> dict[str, float]:
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {"p50": cuts[49], "p99": cuts[98], "max": max(values)}
+
+
+async def feed(
+    queue: asyncio.Queue, sent_at: dict, streams: int, frames: int, audio: bytes
+):
+    guids = [make_short_guid() for _ in range(streams)]
+    frequency = [Frequency(251e6, Modulation.AM)]
+    pacer = FramePacer()
+    for packet_id in range(frames):
+        await pacer.wait()
+        now = time.monotonic()
+        for guid in guids:
+            packet = VoicePacket(audio, frequency, 0, packet_id, guid)
+            queue.put_nowait(VoicePacket.deserialize_lazy(packet.serialize()))
+            sent_at[(guid, packet_id)] = now
+
+
+async def collect(output: asyncio.Queue, sent_at: dict, expected: int):
+    latencies = []
+    while len(latencies) < expected:
+        frame = await output.get()
+        latencies.append(
+            (time.monotonic() - sent_at[(frame.guid, frame.packet_id)]) * 1000
+        )
+    return latencies
+
+
+async def timer_lag(stop: asyncio.Event) -> list[float]:
+    lags = []
+    while not stop.is_set():
+        start = time.monotonic()
+        await asyncio.sleep(TIMER_PERIOD)
+        lags.append((time.monotonic() - start - TIMER_PERIOD) * 1000)
+    return lags
+
+
+async def run(args) -> dict:
+    codec, is_opus = make_codec(args.work_us)
+    pool = CodecPool(codec, args.workers, args.processes)
+    frames = round(args.seconds / AUDIO_FRAME_DURATION)
+    # Opus can't decode silence of arbitrary bytes, so give it a real frame
+    audio = bytes(1280)
+    if is_opus:
+        audio = codec.encoder().encode(audio)
+
+    queue = asyncio.Queue()
+    stage = DecodeStage(queue, pool, output=asyncio.Queue())
+    stage_task = asyncio.create_task(stage.run())
+    stop = asyncio.Event()
+    timer_task = asyncio.create_task(timer_lag(stop))
+
+    start = time.monotonic()
+    sent_at = {}
+    _, latencies = await asyncio.gather(
+        feed(queue, sent_at, args.streams, frames, audio),
+        collect(stage.output, sent_at, args.streams * frames),
+    )
+    elapsed = time.monotonic() - start
+
+    stop.set()
+    lags = await timer_task
+    stage_task.cancel()
+    pool.shutdown()
+
+    return {
+        "codec": "opus" if is_opus else f"busy_{args.work_us:g}us",
+        "executor": "process" if args.processes else "thread",
+        "streams": args.streams,
+        "decoded_fps": stage.decoded / elapsed,
+        "errors": stage.errors,
+        "loop_lag_ms": percentiles(lags),
+        "decode_latency_ms": percentiles(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--processes", action="store_true")
+    parser.add_argument("--work-us", type=float, default=200.0)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
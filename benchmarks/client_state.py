@@ -0,0 +1,87 @@
+"""
+Memory per client of the compact ClientStore against keeping the raw ClientInfo
+dicts, on a synthetic server. Also checks the wire format round trips and times
+merging radio updates.
+
+Run from the repository root:
+
+    python -m benchmarks.client_state --clients 1000
+"""
+
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+
+from dcs_srs.client_state import ClientStore
+from dcs_srs.server_emulator import synthetic_client, synthetic_radio
+
+
+def wire_clients(count: int) -> list[bytes]:
+    """Clients as they'd arrive, so each parse makes fresh unshared objects"""
+    return [json.dumps(synthetic_client(f"Client-{i}")).encode() for i in range(count)]
+
+
+def measure(build) -> tuple[int, object]:
+    gc.collect()
+    tracemalloc.start()
+    kept = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+
+    raw = wire_clients(args.clients)
+
+    def build_dicts():
+        clients = (json.loads(data) for data in raw)
+        return {client["ClientGuid"]: client for client in clients}
+
+    def build_store():
+        store = ClientStore()
+        for data in raw:
+            store.merge(json.loads(data))
+        return store
+
+    dict_bytes, dicts = measure(build_dicts)
+    store_bytes, store = measure(build_store)
+
+    round_trips = all(store[guid] == info for guid, info in dicts.items())
+
+    changes = 0
+    store.subscribe(lambda change: None)
+    guids = list(dicts)
+    start = time.perf_counter()
+    for _ in range(args.updates):
+        info = dicts[random.choice(guids)]
+        info["RadioInfo"]["radios"][random.randrange(11)] = synthetic_radio()
+        changes += len(store.merge(info))
+    merge_time = (time.perf_counter() - start) / args.updates
+
+    print(
+        json.dumps(
+            {
+                "clients": args.clients,
+                "dict_bytes_per_client": dict_bytes / args.clients,
+                "store_bytes_per_client": store_bytes / args.clients,
+                "reduction": dict_bytes / store_bytes,
+                "round_trips": round_trips,
+                "merge_us": merge_time * 1e6,
+                "changes_per_merge": changes / args.updates,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+End to end benchmarks against the in-process SRS server emulator.
+
+Measures SYNC login latency, RADIO_UPDATE round trip latency (tune on one
+client until another sees the update), sustained voice packets per second
+through the server relay, and per-packet CPU cost of decoding. Results are
+printed (and optionally written) as JSON so runs can be compared between
+releases.
+
+Run from the repository root:
+
+    python -m benchmarks.end_to_end --seed-clients 2000 --output results.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import statistics
+import time
+
+from dcs_srs.client import SrsClient
+from dcs_srs.client_info import Modulation
+from dcs_srs import messages
+from dcs_srs.messages import MessageType
+from dcs_srs.server_emulator import SrsServerEmulator
+from dcs_srs.tcp_json_connection import connect_tcp_json
+from dcs_srs.voice_batch import decode_batch
+from dcs_srs.voice_packet import Frequency, VoicePacket
+
+FREQUENCY = 251e6
+
+
+def percentiles(samples: list[float], scale: float = 1000) -> dict[str, float]:
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50": cuts[49] * scale,
+        "p90": cuts[89] * scale,
+        "p99": cuts[98] * scale,
+        "max": max(samples) * scale,
+    }
+
+
+async def bench_sync_latency(port: int, rounds: int) -> dict:
+    latencies = []
+    for i in range(rounds):
+        client = SrsClient(f"Bench-{i}", print_updates=False)
+        start = time.perf_counter()
+        await client.connect("127.0.0.1", port)
+        latencies.append(time.perf_counter() - start)
+        await client.disconnect()
+    return percentiles(latencies)
+
+
+async def bench_radio_update_rtt(port: int, rounds: int) -> dict:
+    tuner = SrsClient("Bench-Tuner", print_updates=False)
+    await tuner.connect("127.0.0.1", port)
+
+    # Watch for the updates on a bare connection
+    receive_queue, send_queue, tasks = await connect_tcp_json("127.0.0.1", port)
+    observer = SrsClient("Bench-Observer", print_updates=False)
+    await send_queue.put(messages.sync_message(observer.my_info))
+    while (await receive_queue.get())["MsgType"] != MessageType.SYNC:
+        pass
+
+    latencies = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        # Flushed, or this would time the update window
+        await tuner.tune_radio(1, FREQUENCY + i * 1000, Modulation.AM, flush=True)
+        while True:
+            msg = await receive_queue.get()
+            if (
+                msg["MsgType"] == MessageType.RADIO_UPDATE
+                and msg["Client"]["ClientGuid"] == tuner.guid
+            ):
+                break
+        latencies.append(time.perf_counter() - start)
+
+    for task in tasks:
+        task.cancel()
+    await tuner.disconnect()
+    return percentiles(latencies)
+
+
+async def bench_voice_throughput(port: int, packets: int, window: int) -> dict:
+    sender = SrsClient("Bench-Sender", print_updates=False)
+    receiver = SrsClient("Bench-Receiver", print_updates=False)
+    for client in (sender, receiver):
+        await client.connect("127.0.0.1", port)
+        await client.tune_radio(1, FREQUENCY, Modulation.AM)
+    # Let the keepalives and radio updates land before sending
+    await asyncio.sleep(0.2)
+
+    audio = b"\0" * 60
+    frequencies = [Frequency(FREQUENCY, Modulation.AM)]
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for packet_id in range(packets):
+        sender._send_voice_queue.put_nowait(
+            VoicePacket(audio, frequencies, 0, packet_id, sender.guid)
+        )
+        # Keep at most a window of packets in flight so this measures what the
+        # path sustains rather than how fast socket buffers overflow
+        stall_deadline = time.perf_counter() + 0.1
+        while (
+            packet_id - receiver.voice_packets_received > window
+            and time.perf_counter() < stall_deadline
+        ):
+            await asyncio.sleep(0)
+
+    deadline = time.perf_counter() + 2
+    while receiver.voice_packets_received < packets and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    await sender.disconnect()
+    await receiver.disconnect()
+    received = receiver.voice_packets_received
+    return {
+        "sent": packets,
+        "received": received,
+        "lost": packets - received,
+        "packets_per_s": received / elapsed,
+        # Covers sender, emulator relay and receiver since they share a process
+        "cpu_us_per_packet": cpu / max(received, 1) * 1e6,
+    }
+
+
+def bench_decode_cpu(packets: int) -> dict:
+    data = VoicePacket(
+        b"\0" * 60, [Frequency(FREQUENCY, Modulation.AM)], 0, 1, "A" * 22
+    ).serialize()
+    datagrams = [data] * packets
+
+    def cpu_per_packet(func) -> float:
+        start = time.process_time()
+        func()
+        return (time.process_time() - start) / packets * 1e6
+
+    return {
+        "deserialize_us": cpu_per_packet(
+            lambda: [VoicePacket.deserialize(d) for d in datagrams]
+        ),
+        "deserialize_lazy_guid_us": cpu_per_packet(
+            lambda: [VoicePacket.deserialize_lazy(d).guid for d in datagrams]
+        ),
+        "decode_batch_us": cpu_per_packet(lambda: decode_batch(datagrams)),
+    }
+
+
+async def run(args) -> dict:
+    server = SrsServerEmulator(args.seed_clients)
+    port = await server.start()
+    try:
+        return {
+            "python": platform.python_version(),
+            "seed_clients": args.seed_clients,
+            "sync_latency_ms": await bench_sync_latency(port, args.rounds),
+            "radio_update_rtt_ms": await bench_radio_update_rtt(port, args.rounds),
+            "voice": await bench_voice_throughput(port, args.packets, args.window),
+            "decode_cpu": bench_decode_cpu(args.packets),
+        }
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seed-clients", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--packets", type=int, default=20000)
+    parser.add_argument("--window", type=int, default=32)
+    parser.add_argument("--output", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    results = asyncio.run(run(args))
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
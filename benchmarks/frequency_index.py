@@ -0,0 +1,107 @@
+"""
+Compare FrequencyIndex lookups against scanning every client's radios, on a
+synthetic server, and check the index stays consistent under update churn.
+
+Run from the repository root:
+
+    python -m benchmarks.frequency_index --clients 2000
+"""
+
+import argparse
+import json
+import random
+import time
+
+from dcs_srs.frequency_index import FrequencyIndex
+from dcs_srs.server_emulator import (
+    COMMON_FREQUENCIES,
+    synthetic_client,
+    synthetic_radio,
+)
+
+
+def synthetic_clients(count: int):
+    clients = (synthetic_client() for _ in range(count))
+    return {client["ClientGuid"]: client for client in clients}
+
+
+def scan(clients, frequency, modulation, tolerance):
+    return {
+        guid
+        for guid, client in clients.items()
+        for radio in client["RadioInfo"]["radios"]
+        if radio["freq"] > 1.0
+        and radio["modulation"] == modulation
+        and abs(radio["freq"] - frequency) <= tolerance
+    }
+
+
+def timed(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=2000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--updates", type=int, default=20000)
+    args = parser.parse_args()
+
+    clients = synthetic_clients(args.clients)
+    index = FrequencyIndex()
+
+    start = time.perf_counter()
+    for client in clients.values():
+        index.update_client(client)
+    build_time = time.perf_counter() - start
+
+    queries = [random.choice(COMMON_FREQUENCIES) for _ in range(args.lookups)]
+    query = iter(queries * 2)
+    index_lookup = timed(lambda: index.clients_on(*next(query)), args.lookups)
+    scan_repeat = max(1, args.lookups // 100)
+    query = iter(queries)
+    scan_lookup = timed(
+        lambda: scan(clients, *next(query), index.tolerance), scan_repeat
+    )
+
+    # Churn: retune, disconnect and reconnect clients at random
+    guids = list(clients)
+    start = time.perf_counter()
+    for _ in range(args.updates):
+        guid = random.choice(guids)
+        if random.random() < 0.05:
+            index.remove_client(guid)
+            continue
+        clients[guid]["RadioInfo"]["radios"][random.randrange(11)] = synthetic_radio()
+        index.update_client(clients[guid])
+    update_time = (time.perf_counter() - start) / args.updates
+
+    # Removed clients are gone from the index, put them back before comparing
+    for client in clients.values():
+        index.update_client(client)
+    consistent = all(
+        index.clients_on(f, m) == scan(clients, f, m, index.tolerance)
+        for f, m in COMMON_FREQUENCIES
+    )
+
+    print(
+        json.dumps(
+            {
+                "clients": args.clients,
+                "build_ms": build_time * 1000,
+                "index_lookup_us": index_lookup * 1e6,
+                "scan_lookup_us": scan_lookup * 1e6,
+                "speedup": scan_lookup / index_lookup,
+                "update_us": update_time * 1e6,
+                "consistent": consistent,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
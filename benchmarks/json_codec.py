@@ -0,0 +1,76 @@
+"""
+Compare the JSON codec backends on SYNC sized payloads.
+
+By default a SYNC message for a synthetic server is generated. A recorded
+message (one JSON object per line, e.g. captured from a real server) can be
+given with --payload instead.
+
+Run from the repository root:
+
+    python -m benchmarks.json_codec --clients 1000
+    python -m benchmarks.json_codec --payload recorded_sync.jsonl
+"""
+
+import argparse
+import json
+import time
+
+from dcs_srs import messages
+from dcs_srs.json_codec import available_codecs, get_codec
+from dcs_srs.messages import MessageType
+from dcs_srs.server_emulator import DEFAULT_SERVER_SETTINGS, synthetic_client
+
+
+def synthetic_sync(clients: int) -> bytes:
+    return json.dumps(
+        {
+            "Version": messages.SRS_VERSION,
+            "MsgType": MessageType.SYNC,
+            "Clients": [synthetic_client(f"Client-{i}") for i in range(clients)],
+            "ServerSettings": DEFAULT_SERVER_SETTINGS,
+        }
+    ).encode()
+
+
+def per_call_ms(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument(
+        "--payload", help="File with one recorded JSON message per line"
+    )
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.payload:
+        with open(args.payload, "rb") as f:
+            payloads = [line for line in f if line.strip()]
+    else:
+        payloads = [synthetic_sync(args.clients)]
+
+    results = {
+        "payload_bytes": sum(len(p) for p in payloads),
+        "codecs": {},
+    }
+    for name in available_codecs():
+        codec = get_codec(name)
+        decoded = [codec.loads(p) for p in payloads]
+        results["codecs"][name] = {
+            "loads_ms": per_call_ms(
+                lambda: [codec.loads(p) for p in payloads], args.repeat
+            ),
+            "dumps_ms": per_call_ms(
+                lambda: [codec.dumps(m) for m in decoded], args.repeat
+            ),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Measure the cost of a MixerStage playout tick.
+
+Fills a mixer with decoded frames for a number of frequencies, each with a few
+overlapping talkers, and times tick() against the 40 ms frame budget. Needs
+NumPy.
+
+Run from the repository root:
+
+    python -m benchmarks.mixer --frequencies 24 --talkers 4
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import numpy as np
+
+from dcs_srs.audio_codec import DecodedFrame
+from dcs_srs.client_info import Modulation
+from dcs_srs.mixer import MixerStage
+from dcs_srs.pacing import AUDIO_FRAME_DURATION
+from dcs_srs.utils import make_short_guid
+from dcs_srs.voice_packet import Frequency
+
+
+def run(frequencies: int, talkers: int, ticks: int) -> dict:
+    mixer = MixerStage(asyncio.Queue(), target_delay=0, max_frames=ticks)
+    rng = np.random.default_rng(0)
+
+    for i in range(frequencies):
+        frequency = [Frequency(225e6 + i * 25e3, Modulation.AM)]
+        for _ in range(talkers):
+            guid = make_short_guid()
+            for packet_id in range(ticks):
+                pcm = rng.integers(-12000, 12000, mixer.frame_samples, "<i2")
+                mixer.push(DecodedFrame(guid, packet_id, frequency, pcm.tobytes()))
+
+    tick_us = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        mixer.tick()
+        tick_us.append((time.perf_counter() - start) * 1e6)
+
+    percentiles = statistics.quantiles(tick_us, n=100, method="inclusive")
+    return {
+        "frequencies": frequencies,
+        "talkers_per_frequency": talkers,
+        "tick_p50_us": percentiles[49],
+        "tick_p99_us": percentiles[98],
+        "frame_budget_used": percentiles[49] / (AUDIO_FRAME_DURATION * 1e6),
+        "clipped_samples": sum(c.clipped for c in mixer.channels.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--frequencies", type=int, default=24)
+    parser.add_argument("--talkers", type=int, default=4)
+    parser.add_argument("--ticks", type=int, default=250)
+    args = parser.parse_args()
+
+    print(json.dumps(run(args.frequencies, args.talkers, args.ticks), indent=2))
+
+
+if __name__ == "__main__":
+    main()
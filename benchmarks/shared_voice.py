@@ -0,0 +1,104 @@
+"""
+Compare a fleet of bot clients with their own voice sockets and on one shared.
+
+Connects the bots to the in-process server emulator, all tuned to the same
+frequency, has one of them talk, and reports tasks, open file descriptors, idle
+CPU use per second and how much of the voice reached the others.
+
+Run from the repository root:
+
+    python -m benchmarks.shared_voice --clients 200
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from dcs_srs.client import SrsClient
+from dcs_srs.client_info import Modulation
+from dcs_srs.server_emulator import SrsServerEmulator
+from dcs_srs.shared_voice import SharedVoiceTransport
+from dcs_srs.voice_packet import VoicePacket
+
+
+def open_fds() -> int:
+    return len(os.listdir("/proc/self/fd"))
+
+
+async def run(clients: int, shared: bool, frames: int, idle: float) -> dict:
+    server = SrsServerEmulator()
+    port = await server.start()
+    fds_before = open_fds()
+    tasks_before = len(asyncio.all_tasks())
+
+    transport = None
+    if shared:
+        transport = await SharedVoiceTransport.connect(("127.0.0.1", port))
+    bots = [
+        SrsClient(f"Bot-{i}", print_updates=False, voice_transport=transport)
+        for i in range(clients)
+    ]
+    for bot in bots:
+        await bot.connect("127.0.0.1", port)
+        await bot.tune_radio(1, 251e6, Modulation.AM)
+    for bot in bots:
+        await bot.flush_updates()
+    await asyncio.sleep(1.5)
+
+    cpu_start = time.process_time()
+    await asyncio.sleep(idle)
+    idle_cpu = (time.process_time() - cpu_start) / idle
+
+    talker = bots[0]
+    received_before = sum(bot.voice_packets_received for bot in bots)
+    for packet_id in range(frames):
+        await talker._send_voice_queue.put(
+            VoicePacket(
+                bytes(60),
+                talker.transmit_frequencies(1),
+                0,
+                packet_id,
+                talker.guid,
+            )
+        )
+        await asyncio.sleep(0.02)
+    await asyncio.sleep(0.5)
+    received = sum(bot.voice_packets_received for bot in bots) - received_before
+
+    result = {
+        "clients": clients,
+        "shared": shared,
+        "tasks": len(asyncio.all_tasks()) - tasks_before,
+        "fds": open_fds() - fds_before,
+        "idle_cpu_per_s": idle_cpu,
+        "voice_expected": frames * (clients - 1),
+        "voice_received": received,
+        "rtt_ms": 1000 * (talker.link_health.rtt or 0),
+    }
+
+    for bot in bots:
+        await bot.disconnect()
+    if transport is not None:
+        transport.close()
+    await server.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--idle", type=float, default=3.0)
+    args = parser.parse_args()
+
+    results = [
+        asyncio.run(run(args.clients, shared, args.frames, args.idle))
+        for shared in (False, True)
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
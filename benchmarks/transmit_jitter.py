@@ -0,0 +1,90 @@
+"""
+Measure the send cadence of the transmit pacing under event loop load.
+
+Compares FramePacer against the naive "sleep one frame after each send" loop
+while other tasks keep the loop busy with short blocking bursts, roughly like
+a client handling a big SYNC or lots of inbound voice at the same time.
+
+Run from the repository root:
+
+    python -m benchmarks.transmit_jitter --frames 250 --load-ms 15
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+from dcs_srs.pacing import AUDIO_FRAME_DURATION, FramePacer
+
+
+async def busy_loop_load(max_block_ms: float, stop: asyncio.Event):
+    """Block the loop for random short stretches until told to stop"""
+    while not stop.is_set():
+        end = time.monotonic() + random.uniform(0, max_block_ms) / 1000
+        while time.monotonic() < end:
+            pass
+        await asyncio.sleep(random.uniform(0, AUDIO_FRAME_DURATION))
+
+
+async def naive_sender(frames: int) -> list[float]:
+    send_times = []
+    for _ in range(frames):
+        send_times.append(time.monotonic())
+        await asyncio.sleep(AUDIO_FRAME_DURATION)
+    return send_times
+
+
+async def paced_sender(frames: int) -> list[float]:
+    pacer = FramePacer()
+    send_times = []
+    for _ in range(frames):
+        await pacer.wait()
+        send_times.append(time.monotonic())
+    return send_times
+
+
+def summarize(send_times: list[float]) -> dict[str, float]:
+    intervals = [b - a for a, b in zip(send_times, send_times[1:])]
+    jitter_ms = [abs(i - AUDIO_FRAME_DURATION) * 1000 for i in intervals]
+    percentiles = statistics.quantiles(jitter_ms, n=100, method="inclusive")
+    expected = AUDIO_FRAME_DURATION * (len(send_times) - 1)
+    return {
+        "jitter_p50_ms": percentiles[49],
+        "jitter_p99_ms": percentiles[98],
+        "jitter_max_ms": max(jitter_ms),
+        "drift_ms": (send_times[-1] - send_times[0] - expected) * 1000,
+    }
+
+
+async def run(sender, frames: int, load_tasks: int, load_ms: float):
+    stop = asyncio.Event()
+    loads = [
+        asyncio.create_task(busy_loop_load(load_ms, stop)) for _ in range(load_tasks)
+    ]
+    try:
+        return summarize(await sender(frames))
+    finally:
+        stop.set()
+        await asyncio.gather(*loads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--frames", type=int, default=250)
+    parser.add_argument("--load-tasks", type=int, default=2)
+    parser.add_argument("--load-ms", type=float, default=15.0)
+    args = parser.parse_args()
+
+    results = {}
+    for name, sender in (("naive_sleep", naive_sender), ("frame_pacer", paced_sender)):
+        results[name] = asyncio.run(
+            run(sender, args.frames, args.load_tasks, args.load_ms)
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Compare the datagram endpoint and the batched UDP receiver under bursts.
+
+A plain socket fires bursts of voice datagrams at each receive engine over
+loopback, and a consumer drains the voice receive queue with `get_batch`.
+Reports CPU time per received packet and how many packets were lost, in the
+kernel or in the queues.
+
+Run from the repository root:
+
+    python -m benchmarks.udp_receive --bursts 200 --burst-size 500
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import time
+
+from dcs_srs.client_info import Modulation
+from dcs_srs.link_health import LinkHealth
+from dcs_srs.queues import StageQueues
+from dcs_srs.udp_receiver import BatchedUdpSocket
+from dcs_srs.utils import make_short_guid, run
+from dcs_srs.voice_batch import get_batch
+from dcs_srs.voice_connection import UdpProtocol, receive_voice
+from dcs_srs.voice_packet import Frequency, VoicePacket
+
+
+async def open_receiver(batched: bool, addr: tuple[str, int], queues: StageQueues):
+    """Start a receive engine, returning the receiver's address and a closer"""
+    health = LinkHealth()
+    voice_receive_queue = queues.make("voice_receive")
+    if batched:
+        receiver = await BatchedUdpSocket.connect(addr, voice_receive_queue, health)
+        return receiver.sock.getsockname(), receiver.close
+
+    datagram_queue = queues.make("voice_datagram")
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: UdpProtocol(datagram_queue, health), remote_addr=addr
+    )
+    task = asyncio.create_task(
+        receive_voice(datagram_queue, voice_receive_queue, health)
+    )
+
+    def close():
+        task.cancel()
+        transport.close()
+
+    return transport.get_extra_info("sockname"), close
+
+
+async def measure(batched: bool, bursts: int, burst_size: int, gap: float) -> dict:
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.bind(("127.0.0.1", 0))
+    queues = StageQueues()
+    receiver_addr, close = await open_receiver(
+        batched, sender.getsockname(), queues
+    )
+    sender.connect(receiver_addr)
+
+    guid = make_short_guid()
+    frequencies = [Frequency(251e6, Modulation.AM)]
+    datagrams = [
+        VoicePacket(bytes(80), frequencies, 0, packet_id, guid).serialize()
+        for packet_id in range(burst_size)
+    ]
+
+    received = 0
+
+    async def consume():
+        nonlocal received
+        while True:
+            received += len(await get_batch(queues.queues["voice_receive"]))
+
+    consumer = asyncio.create_task(consume())
+    cpu_start = time.process_time()
+    for _ in range(bursts):
+        for data in datagrams:
+            sender.send(data)
+        await asyncio.sleep(gap)
+    await asyncio.sleep(0.2)
+    cpu = time.process_time() - cpu_start
+
+    consumer.cancel()
+    close()
+    sender.close()
+
+    sent = bursts * burst_size
+    return {
+        "engine": "batched" if batched else "endpoint",
+        "sent": sent,
+        "received": received,
+        "lost": sent - received,
+        "cpu_us_per_packet": cpu / max(received, 1) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--bursts", type=int, default=200)
+    parser.add_argument("--burst-size", type=int, default=500)
+    parser.add_argument(
+        "--gap", type=float, default=0.01, help="Seconds between bursts"
+    )
+    args = parser.parse_args()
+
+    results = [
+        run(measure(batched, args.bursts, args.burst_size, args.gap))
+        for batched in (False, True)
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
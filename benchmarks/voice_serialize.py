@@ -0,0 +1,74 @@
+"""
+Compare per-packet cost of VoicePacket.serialize and PacketTemplate.
+
+Serializes the same transmission both ways for a few audio sizes and radio
+counts and reports nanoseconds per packet.
+
+Run from the repository root:
+
+    python -m benchmarks.voice_serialize --packets 200000
+"""
+
+import argparse
+import json
+import time
+
+from dcs_srs.client_info import Modulation
+from dcs_srs.utils import make_short_guid
+from dcs_srs.voice_packet import Frequency, PacketTemplate, VoicePacket
+
+FREQUENCIES = [
+    Frequency(243e6, Modulation.AM),
+    Frequency(251e6, Modulation.AM),
+    Frequency(30e6, Modulation.FM),
+]
+
+
+def time_per_packet(serialize, packets: int) -> float:
+    start = time.perf_counter_ns()
+    for packet_id in range(packets):
+        serialize(packet_id)
+    return (time.perf_counter_ns() - start) / packets
+
+
+def run(audio_length: int, radios: int, packets: int) -> dict:
+    audio = bytes(audio_length)
+    packet = VoicePacket(audio, FREQUENCIES[:radios], 1234, 0, make_short_guid())
+
+    def serialize(packet_id):
+        packet.packet_id = packet_id
+        return packet.serialize()
+
+    template = PacketTemplate.for_packet(packet)
+
+    def serialize_template(packet_id):
+        return template.serialize(audio, packet_id)
+
+    assert bytes(serialize_template(7)) == serialize(7)
+
+    baseline_ns = time_per_packet(serialize, packets)
+    template_ns = time_per_packet(serialize_template, packets)
+    return {
+        "audio_bytes": audio_length,
+        "radios": radios,
+        "serialize_ns": baseline_ns,
+        "template_ns": template_ns,
+        "speedup": baseline_ns / template_ns,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--packets", type=int, default=200_000)
+    args = parser.parse_args()
+
+    results = [
+        run(audio_length, radios, args.packets)
+        for audio_length in (120, 1280)
+        for radios in (1, 3)
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Measure voice throughput of VoiceWorkerPool for different worker counts.
+
+Pushes synthetic voice datagrams from many transmitters through the shared
+memory rings as fast as the workers take them, with each worker spending
+--work-us of CPU per packet as a stand-in for decoding, mixing or
+transcription. Scaling is bounded by the number of cores available.
+
+Run from the repository root:
+
+    python -m benchmarks.voice_workers --workers 1 2 4 --packets 50000
+"""
+
+import argparse
+import functools
+import json
+import os
+import time
+
+from dcs_srs.client_info import Modulation
+from dcs_srs.utils import make_short_guid
+from dcs_srs.voice_packet import Frequency, VoicePacket, VoicePacketView
+from dcs_srs.voice_workers import VoiceWorkerPool
+
+
+class BusySink:
+    """Reads each packet's GUID and id and burns CPU, like real work would"""
+
+    def __init__(self, work_us: float, index: int):
+        self.work_s = work_us / 1e6
+
+    def handle_batch(self, packets: list[VoicePacketView]):
+        for packet in packets:
+            packet.guid, packet.packet_id
+            end = time.perf_counter() + self.work_s
+            while time.perf_counter() < end:
+                pass
+
+    def close(self):
+        pass
+
+
+def make_datagrams(transmitters: int) -> list[bytes]:
+    frequency = [Frequency(251e6, Modulation.AM)]
+    return [
+        VoicePacket(bytes(120), frequency, 0, 0, make_short_guid()).serialize()
+        for _ in range(transmitters)
+    ]
+
+
+def run(workers: int, packets: int, work_us: float, transmitters: int) -> dict:
+    datagrams = make_datagrams(transmitters)
+    pool = VoiceWorkerPool(functools.partial(BusySink, work_us), workers)
+    pool.start()
+    try:
+        start = time.perf_counter()
+        for i in range(packets):
+            datagram = datagrams[i % transmitters]
+            # Wait for room rather than dropping
+            while not pool.submit(datagram):
+                time.sleep(0.0005)
+        while pool.processed() < packets:
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.close()
+
+    return {
+        "workers": workers,
+        "packets_per_second": packets / elapsed,
+        "ring_full_retries": pool.dropped,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--packets", type=int, default=50_000)
+    parser.add_argument("--work-us", type=float, default=50.0)
+    parser.add_argument("--transmitters", type=int, default=200)
+    args = parser.parse_args()
+
+    results = [
+        run(workers, args.packets, args.work_us, args.transmitters)
+        for workers in args.workers
+    ]
+    baseline = results[0]["packets_per_second"]
+    for result in results:
+        result["speedup"] = result["packets_per_second"] / baseline
+    print(json.dumps({"cpus": os.cpu_count(), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
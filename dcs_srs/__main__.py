@@ -2,20 +2,61 @@ import argparse
 import asyncio
 import logging
 
+from .audio_codec import CodecPool, OpusCodec
+from .capture import TrafficCapture
 from .client import SrsClient
 from .client_info import Modulation
+from . import profiling
+from .supervisor import ConnectionSupervisor
+from .utils import run
 
 logger = logging.getLogger(__name__)
 
 
-async def main(addr: tuple[str, int], name: str, awacs: str):
-    # Make a new client instance
-    client = SrsClient(name)
+async def main(
+    addr: tuple[str, int],
+    name: str,
+    awacs: str,
+    audio: str | None,
+    loop: bool,
+    stats: bool,
+    batched_voice: bool,
+    reconnect: bool,
+    capture_path: str | None,
+):
+    stats_task = None
+    if stats:
+        # Time the hot paths and print a summary every few seconds
+        stats_task = asyncio.create_task(profiling.print_summaries())
+
+    # Make a new client instance, logging its traffic if asked to
+    capture = TrafficCapture(capture_path) if capture_path else None
+    client = SrsClient(name, batched_voice=batched_voice, capture=capture)
 
     # Connect to the SRS server
     host, port = addr
-    await client.connect(host, port)
+    supervisor_task = None
+    try:
+        if reconnect:
+            # Stay connected, reconnecting whenever the connection is lost
+            supervisor = ConnectionSupervisor(client, host, port)
+            supervisor_task = asyncio.create_task(supervisor.run())
+            await supervisor.connected.wait()
+        else:
+            await client.connect(host, port)
+
+        await run_client(client, awacs, audio, loop)
+    finally:
+        for task in (supervisor_task, stats_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        await client.disconnect()
+        if capture is not None:
+            capture.close()
+
 
+async def run_client(client: SrsClient, awacs: str, audio: str | None, loop: bool):
     # Grab the first global frequency and tune radio 1 to it
     global_freq = client.server_settings["GLOBAL_LOBBY_FREQUENCIES"].split(",")[0]
     global_freq_mhz = float(global_freq)
@@ -27,7 +68,26 @@ async def main(addr: tuple[str, int], name: str, awacs: str):
             print("Bad password")
             return
 
-    await asyncio.to_thread(input, "press enter to end...")
+    if not audio:
+        await asyncio.to_thread(input, "press enter to end...")
+        return
+
+    pool = CodecPool(OpusCodec())
+    try:
+        if not loop:
+            # Broadcast the file once on radio 1
+            await client.transmit_file(audio, 1, pool)
+            return
+
+        # Keep broadcasting on radio 1 until enter is pressed
+        broadcast = asyncio.create_task(client.transmit_file(audio, 1, pool, loop))
+        try:
+            await asyncio.to_thread(input, "press enter to end...")
+        finally:
+            broadcast.cancel()
+            await asyncio.gather(broadcast, return_exceptions=True)
+    finally:
+        pool.shutdown()
 
 
 if __name__ == "__main__":
@@ -50,6 +110,43 @@ if __name__ == "__main__":
     parser.add_argument(
         "--awacs", help="Log in to external AWACS mode with the given password"
     )
+    parser.add_argument(
+        "--audio", help="WAV or raw 16 kHz mono PCM file to broadcast on radio 1"
+    )
+    parser.add_argument(
+        "--loop", action="store_true", help="Keep repeating the --audio file"
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print per-stage timings and throughput while connected",
+    )
+    parser.add_argument(
+        "--batched-voice",
+        action="store_true",
+        help="Receive voice with the batched UDP receiver",
+    )
+    parser.add_argument(
+        "--reconnect",
+        action="store_true",
+        help="Reconnect automatically if the connection to the server is lost",
+    )
+    parser.add_argument(
+        "--capture",
+        help="Log all traffic to this file, for replay with python -m dcs_srs.capture",
+    )
     args = parser.parse_args()
 
-    asyncio.run(main((args.host, args.port), args.name, args.awacs))
+    run(
+        main(
+            (args.host, args.port),
+            args.name,
+            args.awacs,
+            args.audio,
+            args.loop,
+            args.stats,
+            args.batched_voice,
+            args.reconnect,
+            args.capture,
+        )
+    )
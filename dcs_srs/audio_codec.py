@@ -0,0 +1,351 @@
+"""
+Audio encode/decode off the event loop.
+
+Voice packets carry Opus frames. Encoding and decoding them is CPU work that
+would stall the TCP and keepalive tasks if done on the loop, so it's handed to
+a pool of single-worker thread or process executors. Codecs are stateful per
+stream, so each stream (transmitter GUID when decoding) is pinned to one
+worker by hashing its key, and the worker keeps that stream's encoder/decoder.
+Jobs to one worker run in order, so a stream's frames come back in order too.
+
+Frames are batched per job: whatever is waiting on the receive queue for a
+stream goes over in one call, and encoding takes a few frames at a time.
+
+`PcmCodec` passes audio through unchanged for testing. `OpusCodec` needs
+opuslib installed.
+"""
+
+import asyncio
+from collections import deque
+from collections.abc import AsyncIterator, Hashable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+import itertools
+import logging
+import os
+import time
+from typing import Any, Protocol
+import zlib
+
+from .queues import BoundedQueue, OverflowPolicy
+from .utils import Guid
+from .voice_batch import get_batch
+from .voice_packet import Frequency, VoicePacketView
+
+logger = logging.getLogger(__name__)
+
+
+SRS_SAMPLE_RATE = 16000
+SRS_CHANNELS = 1
+
+
+class Encoder(Protocol):
+    def encode(self, pcm: bytes) -> bytes:
+        ...
+
+
+class Decoder(Protocol):
+    def decode(self, frame: bytes) -> bytes:
+        ...
+
+
+class AudioCodec(Protocol):
+    """Makes a fresh encoder or decoder for each stream. Must be picklable."""
+
+    def encoder(self) -> Encoder:
+        ...
+
+    def decoder(self) -> Decoder:
+        ...
+
+
+class _Passthrough:
+    def encode(self, pcm: bytes) -> bytes:
+        return pcm
+
+    def decode(self, frame: bytes) -> bytes:
+        return frame
+
+
+class PcmCodec:
+    """Raw PCM in and out, no actual coding"""
+
+    def encoder(self) -> Encoder:
+        return _Passthrough()
+
+    def decoder(self) -> Decoder:
+        return _Passthrough()
+
+
+class _OpusEncoder:
+    def __init__(self, codec: "OpusCodec"):
+        import opuslib
+
+        self._encoder = opuslib.Encoder(
+            codec.sample_rate, codec.channels, opuslib.APPLICATION_VOIP
+        )
+        self._frame_size = codec.frame_size
+
+    def encode(self, pcm: bytes) -> bytes:
+        # opuslib casts the buffer with ctypes, which only takes bytes, and
+        # frames of a mapped file are memoryviews
+        return self._encoder.encode(bytes(pcm), self._frame_size)
+
+
+class _OpusDecoder:
+    def __init__(self, codec: "OpusCodec"):
+        import opuslib
+
+        self._decoder = opuslib.Decoder(codec.sample_rate, codec.channels)
+        self._frame_size = codec.frame_size
+
+    def decode(self, frame: bytes) -> bytes:
+        return self._decoder.decode(frame, self._frame_size)
+
+
+@dataclass(frozen=True)
+class OpusCodec:
+    """16 bit PCM <-> Opus through opuslib"""
+
+    sample_rate: int = SRS_SAMPLE_RATE
+    channels: int = SRS_CHANNELS
+    frame_duration: float = 0.04
+
+    def __post_init__(self):
+        # Fail early rather than in a worker
+        import opuslib  # noqa: F401
+
+    @property
+    def frame_size(self) -> int:
+        return int(self.sample_rate * self.frame_duration)
+
+    def encoder(self) -> Encoder:
+        return _OpusEncoder(self)
+
+    def decoder(self) -> Decoder:
+        return _OpusDecoder(self)
+
+
+#
+# Worker side. Each worker only ever sees the streams hashed to it, so its
+# states are only touched from its own thread or process. States are kept per
+# pool, as in thread mode several pools share this module.
+#
+_states: dict[int, dict[tuple[str, Hashable], Any]] = {}
+_pool_ids = itertools.count()
+
+
+def _encode_frames(
+    pool_id: int, codec: AudioCodec, key: Hashable, frames: list[bytes]
+):
+    states = _states.setdefault(pool_id, {})
+    encoder = states.get(("encode", key))
+    if encoder is None:
+        encoder = states[("encode", key)] = codec.encoder()
+    return [encoder.encode(frame) for frame in frames]
+
+
+def _decode_frames(
+    pool_id: int, codec: AudioCodec, key: Hashable, frames: list[bytes]
+):
+    states = _states.setdefault(pool_id, {})
+    decoder = states.get(("decode", key))
+    if decoder is None:
+        decoder = states[("decode", key)] = codec.decoder()
+    return [decoder.decode(frame) for frame in frames]
+
+
+def _release(pool_id: int, key: Hashable):
+    states = _states.get(pool_id, {})
+    states.pop(("encode", key), None)
+    states.pop(("decode", key), None)
+
+
+class CodecPool:
+    def __init__(
+        self,
+        codec: AudioCodec,
+        workers: int | None = None,
+        use_processes: bool = False,
+    ):
+        self.codec = codec
+        self._id = next(_pool_ids)
+        self._use_processes = use_processes
+        workers = workers or os.cpu_count() or 1
+        executor_type = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        # Memoryviews (e.g. frames of a mapped file) can't be pickled
+        self._copy_frames = use_processes
+        self._shards: list[Executor] = [executor_type(1) for _ in range(workers)]
+
+    @property
+    def shards(self) -> int:
+        return len(self._shards)
+
+    def shard_index(self, key: Hashable) -> int:
+        """Which worker a stream's jobs go to"""
+        # Stable across processes, unlike hash() of a str
+        return zlib.crc32(repr(key).encode()) % len(self._shards)
+
+    def _shard(self, key: Hashable) -> Executor:
+        return self._shards[self.shard_index(key)]
+
+    def encode(
+        self, key: Hashable, frames: list[bytes]
+    ) -> asyncio.Future[list[bytes]]:
+        if self._copy_frames:
+            frames = [bytes(frame) for frame in frames]
+        return asyncio.wrap_future(
+            self._shard(key).submit(
+                _encode_frames, self._id, self.codec, key, frames
+            )
+        )
+
+    def decode(
+        self, key: Hashable, frames: list[bytes]
+    ) -> asyncio.Future[list[bytes]]:
+        return asyncio.wrap_future(
+            self._shard(key).submit(
+                _decode_frames, self._id, self.codec, key, frames
+            )
+        )
+
+    def release(self, key: Hashable):
+        """Drop a finished stream's codec state"""
+        self._shard(key).submit(_release, self._id, key)
+
+    async def encode_stream(
+        self,
+        key: Hashable,
+        pcm_frames: AsyncIterator[bytes],
+        batch_frames: int = 2,
+        lookahead: int = 2,
+    ) -> AsyncIterator[bytes]:
+        """
+        Encode a stream of PCM frames, batch_frames per job, with up to
+        lookahead jobs in flight ahead of the consumer.
+        """
+        in_flight: deque[asyncio.Future[list[bytes]]] = deque()
+        batch: list[bytes] = []
+        try:
+            async for frame in pcm_frames:
+                batch.append(frame)
+                if len(batch) < batch_frames:
+                    continue
+                in_flight.append(self.encode(key, batch))
+                batch = []
+                if len(in_flight) > lookahead:
+                    for encoded in await in_flight.popleft():
+                        yield encoded
+            if batch:
+                in_flight.append(self.encode(key, batch))
+            while in_flight:
+                for encoded in await in_flight.popleft():
+                    yield encoded
+        finally:
+            for future in in_flight:
+                future.cancel()
+            self.release(key)
+
+    def shutdown(self):
+        for shard in self._shards:
+            shard.shutdown(wait=False, cancel_futures=True)
+        if not self._use_processes:
+            _states.pop(self._id, None)
+
+
+@dataclass(slots=True)
+class DecodedFrame:
+    guid: Guid
+    packet_id: int
+    frequencies: list[Frequency]
+    pcm: bytes
+
+
+class DecodeStage:
+    """
+    Decodes packets from the voice receive queue on a CodecPool and puts
+    DecodedFrames on `output`, in order per transmitter. Decoder state for a
+    transmitter is released after it's been quiet for idle_timeout.
+
+    At most max_in_flight jobs are queued on each pool worker. Past that the
+    stage waits for the worker's oldest job, so if decoding can't keep up the
+    backlog stays in the voice receive queue and its drop policy applies,
+    instead of growing in the pool.
+    """
+
+    def __init__(
+        self,
+        voice_receive_queue: asyncio.Queue[VoicePacketView],
+        pool: CodecPool,
+        output: asyncio.Queue[DecodedFrame] | None = None,
+        max_batch: int = 64,
+        idle_timeout: float = 5.0,
+        max_in_flight: int = 2,
+    ):
+        self.voice_receive_queue = voice_receive_queue
+        self.pool = pool
+        if output is None:
+            output = BoundedQueue(1024, OverflowPolicy.DROP_OLDEST)
+        self.output = output
+        self.max_batch = max_batch
+        self.idle_timeout = idle_timeout
+        self.max_in_flight = max_in_flight
+        self.decoded = 0
+        self.errors = 0
+
+        self._last_heard: dict[Guid, float] = {}
+        self._last_sweep = time.monotonic()
+        # Jobs per pool worker, oldest first. A worker runs them in order.
+        self._in_flight = [deque() for _ in range(pool.shards)]
+
+    async def run(self):
+        while True:
+            packets = await get_batch(self.voice_receive_queue, self.max_batch)
+
+            streams: dict[Guid, list[VoicePacketView]] = {}
+            for packet in packets:
+                streams.setdefault(packet.guid, []).append(packet)
+
+            now = time.monotonic()
+            for guid, stream in streams.items():
+                self._last_heard[guid] = now
+                # Copy the audio out, memoryviews can't cross to a worker
+                frames = [bytes(packet.audio_data) for packet in stream]
+                await self._wait_for_room(self.pool.shard_index(guid))
+                future = self.pool.decode(guid, frames)
+                future.add_done_callback(
+                    lambda f, stream=stream: self._deliver(stream, f)
+                )
+                self._in_flight[self.pool.shard_index(guid)].append(future)
+
+            if now - self._last_sweep > self.idle_timeout:
+                self._release_idle(now)
+
+    async def _wait_for_room(self, shard: int):
+        in_flight = self._in_flight[shard]
+        while in_flight and in_flight[0].done():
+            in_flight.popleft()
+        while len(in_flight) >= self.max_in_flight:
+            await asyncio.wait([in_flight.popleft()])
+
+    def _release_idle(self, now: float):
+        self._last_sweep = now
+        for guid, last_heard in list(self._last_heard.items()):
+            if now - last_heard > self.idle_timeout:
+                del self._last_heard[guid]
+                self.pool.release(guid)
+
+    def _deliver(
+        self, stream: list[VoicePacketView], future: asyncio.Future[list[bytes]]
+    ):
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.errors += 1
+            logger.error("Decoding failed: %s", future.exception())
+            return
+        for packet, pcm in zip(stream, future.result()):
+            self.output.put_nowait(
+                DecodedFrame(packet.guid, packet.packet_id, packet.frequencies, pcm)
+            )
+            self.decoded += 1
@@ -0,0 +1,238 @@
+"""
+Pre-recorded audio as a source of PCM frames to transmit.
+
+`AudioFileSource` memory-maps a WAV or raw PCM file instead of reading it in,
+so an hours long briefing costs no more RAM than a short one and many
+broadcasters of the same file share the page cache. When the file is already
+in the SRS format (16 kHz mono 16 bit), frames are zero-copy memoryview slices
+of the mapping. Anything else is downmixed and linearly resampled with NumPy a
+block of frames at a time, which needs NumPy installed. Higher sample rates
+are low-pass filtered first, so what's above 8 kHz doesn't alias.
+
+Iterating the source (sync or async) gives one fixed-duration frame at a time,
+with the last one padded with silence. With `loop` set it starts over from the
+top of the mapping when it reaches the end. Pacing is left to the transmit
+path, see `SrsClient.transmit_file`.
+"""
+
+from collections.abc import AsyncIterator, Iterator
+from dataclasses import dataclass
+import mmap
+import os
+import struct
+
+from .audio_codec import SRS_CHANNELS, SRS_SAMPLE_RATE
+from .pacing import AUDIO_FRAME_DURATION
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+_WAVE_FORMAT_PCM = 1
+_WAVE_FORMAT_IEEE_FLOAT = 3
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+_chunk_header = struct.Struct("<4sI")
+_fmt_struct = struct.Struct("<HHIIHH")
+
+# Output samples resampled per NumPy call, in frames
+_CONVERT_BLOCK_FRAMES = 25
+# Low-pass filter length when downsampling, in output samples
+_LOWPASS_ZERO_CROSSINGS = 8
+
+
+def _lowpass_kernel(ratio: float):
+    """Windowed sinc filter cutting off just below the SRS Nyquist frequency"""
+    cutoff = 0.45 / ratio  # In cycles per source sample
+    half = int(_LOWPASS_ZERO_CROSSINGS * ratio)
+    taps = np.arange(-half, half + 1)
+    kernel = np.sinc(2 * cutoff * taps) * np.hamming(len(taps))
+    return (kernel / kernel.sum()).astype(np.float32)
+
+
+class AudioFormatError(Exception):
+    """The audio file can't be read as PCM"""
+
+
+@dataclass(frozen=True)
+class PcmFormat:
+    sample_rate: int = SRS_SAMPLE_RATE
+    channels: int = SRS_CHANNELS
+    sample_width: int = 2  # Bytes. 2 is int16, 4 is float32
+    is_float: bool = False
+
+    @property
+    def frame_width(self) -> int:
+        """Bytes per sample across all channels"""
+        return self.sample_width * self.channels
+
+    @property
+    def dtype(self) -> str:
+        return "<f4" if self.is_float else "<i2"
+
+
+SRS_FORMAT = PcmFormat()
+
+
+def read_wav_header(data: memoryview) -> tuple[PcmFormat, int, int]:
+    """Format, offset and length of the sample data in a mapped WAV file"""
+    if len(data) < 12 or data[0:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise AudioFormatError("Not a RIFF WAVE file")
+
+    pcm_format = None
+    offset = 12
+    while offset + _chunk_header.size <= len(data):
+        chunk_id, chunk_length = _chunk_header.unpack_from(data, offset)
+        offset += _chunk_header.size
+        if chunk_id == b"fmt ":
+            tag, channels, rate, _, _, bits = _fmt_struct.unpack_from(data, offset)
+            if tag == _WAVE_FORMAT_EXTENSIBLE:
+                # The real format tag starts the subformat GUID
+                (tag,) = struct.unpack_from("<H", data, offset + 24)
+            if (tag, bits) == (_WAVE_FORMAT_PCM, 16):
+                pcm_format = PcmFormat(rate, channels, 2)
+            elif (tag, bits) == (_WAVE_FORMAT_IEEE_FLOAT, 32):
+                pcm_format = PcmFormat(rate, channels, 4, is_float=True)
+            else:
+                raise AudioFormatError(
+                    f"Unsupported WAV format {tag} with {bits} bit samples"
+                )
+        elif chunk_id == b"data":
+            if pcm_format is None:
+                raise AudioFormatError("WAV data chunk before fmt chunk")
+            # Streamed WAVs can leave the length unset
+            length = min(chunk_length, len(data) - offset)
+            return pcm_format, offset, length
+        # Chunks are padded to an even length
+        offset += chunk_length + (chunk_length & 1)
+
+    raise AudioFormatError("WAV file has no data chunk")
+
+
+class AudioFileSource:
+    """
+    Fixed-duration SRS format PCM frames from a WAV or raw PCM file. Raw files
+    are read as `raw_format` (SRS format by default); WAV files describe
+    themselves.
+    """
+
+    def __init__(
+        self,
+        path: str | os.PathLike,
+        loop: bool = False,
+        frame_duration: float = AUDIO_FRAME_DURATION,
+        raw_format: PcmFormat | None = None,
+    ):
+        self.path = path
+        self.loop = loop
+        self.frame_samples = round(SRS_SAMPLE_RATE * frame_duration)
+        self.frame_bytes = self.frame_samples * SRS_FORMAT.frame_width
+
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(self._mmap, "madvise"):
+            self._mmap.madvise(mmap.MADV_SEQUENTIAL)
+        self._view = memoryview(self._mmap)
+
+        if raw_format is None and self._view[0:4] == b"RIFF":
+            self.format, offset, length = read_wav_header(self._view)
+        else:
+            self.format = raw_format or SRS_FORMAT
+            offset, length = 0, len(self._view)
+        # Drop any partial sample at the end
+        length -= length % self.format.frame_width
+        self._samples = self._view[offset : offset + length]
+
+        if self.format != SRS_FORMAT and np is None:
+            raise AudioFormatError(
+                f"Converting {self.format} to the SRS format needs NumPy"
+            )
+
+    @property
+    def duration(self) -> float:
+        """Length of one pass through the file, in seconds"""
+        samples = len(self._samples) // self.format.frame_width
+        return samples / self.format.sample_rate
+
+    def __iter__(self) -> Iterator[memoryview | bytes]:
+        while True:
+            if self.format == SRS_FORMAT:
+                yield from self._slice_frames()
+            else:
+                yield from self._convert_frames()
+            if not self.loop:
+                return
+
+    async def __aiter__(self) -> AsyncIterator[memoryview | bytes]:
+        for frame in self:
+            yield frame
+
+    def close(self):
+        """
+        Unmap the file. Frames still referenced elsewhere keep the mapping
+        alive until they're let go of, instead of failing the close.
+        """
+        self._samples.release()
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Unmapped when the last frame view is garbage collected
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _slice_frames(self) -> Iterator[memoryview | bytes]:
+        samples = self._samples
+        frame_bytes = self.frame_bytes
+        whole = len(samples) - len(samples) % frame_bytes
+        for offset in range(0, whole, frame_bytes):
+            yield samples[offset : offset + frame_bytes]
+        if whole < len(samples):
+            yield bytes(samples[whole:]).ljust(frame_bytes, b"\0")
+
+    def _convert_frames(self) -> Iterator[memoryview | bytes]:
+        source = np.frombuffer(self._samples, dtype=self.format.dtype)
+        source = source.reshape(-1, self.format.channels)
+        if self.format.is_float:
+            scale = 32767.0
+        else:
+            scale = 1.0
+
+        ratio = self.format.sample_rate / SRS_SAMPLE_RATE
+        total = int(len(source) / ratio)
+        block = self.frame_samples * _CONVERT_BLOCK_FRAMES
+        kernel = _lowpass_kernel(ratio) if ratio > 1 else None
+
+        for start in range(0, total, block):
+            count = min(block, total - start)
+            # Source positions of the output samples, and the source samples
+            # that cover them
+            positions = (start + np.arange(count)) * ratio
+            first = int(positions[0])
+            last = min(int(positions[-1]) + 2, len(source))
+            if kernel is None:
+                mono = source[first:last].mean(axis=1, dtype=np.float32)
+            else:
+                # Filter with the source samples either side of the block too,
+                # so blocks join up
+                half = len(kernel) // 2
+                low = max(first - half, 0)
+                high = min(last + half, len(source))
+                mono = source[low:high].mean(axis=1, dtype=np.float32)
+                mono = np.convolve(mono, kernel, mode="same")
+                mono = mono[first - low : last - low]
+            resampled = np.interp(positions - first, np.arange(last - first), mono)
+
+            pcm = np.zeros(-(-count // self.frame_samples) * self.frame_samples, "<i2")
+            np.clip(resampled * scale, -32768, 32767, out=resampled)
+            pcm[:count] = resampled
+            converted = memoryview(pcm.tobytes())
+            for offset in range(0, len(converted), self.frame_bytes):
+                yield converted[offset : offset + self.frame_bytes]
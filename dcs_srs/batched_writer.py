@@ -0,0 +1,92 @@
+"""
+Writer thread that keeps file I/O off the event loop.
+
+`BatchedWriter` takes batches handed over from the loop with `submit`, and its
+thread passes them to a write function, every batch that's waiting at once, so
+a burst of them costs one write. What a batch is and when to hand one over is
+up to the owner. Memory is bounded: the owner `reserve`s room for what it
+buffers, and once more than max_buffered bytes are waiting to be written that's
+refused, for the owner to count as dropped.
+"""
+
+from collections.abc import Callable
+import logging
+import queue
+import threading
+from typing import Generic, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class BatchedWriter(Generic[T]):
+    def __init__(
+        self,
+        name: str,
+        write: Callable[[list[T]], None],
+        finish: Callable[[], None],
+        max_buffered: int,
+    ):
+        """
+        write is called on the writer thread with the batches waiting, and
+        finish once after the last of them, e.g. to close the file.
+        """
+        self.name = name
+        self.max_buffered = max_buffered
+        self._write = write
+        self._finish = finish
+
+        # Each only written from one thread, the difference is what's buffered
+        self._accepted_bytes = 0
+        self._written_bytes = 0
+
+        self._batches = queue.SimpleQueue[tuple[T, int] | None]()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def buffered_bytes(self) -> int:
+        """Bytes reserved but not yet written"""
+        return self._accepted_bytes - self._written_bytes
+
+    def reserve(self, size: int) -> bool:
+        """Count size more bytes as buffered, or return False if there's no room"""
+        if self.buffered_bytes + size > self.max_buffered:
+            return False
+        self._accepted_bytes += size
+        return True
+
+    def submit(self, batch: T, size: int):
+        """Hand a batch holding size reserved bytes to the writer thread"""
+        self._batches.put((batch, size))
+
+    def close(self):
+        """Write out everything submitted and finish. Blocks."""
+        self._batches.put(None)
+        self._thread.join()
+
+    #
+    # Writer thread
+    #
+    def _run(self):
+        try:
+            while (item := self._batches.get()) is not None:
+                # Take whatever else is waiting too, for one write
+                items = [item]
+                while True:
+                    try:
+                        item = self._batches.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        self._batches.put(None)
+                        break
+                    items.append(item)
+                try:
+                    self._write([batch for batch, _ in items])
+                except OSError:
+                    logger.exception(f"Failed writing {self.name}")
+                self._written_bytes += sum(size for _, size in items)
+        finally:
+            self._finish()
@@ -0,0 +1,294 @@
+"""
+Capture of everything a client sends and receives, and replay of captures.
+
+A `TrafficCapture` handed to `connect_tcp_json` and `connect_voice` (or to
+SrsClient) logs every JSON message line and UDP datagram in both directions
+to an append-only file:
+
+    file header: FILE_MAGIC, wall clock time capture started
+    record*: time since start in monotonic ns, kind, length, data
+
+Records are appended to an in-memory buffer that's handed to a
+`BatchedWriter` thread once it's big enough or every flush interval, so the
+loop never waits on the disk. Memory is bounded: once more than max_buffered
+bytes are waiting to be written, new records are counted in `dropped`
+instead. A capture cut short by a crash is readable up to its last whole
+record.
+
+`CaptureFile` reads a capture back, and `replay_capture` feeds its inbound
+messages and voice into a message handling queue and a voice receive queue at
+the captured pace, N times faster, or as fast as they're consumed. That makes
+profiling message handling and voice consumers against real traffic
+repeatable; `SrsClient.replay_capture` does it for a client, and
+
+    python -m dcs_srs.capture mission.cap --speed 0 --stats
+
+replays a capture as fast as possible and prints the stage timings.
+"""
+
+import argparse
+import asyncio
+from collections.abc import Iterator
+from dataclasses import asdict, dataclass
+from enum import IntEnum
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+
+from . import profiling
+from .batched_writer import BatchedWriter
+from .json_codec import JsonCodec, get_codec
+from .link_health import LinkHealth
+from .messages import NetworkMessage
+from .voice_batch import min_packet_length
+from .voice_packet import VoicePacketView
+
+logger = logging.getLogger(__name__)
+
+
+FILE_MAGIC = b"SRSCAP01"
+
+file_header_struct = struct.Struct("<8sd")
+record_struct = struct.Struct("<QBI")
+
+
+class RecordKind(IntEnum):
+    TCP_IN = 1
+    TCP_OUT = 2
+    UDP_IN = 3
+    UDP_OUT = 4
+
+
+class TrafficCapture:
+    def __init__(
+        self,
+        path: str | os.PathLike,
+        flush_bytes: int = 256 * 1024,
+        flush_interval: float = 1.0,
+        max_buffered: int = 64 * 1024 * 1024,
+    ):
+        self.path = path
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+
+        self.captured = 0
+        self.dropped = 0
+
+        self._started_ns = time.monotonic_ns()
+        self._flushed_ns = self._started_ns
+        self._buffer = bytearray()
+
+        self._file = open(path, "wb")
+        self._file.write(file_header_struct.pack(FILE_MAGIC, time.time()))
+        logger.info(f"Capturing traffic to {path}")
+
+        self._writer = BatchedWriter[bytearray](
+            "traffic-capture", self._write_chunks, self._file.close, max_buffered
+        )
+
+    @property
+    def buffered_bytes(self) -> int:
+        """Bytes captured but not yet written to disk"""
+        return self._writer.buffered_bytes
+
+    def record(self, kind: RecordKind, data: bytes | memoryview):
+        """Append one message line or datagram, copying it"""
+        now = time.monotonic_ns()
+        size = record_struct.size + len(data)
+        if not self._writer.reserve(size):
+            self.dropped += 1
+            return
+
+        buffer = self._buffer
+        buffer += record_struct.pack(now - self._started_ns, kind, len(data))
+        buffer += data
+        self.captured += 1
+
+        if (
+            len(buffer) >= self.flush_bytes
+            or now - self._flushed_ns >= self.flush_interval * 1e9
+        ):
+            self.flush()
+
+    def flush(self):
+        """Hand everything buffered so far to the writer thread"""
+        self._flushed_ns = time.monotonic_ns()
+        if self._buffer:
+            self._writer.submit(self._buffer, len(self._buffer))
+            self._buffer = bytearray()
+
+    def close(self):
+        """Write out what's buffered and close the file. Blocks."""
+        self.flush()
+        self._writer.close()
+
+    def _write_chunks(self, chunks: list[bytearray]):
+        # On the writer thread
+        self._file.write(b"".join(chunks))
+        self._file.flush()
+
+
+@dataclass(slots=True)
+class CapturedRecord:
+    time: float  # Seconds since the capture started
+    kind: RecordKind
+    data: memoryview
+
+
+class CaptureFile:
+    """
+    Read access to a capture. Record data is a view into the mapped file, so
+    it has to be let go of before closing.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data = memoryview(self._mmap)
+        if self._data[: len(FILE_MAGIC)] != FILE_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a traffic capture")
+        _, self.started_at = file_header_struct.unpack_from(self._data, 0)
+
+    def records(self) -> Iterator[CapturedRecord]:
+        data = self._data
+        offset = file_header_struct.size
+        while offset + record_struct.size <= len(data):
+            time_ns, kind, length = record_struct.unpack_from(data, offset)
+            start = offset + record_struct.size
+            if start + length > len(data):
+                # Cut short
+                return
+            yield CapturedRecord(
+                time_ns / 1e9, RecordKind(kind), data[start : start + length]
+            )
+            offset = start + length
+
+    def close(self):
+        self._data.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@dataclass
+class ReplayStats:
+    messages: int = 0
+    voice_packets: int = 0
+    captured_seconds: float = 0.0
+    elapsed: float = 0.0
+
+
+async def replay_capture(
+    path: str | os.PathLike,
+    message_queue: asyncio.Queue[NetworkMessage],
+    voice_receive_queue: asyncio.Queue[VoicePacketView],
+    codec: JsonCodec | None = None,
+    speed: float | None = 1.0,
+    health: LinkHealth | None = None,
+    yield_every: int = 64,
+) -> ReplayStats:
+    """
+    Put a capture's received messages and voice packets on the queues, as
+    the TCP and UDP connections would have. With a speed they're paced at
+    that many times the captured rate. With speed None they go as fast as
+    they're taken off the queues, yielding to the loop every yield_every
+    records and whenever a queue is full, so nothing is dropped.
+    """
+    if codec is None:
+        codec = get_codec()
+    loop = asyncio.get_running_loop()
+    stats = ReplayStats()
+    started = loop.time()
+
+    with CaptureFile(path) as capture:
+        for count, record in enumerate(capture.records()):
+            if record.kind is RecordKind.TCP_IN:
+                item = codec.loads(bytes(record.data))
+                target = message_queue
+                stats.messages += 1
+            elif record.kind is RecordKind.UDP_IN:
+                if len(record.data) < min_packet_length:
+                    # Keepalive echoes
+                    continue
+                try:
+                    # Copied, so packets can outlive the mapped file
+                    item = VoicePacketView(bytes(record.data))
+                    item.frequencies
+                except (struct.error, ValueError):
+                    # Dropped by the receiver when it was captured
+                    continue
+                if health is not None:
+                    health.datagram_received(len(record.data))
+                    health.voice_received(item.guid, item.packet_id)
+                target = voice_receive_queue
+                stats.voice_packets += 1
+            else:
+                continue
+            stats.captured_seconds = record.time
+
+            if speed is not None:
+                delay = started + record.time / speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                while target.full():
+                    await asyncio.sleep(0)
+                if count % yield_every == 0:
+                    await asyncio.sleep(0)
+            target.put_nowait(item)
+        # Let go of the last view into the file, so it can close
+        record = None
+
+    # Let the consumers catch up with the last of it
+    while not (message_queue.empty() and voice_receive_queue.empty()):
+        await asyncio.sleep(0)
+    await asyncio.sleep(0)
+
+    stats.elapsed = loop.time() - started
+    return stats
+
+
+async def main(path: str, speed: float | None, stats: bool):
+    from .client import SrsClient
+
+    if stats:
+        profiler = profiling.enable()
+    client = SrsClient("Replay", print_updates=False)
+    try:
+        replay_stats = await client.replay_capture(path, speed)
+    finally:
+        await client.disconnect()
+
+    print(json.dumps(asdict(replay_stats), indent=2))
+    if stats:
+        print(profiling.format_summary(profiler.take()))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Replay a traffic capture through an SrsClient"
+    )
+    parser.add_argument("path", help="Capture file")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="Times real time to replay at, 0 for as fast as possible",
+    )
+    parser.add_argument(
+        "--stats", action="store_true", help="Print per-stage timings at the end"
+    )
+    args = parser.parse_args()
+
+    asyncio.run(main(args.path, args.speed or None, args.stats))
@@ -7,10 +7,16 @@ server settings
 """
 
 import asyncio
-from collections import defaultdict
+import itertools
 import logging
+import os
 from pprint import pprint
+import time
+from typing import AsyncIterator, Collection
 
+from .audio_codec import CodecPool, DecodeStage
+from .audio_source import AudioFileSource
+from .capture import ReplayStats, TrafficCapture, replay_capture
 from .client_info import (
     ClientInfo,
     Coalition,
@@ -19,161 +25,520 @@ from .client_info import (
     make_radio_information,
     print_client_info,
 )
+from .client_state import ChangeKind, ClientChange, ClientStore
+from .dispatcher import MessageDispatcher
+from .frequency_index import FrequencyIndex
+from .jitter_buffer import JitterBufferStage
+from .json_codec import get_codec
+from .link_health import LinkHealth
 from .tcp_json_connection import connect_tcp_json
-from . import messages
+from . import messages, profiling
 from .messages import MessageType, NetworkMessage
+from .mixer import MixerStage
+from .pacing import AUDIO_FRAME_DURATION, FramePacer
+from .queues import QueueLimit, StageQueues
+from .recorder import VoiceRecorder
+from .shared_voice import SharedVoiceTransport
+from .update_scheduler import UpdateScheduler
 from .utils import Guid, make_short_guid
 from .voice_connection import connect_voice
+from .voice_packet import Frequency, VoicePacket
+from .voice_workers import VoiceWorkerPool
 
 logger = logging.getLogger(__name__)
 
 
+class VersionMismatchError(Exception):
+    """The SRS server doesn't support this client's version"""
+
+
 class SrsClient:
-    def __init__(self, name: str):
+    def __init__(
+        self,
+        name: str,
+        print_updates: bool = True,
+        queue_limits: dict[str, QueueLimit] | None = None,
+        json_codec: str | None = None,
+        update_window: float = 0.05,
+        batched_voice: bool = False,
+        capture: TrafficCapture | None = None,
+        voice_transport: SharedVoiceTransport | None = None,
+    ):
         self.guid = make_short_guid()
-        self.clients: dict[Guid, ClientInfo] = {
-            self.guid: default_client_info(self.guid)
-        }
+        self.clients = ClientStore(default_client_info(self.guid))
         self.server_settings: messages.ServerSettings = {}
 
+        # Kept up to date from client state change events
+        self.frequency_index = FrequencyIndex()
+        self.clients.subscribe(
+            self._update_frequency_index,
+            {ChangeKind.ADDED, ChangeKind.RADIO, ChangeKind.REMOVED},
+        )
+
         self.my_info["Name"] = name
+        self.clients.merge(self.my_info)
+        self.print_updates = print_updates
+
+        self.messages_sent = 0
+        self.messages_received = 0
+        self.voice_packets_sent = 0
+        self.voice_packets_received = 0
+
+        # Waits and subscriptions for received messages
+        self.dispatcher = MessageDispatcher()
+
+        # UDP keepalive round trips, traffic rates and per transmitter loss.
+        # Set link_health.metrics_callback to get a snapshot every second.
+        self.link_health = LinkHealth()
+
+        self.queues = StageQueues()
+        self.queues.limits.update(queue_limits or {})
+        # Read voice with the batched UDP receiver rather than a datagram
+        # endpoint, for busy servers
+        self.batched_voice = batched_voice
+        # Logs all traffic when set. Closing it is up to the caller.
+        self.capture = capture
+        # Voice socket shared with other clients, instead of one of our own.
+        # Closing it is up to the caller.
+        self.voice_transport = voice_transport
+        self._json_codec = get_codec(json_codec)
+
+        # Outbound UPDATE/RADIO_UPDATEs within this window are sent as one
+        self._updates = UpdateScheduler(
+            self._send_message, lambda: self.my_info, update_window
+        )
+        self._send_queue = None
 
-        self._message_futures: defaultdict[
-            MessageType, list[asyncio.Future[NetworkMessage]]
-        ] = defaultdict(list)
+        self._tasks: list[asyncio.Task] = []
+        self._voice_consumer_task = None
+        # Made up front so voice consumers can be set up before connecting
+        self._receive_voice_queue = self.queues.make("voice_receive")
+        self._send_voice_queue = self.queues.make("voice_send")
 
-        self._tcp_task = None
-        self._message_receive_task = None
+        # Remembered to log back in after a reconnect
+        self._awacs_password: str | None = None
+
+        # Packet ids keep counting up across transmissions
+        self._packet_ids = itertools.count()
 
     @property
     def my_info(self) -> ClientInfo:
-        return self.clients[self.guid]
+        return self.clients.local_info
 
     #
     # Public methods
     #
     async def connect(self, host: str, port: int):
-        """Connect to an SRS server"""
+        """
+        Connect to an SRS server. After a `close_connection` this picks up where
+        the last connection left off: the SYNC carries my radios, an AWACS log
+        in is redone, and voice consumers and transmissions carry on.
+        """
         logger.info(f"Connecting to SRS server {host}:{port}")
 
         # Start up tasks to handle TCP connection
-        receive_queue, self._send_queue = await connect_tcp_json(host, port)
-        self._message_receive_task = asyncio.create_task(
-            self._handle_messages(receive_queue)
+        receive_queue, self._send_queue, tcp_tasks = await connect_tcp_json(
+            host, port, self.queues, self._json_codec, self.capture
         )
+        self._tasks.extend(tcp_tasks)
+        self._tasks.append(asyncio.create_task(self._handle_messages(receive_queue)))
 
-        # Send sync message
+        # Send sync message, which carries any updates that were waiting
+        self._updates.cancel()
         logger.info("Sending Sync...")
-        await self._send_queue.put(messages.sync_message(self.my_info))
+        sync_reply = self.dispatcher.future(MessageType.SYNC)
+        await self._send_message(messages.sync_message(self.my_info))
         try:
-            await asyncio.wait_for(self._future_message(MessageType.SYNC), 5)
+            await asyncio.wait_for(sync_reply, 5)
         except TimeoutError:
+            await self.close_connection()
             raise TimeoutError("Timed out trying to log in")
+        except VersionMismatchError:
+            await self.close_connection()
+            raise
 
         logger.info("Connected")
         logger.info("Starting UDP voice connection")
+        self.link_health.reset()
+
+        if self.voice_transport is None:
+            (
+                self._receive_voice_queue,
+                self._send_voice_queue,
+                voice_tasks,
+            ) = await connect_voice(
+                (host, port),
+                self.guid,
+                self.queues,
+                self.link_health,
+                batched=self.batched_voice,
+                capture=self.capture,
+            )
+            self._tasks.extend(voice_tasks)
+        else:
+            self._send_voice_queue = self.voice_transport.send_queue
+            self._tasks.append(
+                asyncio.create_task(
+                    self.voice_transport.serve(
+                        self.guid,
+                        self.link_health,
+                        self._receive_voice_queue,
+                        self.clients.state(self.guid).tuned(),
+                        self.clients,
+                    )
+                )
+            )
 
-        self._receive_voice_queue, self._send_voice_queue = await connect_voice(
-            (host, port), self.guid
-        )
+        if self._voice_consumer_task is None:
+            self._voice_consumer_task = asyncio.create_task(self.drop_voice())
+
+        if self._awacs_password is not None:
+            if not await self.log_in_awacs(self._awacs_password):
+                logger.warning("Couldn't log back in to external AWACS mode")
+
+    async def disconnect(self):
+        """Close the TCP and UDP connections and stop all background tasks"""
+        await self.close_connection()
+
+        if self._voice_consumer_task is not None:
+            self._voice_consumer_task.cancel()
+            await asyncio.gather(self._voice_consumer_task, return_exceptions=True)
+        self._voice_consumer_task = None
+
+    async def close_connection(self):
+        """
+        Close the TCP and UDP connections but keep the voice consumer running
+        and all state, ready to `connect` again.
+        """
+        self._updates.cancel()
+        self._send_queue = None
+
+        tasks = self._tasks
+        self._tasks = []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def wait_connection_lost(self) -> str:
+        """
+        Wait until the TCP connection breaks or the voice link stops answering
+        keepalives, and return why
+        """
+        dead = asyncio.create_task(self.link_health.dead.wait())
+        try:
+            done, _ = await asyncio.wait(
+                [*self._tasks, dead], return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            dead.cancel()
 
-        asyncio.create_task(self.drop_voice())
+        if dead in done:
+            return "voice link stopped answering keepalives"
+        task = done.pop()
+        if task.cancelled():
+            return "connection task cancelled"
+        error = task.exception()
+        return "connection closed" if error is None else str(error)
 
     async def drop_voice(self):
         while True:
             voice_packet = await self._receive_voice_queue.get()
-            transmitter_name = self.clients.get(
-                voice_packet.guid, {"Name": "<UNKNOWN>"}
-            )["Name"]
-            logger.debug(f"Getting voice from {transmitter_name}!")
+            self.voice_packets_received += 1
+            if logger.isEnabledFor(logging.DEBUG):
+                transmitter = self.clients.state(voice_packet.guid)
+                transmitter_name = transmitter.name if transmitter else "<UNKNOWN>"
+                logger.debug("Getting voice from %s!", transmitter_name)
+
+    def receive_transmissions(self, **jitter_buffer_args) -> JitterBufferStage:
+        """
+        Stop dropping received voice and instead run it through a jitter
+        buffer. Iterate the returned stage to get each new transmission.
+        """
+        self._stop_voice_consumer()
+        stage = JitterBufferStage(self._receive_voice_queue, **jitter_buffer_args)
+        self._voice_consumer_task = asyncio.create_task(stage.run())
+        return stage
+
+    def decode_voice(self, pool: CodecPool) -> DecodeStage:
+        """
+        Stop dropping received voice and instead decode it on the codec pool.
+        Decoded frames come out on the returned stage's output queue.
+        """
+        self._stop_voice_consumer()
+        stage = DecodeStage(self._receive_voice_queue, pool)
+        self._voice_consumer_task = asyncio.create_task(stage.run())
+        return stage
+
+    def mix_voice(self, pool: CodecPool, **mixer_args) -> MixerStage:
+        """
+        Stop dropping received voice and instead decode it and mix it into
+        one PCM stream per frequency. See MixerStage for the arguments.
+        """
+        self._stop_voice_consumer()
+        decoder = DecodeStage(self._receive_voice_queue, pool)
+        mixer = MixerStage(decoder.output, **mixer_args)
+        self._voice_consumer_task = asyncio.create_task(
+            self._run_stages(decoder, mixer)
+        )
+        return mixer
+
+    def record_voice(
+        self, directory: str | os.PathLike, **recorder_args
+    ) -> VoiceRecorder:
+        """
+        Stop dropping received voice and instead record it all to segment
+        files in the directory.
+        """
+        self._stop_voice_consumer()
+        recorder = VoiceRecorder(directory, **recorder_args)
+        self._voice_consumer_task = asyncio.create_task(
+            recorder.run(self._receive_voice_queue)
+        )
+        return recorder
+
+    def process_voice(self, pool: VoiceWorkerPool) -> VoiceWorkerPool:
+        """
+        Stop dropping received voice and instead hand it to a pool of worker
+        processes. Starting and closing the pool is up to the caller.
+        """
+        self._stop_voice_consumer()
+        self._voice_consumer_task = asyncio.create_task(
+            pool.forward(self._receive_voice_queue)
+        )
+        return pool
+
+    async def replay_capture(
+        self, path: str | os.PathLike, speed: float | None = 1.0
+    ) -> ReplayStats:
+        """
+        Run the messages and voice received in a traffic capture through this
+        client as if they were arriving live, at the captured pace, `speed`
+        times as fast, or with speed None as fast as they can be handled. Use
+        it unconnected, with any voice consumer set up beforehand.
+        """
+        message_queue = self.queues.make("tcp_receive")
+        handler = asyncio.create_task(self._handle_messages(message_queue))
+        if self._voice_consumer_task is None:
+            self._voice_consumer_task = asyncio.create_task(self.drop_voice())
+        try:
+            return await replay_capture(
+                path,
+                message_queue,
+                self._receive_voice_queue,
+                self._json_codec,
+                speed,
+                self.link_health,
+            )
+        finally:
+            handler.cancel()
+            await asyncio.gather(handler, return_exceptions=True)
 
     async def log_in_awacs(self, password: str) -> bool:
         """Log in as AWACS"""
-        await self._send_queue.put(
-            messages.external_awacs_mode_password_message(
-                self.clients[self.guid], password
-            )
+        response = self.dispatcher.future(
+            MessageType.EXTERNAL_AWACS_MODE_PASSWORD, guid=self.guid
+        )
+        await self._send_message(
+            messages.external_awacs_mode_password_message(self.my_info, password)
         )
         try:
-            response = await asyncio.wait_for(
-                self._future_message(MessageType.EXTERNAL_AWACS_MODE_PASSWORD), 5
-            )
+            response = await asyncio.wait_for(response, 5)
         except TimeoutError:
             logger.error("Timed out trying to log in to external awacs mode")
             return False
 
         # On AWACS log in success, the client info will contain the new coalition
-        return response["Client"]["Coalition"] != Coalition.SPECTATOR
+        if response["Client"]["Coalition"] == Coalition.SPECTATOR:
+            return False
+        self._awacs_password = password
+        return True
 
     async def tune_radio(
-        self, radio_index: int, frequency: float, modulation: Modulation
+        self,
+        radio_index: int,
+        frequency: float,
+        modulation: Modulation,
+        flush: bool = False,
     ):
-        my_info = self.clients[self.guid]
+        """
+        Tune one of my radios. The server is told after the update window, in
+        one message with any other changes made meanwhile, or right away if
+        flush is set.
+        """
+        my_info = self.my_info
         my_info["RadioInfo"]["radios"][radio_index] = make_radio_information(
             frequency, modulation
         )
+        self.clients.merge(my_info)
 
-        await self._send_queue.put(messages.radio_update_message(my_info))
+        await self._request_update(MessageType.RADIO_UPDATE, flush)
 
-    async def transmit_audio(self, audio_stream, radio_index: int):
-        pass
+    async def set_position(
+        self, lat: float, lng: float, alt: float, flush: bool = False
+    ):
+        """Move my position, sent to the server like tune_radio"""
+        self.my_info["LatLngPosition"] = {"lat": lat, "lng": lng, "alt": alt}
+        self.clients.merge(self.my_info)
+
+        await self._request_update(MessageType.UPDATE, flush)
+
+    async def flush_updates(self):
+        """Send any pending radio or client updates now"""
+        await self._updates.flush()
+
+    def clients_on(self, frequency: float, modulation: Modulation) -> set[Guid]:
+        """GUIDs of all clients with a radio tuned to the given frequency"""
+        return self.frequency_index.clients_on(frequency, modulation)
+
+    async def transmit_audio(
+        self,
+        audio_stream: AsyncIterator[bytes],
+        radio_index: int | Collection[int],
+        frame_duration: float = AUDIO_FRAME_DURATION,
+    ) -> FramePacer:
+        """
+        Transmit encoded audio frames on one of my radios, or on several at
+        once if given a collection of radio indices. Every frame goes out as a
+        single packet carrying all of the radios' frequencies.
+
+        Frames are sent on a fixed monotonic clock schedule, one per
+        frame_duration. The radios' frequencies and modulations are read for
+        every frame so retuning mid-transmission takes effect right away.
+        Returns the pacer used, which has counts of frames sent and schedule
+        rebases.
+        """
+        pacer = FramePacer(frame_duration)
+        async for audio_frame in audio_stream:
+            await pacer.wait()
+            # Built after the wait, so a retune meanwhile goes out right away
+            voice_packet = VoicePacket(
+                # Packets outlive the stream in the send queue, so views (e.g.
+                # of a mapped file, passed through PcmCodec) are copied
+                bytes(audio_frame),
+                self.transmit_frequencies(radio_index),
+                self.my_info["RadioInfo"]["unitId"],
+                next(self._packet_ids),
+                self.guid,
+            )
+            await self._send_voice_queue.put(voice_packet)
+            self.voice_packets_sent += 1
+
+        return pacer
+
+    def transmit_frequencies(
+        self, radio_index: int | Collection[int]
+    ) -> list[Frequency]:
+        """
+        Frequencies a transmission on the given radios goes out on. Disabled
+        radios are left out, as are repeats of the same frequency.
+        """
+        if isinstance(radio_index, int):
+            radio_index = (radio_index,)
+        radios = self.my_info["RadioInfo"]["radios"]
+
+        frequencies = {}
+        for index in sorted(radio_index):
+            radio = radios[index]
+            modulation = Modulation(radio["modulation"])
+            if modulation == Modulation.DISABLED:
+                continue
+            encryption = radio["encKey"] if radio["enc"] else 0
+            frequencies.setdefault(
+                (radio["freq"], modulation),
+                Frequency(radio["freq"], modulation, encryption),
+            )
+        return list(frequencies.values())
+
+    async def transmit_pcm(
+        self,
+        pcm_stream: AsyncIterator[bytes],
+        radio_index: int | Collection[int],
+        pool: CodecPool,
+        frame_duration: float = AUDIO_FRAME_DURATION,
+    ) -> FramePacer:
+        """Encode PCM frames on the codec pool and transmit them"""
+        if not isinstance(radio_index, int):
+            radio_index = tuple(sorted(radio_index))
+        encoded = pool.encode_stream((self.guid, radio_index), pcm_stream)
+        return await self.transmit_audio(encoded, radio_index, frame_duration)
+
+    async def transmit_file(
+        self,
+        path: str | os.PathLike,
+        radio_index: int | Collection[int],
+        pool: CodecPool,
+        loop: bool = False,
+    ) -> FramePacer:
+        """
+        Broadcast a WAV or raw PCM file on one or more of my radios. With loop
+        set it repeats until cancelled.
+        """
+        with AudioFileSource(path, loop) as source:
+            return await self.transmit_pcm(source, radio_index, pool)
 
     #
     # Class internal methods
     #
-    def _future_message(
-        self, message_type: MessageType
-    ) -> asyncio.Future[NetworkMessage]:
-        """Future that completes when a message of the given type is received."""
-        future = asyncio.Future()
-        self._message_futures[message_type].append(future)
-        return future
+    async def _request_update(self, message_type: MessageType, flush: bool):
+        # Before connecting there's nobody to tell, the SYNC will carry it
+        if self._send_queue is not None:
+            await self._updates.request(message_type, flush)
+
+    def _stop_voice_consumer(self):
+        if self._voice_consumer_task is not None:
+            self._voice_consumer_task.cancel()
+
+    async def _run_stages(self, *stages):
+        await asyncio.gather(*(stage.run() for stage in stages))
+
+    async def _send_message(self, msg: NetworkMessage):
+        await self._send_queue.put(msg)
+        self.messages_sent += 1
 
     async def _handle_messages(self, receive_queue: asyncio.Queue[NetworkMessage]):
         """Take messages from receive queue forever."""
         while True:
             msg: NetworkMessage = await receive_queue.get()
+            profiler = profiling.active
+            if profiler is not None:
+                start = time.perf_counter_ns()
             msg_type = MessageType(msg["MsgType"])
+            self.messages_received += 1
 
             # Update SRS server state
             try:
                 match msg_type:
                     case MessageType.SYNC:
-                        sync_client_dict = {
-                            client["ClientGuid"]: client for client in msg["Clients"]
-                        }
-                        self.clients.update(sync_client_dict)
+                        # After a reconnect only what changed meanwhile is
+                        # applied, and clients who left are removed
+                        self.clients.reconcile(msg["Clients"])
                         self.server_settings.update(msg["ServerSettings"])
 
                         self._print_server_settings()
                         self._print_clients()
 
                     case MessageType.RADIO_UPDATE:
-                        updated_guid = msg["Client"]["ClientGuid"]
-                        if updated_guid in self.clients:
-                            self.clients[updated_guid].update(msg["Client"])
-                        else:
-                            self.clients[updated_guid] = msg["Client"]
+                        self.clients.merge(msg["Client"])
                         self._print_clients()
 
                     case MessageType.UPDATE:
-                        updated_guid = msg["Client"]["ClientGuid"]
-                        if updated_guid in self.clients:
-                            self.clients[updated_guid].update(msg["Client"])
-                        else:
-                            self.clients[updated_guid] = msg["Client"]
+                        self.clients.merge(msg["Client"])
                         self._print_clients()
 
                     case MessageType.CLIENT_DISCONNECT:
-                        disconnected_client = msg["Client"]["ClientGuid"]
-                        if disconnected_client in self.clients:
-                            del self.clients[disconnected_client]
+                        self.clients.remove(msg["Client"]["ClientGuid"])
                         self._print_clients()
 
                     case MessageType.VERSION_MISMATCH:
                         logger.error("SRS version mismatch")
-                        pprint(msg)
-                        exit()
+                        if self.print_updates:
+                            pprint(msg)
+
+                        # Fail anyone waiting on a reply, nothing else is coming
+                        self.dispatcher.fail_all(
+                            VersionMismatchError(msg.get("Version", ""))
+                        )
+                        return
 
                     case MessageType.EXTERNAL_AWACS_MODE_PASSWORD:
                         # Do nothing and don't print
@@ -191,17 +556,32 @@ class SrsClient:
                 logger.error(str(err))
                 pprint(msg)
 
-            # Trigger any waiting futures
-            for future in self._message_futures[msg_type]:
-                future.set_result(msg)
+            # Hand off to anyone waiting on or subscribed to this message
+            self.dispatcher.dispatch(msg)
+
+            if profiler is not None:
+                profiler.record("message_handling", start)
+
+    def _update_frequency_index(self, change: ClientChange):
+        if change.kind is ChangeKind.REMOVED:
+            self.frequency_index.remove_client(change.guid)
+        else:
+            state = self.clients.state(change.guid)
+            self.frequency_index.update_tuned(change.guid, state.tuned())
+            if change.guid == self.guid and self.voice_transport is not None:
+                self.voice_transport.retune(self.guid, state.tuned())
 
     def _print_clients(self):
+        if not self.print_updates:
+            return
         print("Current users:")
         for client in self.clients.values():
             print_client_info(client)
         print()
 
     def _print_server_settings(self):
+        if not self.print_updates:
+            return
         print("Current server settings:")
         pprint(self.server_settings)
         print()
@@ -0,0 +1,374 @@
+"""
+Compact storage of the state of every client on the server.
+
+A ClientInfo as it comes off the wire is a nest of a dozen dicts, and a busy
+server has a thousand of them. `ClientState` keeps the same information in a
+slotted object with radio settings packed into arrays and repeated strings
+interned. Merging in an update compares field by field and returns fine grained
+`ClientChange`s (radio 3 retuned, position moved, ...) instead of blindly
+replacing whole subtrees, and `ClientStore` hands those changes to subscribers.
+
+The wire `ClientInfo` form is rebuilt on demand, and `ClientStore` can be used
+like a read-only dict of them.
+"""
+
+from array import array
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from dataclasses import dataclass
+from enum import Enum
+import sys
+
+from .client_info import ClientInfo, Modulation
+from .utils import Guid
+
+
+class ChangeKind(Enum):
+    ADDED = "added"
+    REMOVED = "removed"
+    NAME = "name"
+    COALITION = "coalition"
+    SEAT = "seat"
+    ALLOW_RECORD = "allow_record"
+    UNIT = "unit"
+    RADIO = "radio"  # radio_index says which one
+    IFF = "iff"
+    AMBIENT = "ambient"
+    POSITION = "position"
+    OTHER = "other"  # Fields this model doesn't know about
+
+
+@dataclass(slots=True, frozen=True)
+class ClientChange:
+    guid: Guid
+    kind: ChangeKind
+    radio_index: int | None = None
+
+
+# Radio flag bits
+_ENCRYPTED = 1
+_RETRANSMIT = 2
+
+_CLIENT_KEYS = {
+    "Coalition",
+    "Name",
+    "ClientGuid",
+    "RadioInfo",
+    "LatLngPosition",
+    "AllowRecord",
+    "Seat",
+}
+_RADIO_INFO_KEYS = {"radios", "unit", "unitId", "iff", "ambient"}
+_RADIO_KEYS = {"enc", "encKey", "freq", "modulation", "secFreq", "retransmit"}
+_IFF_KEYS = ("control", "mode1", "mode2", "mode3", "mode4", "mic", "status")
+
+
+class ClientState:
+    __slots__ = (
+        "guid",
+        "name",
+        "coalition",
+        "seat",
+        "allow_record",
+        "unit",
+        "unit_id",
+        "frequencies",
+        "secondary_frequencies",
+        "modulations",
+        "encryption_keys",
+        "radio_flags",
+        "iff",
+        "ambient",
+        "position",
+        "extra",
+    )
+
+    def __init__(self, guid: Guid):
+        self.guid = guid
+        self.name = ""
+        self.coalition = 0
+        self.seat = 0
+        self.allow_record = True
+        self.unit = ""
+        self.unit_id = 0
+        self.frequencies = array("d")
+        self.secondary_frequencies = array("d")
+        self.modulations = array("B")
+        self.encryption_keys = array("H")
+        self.radio_flags = array("B")
+        self.iff: tuple | None = None
+        self.ambient: tuple[float, str] | None = None
+        self.position = (0.0, 0.0, 0.0)
+        # Any fields not modeled above, so nothing is lost going back to the
+        # wire format. Usually None.
+        self.extra: dict | None = None
+
+    @classmethod
+    def from_client_info(cls, info: ClientInfo) -> "ClientState":
+        state = cls(info["ClientGuid"])
+        state.merge(info)
+        return state
+
+    def merge(self, info: ClientInfo) -> list[ClientChange]:
+        """Apply a full or partial ClientInfo, returning what changed"""
+        changes: list[ClientChange] = []
+
+        def changed(kind: ChangeKind, radio_index: int | None = None):
+            changes.append(ClientChange(self.guid, kind, radio_index))
+
+        if "Name" in info and info["Name"] != self.name:
+            self.name = sys.intern(info["Name"])
+            changed(ChangeKind.NAME)
+        if "Coalition" in info and info["Coalition"] != self.coalition:
+            self.coalition = int(info["Coalition"])
+            changed(ChangeKind.COALITION)
+        if "Seat" in info and info["Seat"] != self.seat:
+            self.seat = info["Seat"]
+            changed(ChangeKind.SEAT)
+        if "AllowRecord" in info and info["AllowRecord"] != self.allow_record:
+            self.allow_record = info["AllowRecord"]
+            changed(ChangeKind.ALLOW_RECORD)
+
+        if "LatLngPosition" in info:
+            pos = info["LatLngPosition"]
+            position = (pos["lat"], pos["lng"], pos["alt"])
+            if position != self.position:
+                self.position = position
+                changed(ChangeKind.POSITION)
+
+        if "RadioInfo" in info:
+            self._merge_radio_info(info["RadioInfo"], changed)
+
+        extra = {k: v for k, v in info.items() if k not in _CLIENT_KEYS}
+        if extra:
+            self._merge_extra("client", extra, changed)
+
+        return changes
+
+    def _merge_radio_info(self, radio_info, changed):
+        if "unit" in radio_info or "unitId" in radio_info:
+            unit = radio_info.get("unit", self.unit)
+            unit_id = radio_info.get("unitId", self.unit_id)
+            if unit != self.unit or unit_id != self.unit_id:
+                self.unit = sys.intern(unit)
+                self.unit_id = unit_id
+                changed(ChangeKind.UNIT)
+
+        if "radios" in radio_info:
+            self._merge_radios(radio_info["radios"], changed)
+
+        if "iff" in radio_info:
+            iff = tuple(radio_info["iff"].get(key) for key in _IFF_KEYS)
+            if iff != self.iff:
+                self.iff = iff
+                changed(ChangeKind.IFF)
+
+        if "ambient" in radio_info:
+            ambient = radio_info["ambient"]
+            ambient = (ambient.get("vol", 1.0), sys.intern(ambient.get("abType", "")))
+            if ambient != self.ambient:
+                self.ambient = ambient
+                changed(ChangeKind.AMBIENT)
+
+        extra = {k: v for k, v in radio_info.items() if k not in _RADIO_INFO_KEYS}
+        if extra:
+            self._merge_extra("radio_info", extra, changed)
+
+    def _merge_radios(self, radios, changed):
+        count = len(radios)
+        if count != len(self.frequencies):
+            # Radio count changed, start over rather than resizing every array
+            self.frequencies = array("d", bytes(8 * count))
+            self.secondary_frequencies = array("d", bytes(8 * count))
+            self.modulations = array("B", [Modulation.DISABLED] * count)
+            self.encryption_keys = array("H", bytes(2 * count))
+            self.radio_flags = array("B", bytes(count))
+
+        radio_extra = []
+        for i, radio in enumerate(radios):
+            flags = (_ENCRYPTED if radio.get("enc") else 0) | (
+                _RETRANSMIT if radio.get("retransmit") else 0
+            )
+            new = (
+                radio.get("freq", 1.0),
+                radio.get("secFreq", 1.0),
+                radio.get("modulation", Modulation.DISABLED),
+                radio.get("encKey", 0),
+                flags,
+            )
+            old = (
+                self.frequencies[i],
+                self.secondary_frequencies[i],
+                self.modulations[i],
+                self.encryption_keys[i],
+                self.radio_flags[i],
+            )
+            if new != old:
+                (
+                    self.frequencies[i],
+                    self.secondary_frequencies[i],
+                    self.modulations[i],
+                    self.encryption_keys[i],
+                    self.radio_flags[i],
+                ) = new
+                changed(ChangeKind.RADIO, i)
+
+            if radio.keys() - _RADIO_KEYS:
+                radio_extra.append(
+                    (i, {k: v for k, v in radio.items() if k not in _RADIO_KEYS})
+                )
+
+        if radio_extra or (self.extra and "radios" in self.extra):
+            self._merge_extra("radios", dict(radio_extra), changed)
+
+    def _merge_extra(self, section: str, values: dict, changed):
+        if self.extra is None:
+            self.extra = {}
+        if self.extra.get(section) != values:
+            if values:
+                self.extra[section] = values
+            else:
+                del self.extra[section]
+            changed(ChangeKind.OTHER)
+
+    def tuned(self) -> Iterator[tuple[float, Modulation]]:
+        """(frequency, modulation) of every radio"""
+        return zip(self.frequencies, self.modulations)
+
+    def to_client_info(self) -> ClientInfo:
+        """Rebuild the wire format ClientInfo"""
+        extra = self.extra or {}
+        radio_extra = extra.get("radios", {})
+        radios = []
+        for i in range(len(self.frequencies)):
+            flags = self.radio_flags[i]
+            radio = {
+                "enc": bool(flags & _ENCRYPTED),
+                "encKey": self.encryption_keys[i],
+                "freq": self.frequencies[i],
+                "modulation": self.modulations[i],
+                "secFreq": self.secondary_frequencies[i],
+                "retransmit": bool(flags & _RETRANSMIT),
+            }
+            if i in radio_extra:
+                radio.update(radio_extra[i])
+            radios.append(radio)
+
+        radio_info = {"radios": radios, "unit": self.unit, "unitId": self.unit_id}
+        if self.iff is not None:
+            radio_info["iff"] = dict(zip(_IFF_KEYS, self.iff))
+        if self.ambient is not None:
+            vol, ab_type = self.ambient
+            radio_info["ambient"] = {"vol": vol, "abType": ab_type}
+        radio_info.update(extra.get("radio_info", {}))
+
+        lat, lng, alt = self.position
+        info = {
+            "Coalition": self.coalition,
+            "Name": self.name,
+            "ClientGuid": self.guid,
+            "RadioInfo": radio_info,
+            "LatLngPosition": {"lat": lat, "lng": lng, "alt": alt},
+            "AllowRecord": self.allow_record,
+            "Seat": self.seat,
+        }
+        info.update(extra.get("client", {}))
+        return info
+
+
+ChangeCallback = Callable[[ClientChange], None]
+
+
+class ClientStore(Mapping[Guid, ClientInfo]):
+    """
+    All known clients as compact ClientStates, readable as a mapping of GUID to
+    wire format ClientInfo (built on each access).
+
+    This client's own info is the exception: it's kept as a live ClientInfo
+    dict that can be edited in place, followed by `merge` to pick up the
+    changes.
+    """
+
+    def __init__(self, local_info: ClientInfo | None = None):
+        self._states: dict[Guid, ClientState] = {}
+        self._subscribers: list[tuple[ChangeCallback, frozenset | None]] = []
+
+        self.local_info = local_info
+        if local_info is not None:
+            self.merge(local_info)
+
+    def __getitem__(self, guid: Guid) -> ClientInfo:
+        if self.local_info is not None and guid == self.local_info["ClientGuid"]:
+            return self.local_info
+        return self._states[guid].to_client_info()
+
+    def __contains__(self, guid) -> bool:
+        return guid in self._states
+
+    def __iter__(self) -> Iterator[Guid]:
+        return iter(self._states)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def state(self, guid: Guid) -> ClientState | None:
+        return self._states.get(guid)
+
+    def states(self) -> Iterator[ClientState]:
+        return iter(self._states.values())
+
+    def subscribe(
+        self, callback: ChangeCallback, kinds: set[ChangeKind] | None = None
+    ):
+        """Call back with every change, or just changes of the given kinds"""
+        self._subscribers.append((callback, frozenset(kinds) if kinds else None))
+
+    def unsubscribe(self, callback: ChangeCallback):
+        self._subscribers = [s for s in self._subscribers if s[0] != callback]
+
+    def merge(self, info: ClientInfo) -> list[ClientChange]:
+        """Add a new client or apply an update to a known one"""
+        guid = info["ClientGuid"]
+        if self.local_info is not None and guid == self.local_info["ClientGuid"]:
+            if info is not self.local_info:
+                self.local_info.update(info)
+
+        state = self._states.get(guid)
+        if state is None:
+            state = self._states[guid] = ClientState.from_client_info(info)
+            changes = [ClientChange(guid, ChangeKind.ADDED)]
+        else:
+            changes = state.merge(info)
+
+        self._publish(changes)
+        return changes
+
+    def reconcile(self, infos: Iterable[ClientInfo]) -> list[ClientChange]:
+        """
+        Bring the store in line with a full list of clients, e.g. from a SYNC
+        after reconnecting: merge in each of them and remove anyone missing
+        from the list. Only the differences come out as changes.
+        """
+        changes = []
+        listed = set()
+        for info in infos:
+            listed.add(info["ClientGuid"])
+            changes += self.merge(info)
+
+        local_guid = None if self.local_info is None else self.local_info["ClientGuid"]
+        for guid in [guid for guid in self._states if guid not in listed]:
+            if guid != local_guid:
+                self.remove(guid)
+                changes.append(ClientChange(guid, ChangeKind.REMOVED))
+        return changes
+
+    def remove(self, guid: Guid) -> bool:
+        if self._states.pop(guid, None) is None:
+            return False
+        self._publish([ClientChange(guid, ChangeKind.REMOVED)])
+        return True
+
+    def _publish(self, changes: list[ClientChange]):
+        for callback, kinds in self._subscribers:
+            for change in changes:
+                if kinds is None or change.kind in kinds:
+                    callback(change)
@@ -0,0 +1,247 @@
+"""
+Routing of received TCP messages to whoever is waiting for them.
+
+Two ways to listen for a message type:
+
+- `wait_for` is a one-shot wait for the next message of a type, optionally
+  only one about a given client GUID and/or matching a predicate. The waiter
+  removes itself when it completes, times out or is cancelled.
+- `subscribe` is a persistent subscription, either calling back for every
+  message or, when no callback is given, returning an async iterator.
+
+Waiters and subscribers are kept per message type, and waiters for a client
+GUID per (type, GUID). Dispatching a message only touches the listeners for
+its type and client, and plain waiters are resolved in one go and removed, so
+the cost doesn't grow with how many unrelated listeners there are. Only
+waiters with an arbitrary predicate have to be checked one by one.
+"""
+
+import asyncio
+from collections import defaultdict
+from collections.abc import Callable
+import logging
+
+from .messages import MessageType, NetworkMessage
+from .queues import BoundedQueue, OverflowPolicy
+from .utils import Guid
+
+logger = logging.getLogger(__name__)
+
+
+MessagePredicate = Callable[[NetworkMessage], bool]
+MessageCallback = Callable[[NetworkMessage], None]
+
+
+class Subscription:
+    """
+    A persistent subscription to one message type. Iterate it for messages
+    if it was made without a callback, and close it to unsubscribe.
+    """
+
+    def __init__(
+        self,
+        dispatcher: "MessageDispatcher",
+        message_type: MessageType,
+        callback: MessageCallback | None,
+        predicate: MessagePredicate | None,
+        maxsize: int,
+    ):
+        self.message_type = message_type
+        self.closed = False
+        self._dispatcher = dispatcher
+        self._callback = callback
+        self._predicate = predicate
+        self._queue: BoundedQueue | None = None
+        if callback is None:
+            self._queue = BoundedQueue(maxsize, OverflowPolicy.DROP_OLDEST)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._dispatcher._subscriptions[self.message_type].pop(self, None)
+        if self._queue is not None:
+            self._queue.put_nowait(None)
+
+    def __aiter__(self):
+        if self._queue is None:
+            raise TypeError("Callback subscriptions can't be iterated")
+        return self
+
+    async def __anext__(self) -> NetworkMessage:
+        msg = await self._queue.get()
+        if msg is None:
+            raise StopAsyncIteration
+        return msg
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _deliver(self, msg: NetworkMessage):
+        if self._predicate is not None and not self._predicate(msg):
+            return
+        if self._callback is not None:
+            self._callback(msg)
+        else:
+            self._queue.put_nowait(msg)
+
+
+class MessageDispatcher:
+    def __init__(self):
+        # Waiters without a predicate, all resolved by the next message
+        self._waiters: defaultdict[
+            MessageType, set[asyncio.Future[NetworkMessage]]
+        ] = defaultdict(set)
+        # Waiters for messages about one client, with an optional predicate
+        self._client_waiters: defaultdict[
+            tuple[MessageType, Guid],
+            dict[asyncio.Future[NetworkMessage], MessagePredicate | None],
+        ] = defaultdict(dict)
+        # Waiters with a predicate, checked one by one
+        self._filtered_waiters: defaultdict[
+            MessageType, dict[asyncio.Future[NetworkMessage], MessagePredicate]
+        ] = defaultdict(dict)
+        # Dicts rather than sets so delivery order follows subscription order
+        self._subscriptions: defaultdict[
+            MessageType, dict[Subscription, None]
+        ] = defaultdict(dict)
+
+    async def wait_for(
+        self,
+        message_type: MessageType,
+        predicate: MessagePredicate | None = None,
+        timeout: float | None = None,
+        guid: Guid | None = None,
+    ) -> NetworkMessage:
+        """
+        Wait for the next message of a type, optionally one about the client
+        with the given GUID and/or one that matches the predicate. Raises
+        TimeoutError if none arrives in time.
+        """
+        return await asyncio.wait_for(
+            self.future(message_type, predicate, guid), timeout
+        )
+
+    def future(
+        self,
+        message_type: MessageType,
+        predicate: MessagePredicate | None = None,
+        guid: Guid | None = None,
+    ) -> asyncio.Future[NetworkMessage]:
+        """
+        Future for the next matching message of a type. It's removed from the
+        dispatcher when it completes or is cancelled.
+        """
+        future = asyncio.get_running_loop().create_future()
+        if guid is not None:
+            key = (message_type, guid)
+            self._client_waiters[key][future] = predicate
+            future.add_done_callback(
+                lambda f: self._discard_from(self._client_waiters, key, f)
+            )
+        elif predicate is not None:
+            self._filtered_waiters[message_type][future] = predicate
+            future.add_done_callback(
+                lambda f: self._discard_from(self._filtered_waiters, message_type, f)
+            )
+        else:
+            self._waiters[message_type].add(future)
+            future.add_done_callback(
+                lambda f: self._discard_from(self._waiters, message_type, f)
+            )
+        return future
+
+    def subscribe(
+        self,
+        message_type: MessageType,
+        callback: MessageCallback | None = None,
+        predicate: MessagePredicate | None = None,
+        maxsize: int = 1024,
+    ) -> Subscription:
+        """
+        Receive every message of a type (that matches the predicate). Without a
+        callback, iterate the returned subscription instead; it keeps up to
+        maxsize messages for a slow reader, dropping the oldest.
+        """
+        subscription = Subscription(self, message_type, callback, predicate, maxsize)
+        self._subscriptions[message_type][subscription] = None
+        return subscription
+
+    def dispatch(self, msg: NetworkMessage):
+        message_type = MessageType(msg["MsgType"])
+
+        waiters = self._waiters.pop(message_type, None)
+        if waiters:
+            for future in waiters:
+                if not future.done():
+                    future.set_result(msg)
+
+        if self._client_waiters:
+            guid = msg.get("Client", {}).get("ClientGuid")
+            client_waiters = self._client_waiters.get((message_type, guid))
+            if client_waiters:
+                self._resolve_filtered(client_waiters, msg)
+
+        filtered = self._filtered_waiters.get(message_type)
+        if filtered:
+            self._resolve_filtered(filtered, msg)
+
+        subscriptions = self._subscriptions.get(message_type)
+        if subscriptions:
+            for subscription in list(subscriptions):
+                try:
+                    subscription._deliver(msg)
+                except Exception:
+                    logger.exception("Error in %r subscriber", message_type)
+
+    def _resolve_filtered(
+        self,
+        waiters: dict[asyncio.Future[NetworkMessage], MessagePredicate | None],
+        msg: NetworkMessage,
+    ):
+        for future, predicate in list(waiters.items()):
+            if future.done():
+                continue
+            try:
+                matched = predicate is None or predicate(msg)
+            except Exception as err:
+                future.set_exception(err)
+                continue
+            if matched:
+                future.set_result(msg)
+
+    def fail_all(self, error: Exception):
+        """Fail every pending waiter and end every subscription"""
+        waiters = [f for fs in self._waiters.values() for f in fs]
+        waiters += [f for fs in self._client_waiters.values() for f in fs]
+        waiters += [f for fs in self._filtered_waiters.values() for f in fs]
+        for future in waiters:
+            if not future.done():
+                future.set_exception(error)
+        for subscriptions in list(self._subscriptions.values()):
+            for subscription in list(subscriptions):
+                subscription.close()
+
+    def pending(self) -> int:
+        """Number of waiters and subscriptions currently registered"""
+        return (
+            sum(len(w) for w in self._waiters.values())
+            + sum(len(w) for w in self._client_waiters.values())
+            + sum(len(w) for w in self._filtered_waiters.values())
+            + sum(len(s) for s in self._subscriptions.values())
+        )
+
+    @staticmethod
+    def _discard_from(waiters_by_key: dict, key, future: asyncio.Future):
+        waiters = waiters_by_key.get(key)
+        if waiters is None:
+            return
+        if isinstance(waiters, set):
+            waiters.discard(future)
+        else:
+            waiters.pop(future, None)
+        if not waiters:
+            del waiters_by_key[key]
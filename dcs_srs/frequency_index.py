@@ -0,0 +1,99 @@
+"""
+Index from tuned (frequency, modulation) to the clients tuned there.
+
+Kept up to date incrementally from the client's message handling so "who is on
+251.000 AM?" is a dict lookup instead of a scan over every radio of every
+client. Frequencies are bucketed by `tolerance` Hz so small floating point
+differences between clients still land in the same bucket; a lookup checks the
+bucket the frequency falls in and its neighbours, then filters on the exact
+tolerance.
+"""
+
+from collections import defaultdict
+from collections.abc import Iterable
+
+from .client_info import ClientInfo, Modulation
+from .utils import Guid
+
+# Radios at or below this are unused
+MIN_TUNED_FREQUENCY = 1.0
+
+FrequencyKey = tuple[int, Modulation]
+
+
+class FrequencyIndex:
+    def __init__(self, tolerance: float = 500.0):
+        self.tolerance = tolerance
+
+        # (bucket, modulation) -> exact frequency -> guids tuned to it
+        self._index: defaultdict[FrequencyKey, dict[float, set[Guid]]] = defaultdict(
+            dict
+        )
+        # guid -> keys it's in, so removing a client doesn't need a scan
+        self._client_keys: dict[Guid, set[tuple[FrequencyKey, float]]] = {}
+
+    def _key(self, frequency: float, modulation: Modulation) -> FrequencyKey:
+        return round(frequency / self.tolerance), modulation
+
+    def update_client(self, client: ClientInfo):
+        """Re-index one client from its current radio state"""
+        radios = client.get("RadioInfo", {}).get("radios", ())
+        self.update_tuned(
+            client["ClientGuid"],
+            ((radio["freq"], radio["modulation"]) for radio in radios),
+        )
+
+    def update_tuned(self, guid: Guid, radios: Iterable[tuple[float, Modulation]]):
+        """Re-index one client from the (frequency, modulation) of its radios"""
+        tuned = set()
+        for frequency, modulation in radios:
+            if frequency > MIN_TUNED_FREQUENCY and modulation != Modulation.DISABLED:
+                tuned.add((self._key(frequency, modulation), frequency))
+
+        previous = self._client_keys.get(guid, set())
+        if tuned == previous:
+            return
+
+        for key, frequency in previous - tuned:
+            self._discard(key, guid, frequency)
+        for key, frequency in tuned - previous:
+            self._index[key].setdefault(frequency, set()).add(guid)
+
+        if tuned:
+            self._client_keys[guid] = tuned
+        else:
+            self._client_keys.pop(guid, None)
+
+    def remove_client(self, guid: Guid):
+        for key, frequency in self._client_keys.pop(guid, ()):
+            self._discard(key, guid, frequency)
+
+    def clear(self):
+        self._index.clear()
+        self._client_keys.clear()
+
+    def _discard(self, key: FrequencyKey, guid: Guid, frequency: float):
+        frequencies = self._index.get(key)
+        if frequencies is None or frequency not in frequencies:
+            return
+        frequencies[frequency].discard(guid)
+        if not frequencies[frequency]:
+            del frequencies[frequency]
+        if not frequencies:
+            del self._index[key]
+
+    def clients_on(self, frequency: float, modulation: Modulation) -> set[Guid]:
+        """GUIDs of every client with a radio within tolerance of the frequency"""
+        bucket, modulation = self._key(frequency, modulation)
+        found = set()
+        for neighbour in (bucket - 1, bucket, bucket + 1):
+            frequencies = self._index.get((neighbour, modulation))
+            if not frequencies:
+                continue
+            for tuned_frequency, guids in frequencies.items():
+                if abs(tuned_frequency - frequency) <= self.tolerance:
+                    found |= guids
+        return found
+
+    def tuned_frequencies(self, guid: Guid) -> set[float]:
+        return {frequency for _, frequency in self._client_keys.get(guid, ())}
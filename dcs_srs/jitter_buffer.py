@@ -0,0 +1,209 @@
+"""
+Receive side jitter buffering.
+
+UDP voice packets can arrive late, out of order, twice or not at all. The stage
+here sits on the voice receive queue and keeps a small bounded buffer per
+transmitter GUID keyed on packet_id. Packets are reordered and de-duplicated in
+the buffer and released on a fixed playout clock once the target delay has
+passed, with gaps in the packet_id sequence released as explicit loss frames.
+
+Each run of packets from a transmitter becomes a `Transmission`, an async
+iterator of `PlayoutFrame`s. New transmissions are announced on the stage's
+`transmissions` queue. A transmission ends (and its buffer is freed) after the
+transmitter has been silent for `idle_timeout`, so a client vanishing mid-stream
+can't hold on to memory. The `transmissions` queue is bounded too: if nobody
+takes new transmissions off it, the oldest unclaimed ones are dropped.
+"""
+
+import asyncio
+from dataclasses import dataclass
+import logging
+
+from .pacing import AUDIO_FRAME_DURATION, FramePacer
+from .queues import BoundedQueue, OverflowPolicy
+from .utils import Guid
+from .voice_packet import VoicePacketView
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class PlayoutFrame:
+    packet_id: int
+    packet: VoicePacketView | None  # None if this packet was lost
+
+    @property
+    def lost(self) -> bool:
+        return self.packet is None
+
+
+class Transmission:
+    """Ordered frames from a single transmitter, released on the playout clock"""
+
+    def __init__(self, guid: Guid, max_pending: int):
+        self.guid = guid
+        self.received = 0
+        self.duplicates = 0
+        self.late = 0
+        self.lost = 0
+        self.overflowed = 0
+        self.ended = False
+
+        # A consumer that stops reading shouldn't grow memory, so drop its
+        # oldest pending frames to make room
+        self._frames = BoundedQueue(max_pending, OverflowPolicy.DROP_OLDEST)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> PlayoutFrame:
+        frame = await self._frames.get()
+        if frame is None:
+            raise StopAsyncIteration
+        return frame
+
+    @property
+    def consumer_dropped(self) -> int:
+        """Frames dropped because the consumer wasn't keeping up"""
+        return self._frames.dropped
+
+    def _emit(self, frame: PlayoutFrame | None):
+        self._frames.put_nowait(frame)
+
+    def _end(self):
+        self.ended = True
+        self._emit(None)
+
+
+class _TransmitterBuffer:
+    __slots__ = (
+        "transmission",
+        "packets",
+        "next_id",
+        "wait_ticks",
+        "idle_ticks",
+        "playing",
+    )
+
+    def __init__(self, transmission: Transmission, first_id: int, wait_ticks: int):
+        self.transmission = transmission
+        self.packets: dict[int, VoicePacketView] = {}
+        self.next_id = first_id
+        self.wait_ticks = wait_ticks
+        self.idle_ticks = 0
+        # Until playout starts, next_id is only the lowest id seen so far
+        self.playing = False
+
+
+class JitterBufferStage:
+    def __init__(
+        self,
+        voice_receive_queue: asyncio.Queue[VoicePacketView],
+        target_delay: float = 2 * AUDIO_FRAME_DURATION,
+        max_frames: int = 25,
+        idle_timeout: float = 0.5,
+        frame_duration: float = AUDIO_FRAME_DURATION,
+        max_transmissions: int = 64,
+    ):
+        self.voice_receive_queue = voice_receive_queue
+        self.frame_duration = frame_duration
+        self.max_frames = max_frames
+        self.target_ticks = max(0, round(target_delay / frame_duration))
+        self.idle_ticks = max(1, round(idle_timeout / frame_duration))
+
+        # Unclaimed transmissions each pin up to max_frames packets, so a stage
+        # that isn't being iterated drops the oldest of them
+        self.transmissions = BoundedQueue(
+            max_transmissions, OverflowPolicy.DROP_OLDEST, "transmissions"
+        )
+        self._buffers: dict[Guid, _TransmitterBuffer] = {}
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Transmission:
+        return await self.transmissions.get()
+
+    async def run(self):
+        """Receive packets and run the playout clock until cancelled"""
+        receive_task = asyncio.create_task(self._receive())
+        try:
+            await self._playout()
+        finally:
+            receive_task.cancel()
+            for buffer in self._buffers.values():
+                buffer.transmission._end()
+            self._buffers.clear()
+
+    async def _receive(self):
+        while True:
+            self.push(await self.voice_receive_queue.get())
+
+    def push(self, packet: VoicePacketView):
+        """Add a received packet to its transmitter's buffer"""
+        guid = packet.guid
+        packet_id = packet.packet_id
+
+        buffer = self._buffers.get(guid)
+        if buffer is None:
+            transmission = Transmission(guid, self.max_frames)
+            buffer = _TransmitterBuffer(transmission, packet_id, self.target_ticks)
+            self._buffers[guid] = buffer
+            self.transmissions.put_nowait(transmission)
+
+        transmission = buffer.transmission
+        if packet_id < buffer.next_id:
+            # The first packets can arrive out of order too. Before playout
+            # starts an earlier one moves the start back, as long as what's
+            # buffered still fits.
+            if buffer.playing or any(
+                i >= packet_id + self.max_frames for i in buffer.packets
+            ):
+                transmission.late += 1
+                return
+            buffer.next_id = packet_id
+        if packet_id in buffer.packets:
+            transmission.duplicates += 1
+            return
+
+        # Way ahead of playout, skip forward rather than buffering without bound
+        if packet_id >= buffer.next_id + self.max_frames:
+            buffer.next_id = packet_id - self.max_frames + 1
+            for stale_id in [i for i in buffer.packets if i < buffer.next_id]:
+                del buffer.packets[stale_id]
+                transmission.overflowed += 1
+
+        buffer.packets[packet_id] = packet
+        buffer.idle_ticks = 0
+        transmission.received += 1
+
+    def tick(self):
+        """Release at most one frame from every transmitter buffer"""
+        for guid, buffer in list(self._buffers.items()):
+            if buffer.wait_ticks > 0:
+                buffer.wait_ticks -= 1
+                continue
+            buffer.playing = True
+
+            transmission = buffer.transmission
+            packet = buffer.packets.pop(buffer.next_id, None)
+            if packet is not None:
+                transmission._emit(PlayoutFrame(buffer.next_id, packet))
+                buffer.next_id += 1
+            elif buffer.packets:
+                # Something later is already here, so this one is a gap
+                transmission._emit(PlayoutFrame(buffer.next_id, None))
+                transmission.lost += 1
+                buffer.next_id += 1
+            else:
+                buffer.idle_ticks += 1
+                if buffer.idle_ticks >= self.idle_ticks:
+                    logger.debug("Transmission from %s ended", guid)
+                    transmission._end()
+                    del self._buffers[guid]
+
+    async def _playout(self):
+        pacer = FramePacer(self.frame_duration)
+        while True:
+            await pacer.wait()
+            self.tick()
@@ -0,0 +1,89 @@
+"""
+JSON encoders/decoders for the TCP message connection.
+
+SYNC messages from big servers are hundreds of KB, so the JSON library matters.
+orjson or msgspec are used when installed, falling back to the standard library
+otherwise. All codecs go straight between objects and UTF-8 bytes with no
+intermediate str.
+"""
+
+import json
+from typing import Any, Protocol
+
+
+class JsonCodec(Protocol):
+    name: str
+
+    def dumps(self, obj: Any) -> bytes:
+        ...
+
+    def loads(self, data: bytes) -> Any:
+        ...
+
+
+class StdlibCodec:
+    name = "json"
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(separators=(",", ":"))
+
+    def dumps(self, obj: Any) -> bytes:
+        return self._encoder.encode(obj).encode()
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonCodec:
+    name = "orjson"
+
+    def __init__(self):
+        import orjson
+
+        self.dumps = orjson.dumps
+        self.loads = orjson.loads
+
+
+class MsgspecCodec:
+    name = "msgspec"
+
+    def __init__(self):
+        import msgspec
+
+        self.dumps = msgspec.json.Encoder().encode
+        self.loads = msgspec.json.Decoder().decode
+
+
+# In order of preference
+CODECS: dict[str, type] = {
+    OrjsonCodec.name: OrjsonCodec,
+    MsgspecCodec.name: MsgspecCodec,
+    StdlibCodec.name: StdlibCodec,
+}
+
+
+def get_codec(name: str | None = None) -> JsonCodec:
+    """
+    Get a codec by name, or the fastest one available if no name is given.
+    Raises ImportError if the named codec's library isn't installed.
+    """
+    if name is not None:
+        return CODECS[name]()
+
+    for codec in CODECS.values():
+        try:
+            return codec()
+        except ImportError:
+            continue
+    raise AssertionError("The stdlib codec is always available")
+
+
+def available_codecs() -> list[str]:
+    names = []
+    for name, codec in CODECS.items():
+        try:
+            codec()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
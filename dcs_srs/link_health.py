@@ -0,0 +1,245 @@
+"""
+Health of the UDP voice link.
+
+The server echoes every 22 byte keepalive ping straight back, which is the only
+way to tell the voice link works before someone talks. `LinkHealth` times
+those echoes for the round trip time, counts datagrams and bytes both ways,
+and infers loss and reordering per transmitter from gaps in packet ids.
+
+The keepalive period adapts: it backs off towards max_keepalive while echoes
+keep coming back, and drops to min_keepalive as soon as one goes missing. After
+dead_after_missed missed echoes in a row the link is considered dead, which
+with the defaults is noticed within about ten seconds.
+
+`snapshot()` is cheap enough to call whenever; rates in it are over the last
+metrics interval. A metrics callback, if set, gets a snapshot every interval.
+"""
+
+import asyncio
+from collections.abc import Callable
+from dataclasses import dataclass, field, replace
+import logging
+import time
+
+from .utils import Guid
+
+logger = logging.getLogger(__name__)
+
+
+# Transmitters not heard from for this long are forgotten
+TRANSMITTER_TIMEOUT = 60.0
+# A packet id this far behind the newest is a new run of ids, not reordering
+PACKET_ID_RESTART = 1000
+
+
+@dataclass(slots=True)
+class TransmitterStats:
+    received: int = 0
+    lost: int = 0  # Gaps in packet ids not (yet) filled in
+    reordered: int = 0
+    highest_packet_id: int = -1
+    last_heard: float = 0.0
+
+    @property
+    def loss_ratio(self) -> float:
+        expected = self.received + self.lost
+        return self.lost / expected if expected else 0.0
+
+
+@dataclass(frozen=True, slots=True)
+class LinkSnapshot:
+    alive: bool
+    rtt: float | None  # Last keepalive round trip, in seconds
+    rtt_average: float | None
+    since_last_echo: float | None
+    keepalive_period: float
+    missed_echoes: int
+    packets_in: int
+    bytes_in: int
+    packets_out: int
+    bytes_out: int
+    packets_in_per_second: float
+    bytes_in_per_second: float
+    packets_out_per_second: float
+    bytes_out_per_second: float
+    transmitters: dict[Guid, TransmitterStats] = field(default_factory=dict)
+
+
+MetricsCallback = Callable[[LinkSnapshot], None]
+
+
+class LinkHealth:
+    def __init__(
+        self,
+        min_keepalive: float = 1.0,
+        max_keepalive: float = 5.0,
+        echo_timeout: float = 1.0,
+        dead_after_missed: int = 3,
+        metrics_interval: float = 1.0,
+        metrics_callback: MetricsCallback | None = None,
+    ):
+        self.min_keepalive = min_keepalive
+        self.max_keepalive = max_keepalive
+        self.echo_timeout = echo_timeout
+        self.dead_after_missed = dead_after_missed
+        self.metrics_interval = metrics_interval
+        self.metrics_callback = metrics_callback
+
+        self.keepalive_period = min_keepalive
+        self.missed_echoes = 0
+        self.rtt: float | None = None
+        self.rtt_average: float | None = None
+        self.last_echo: float | None = None
+        # Set while the link looks dead, cleared when an echo comes back
+        self.dead = asyncio.Event()
+
+        self.packets_in = 0
+        self.bytes_in = 0
+        self.packets_out = 0
+        self.bytes_out = 0
+        self.transmitters: dict[Guid, TransmitterStats] = {}
+
+        self._ping_sent_at: float | None = None
+        self._echoed = asyncio.Event()
+        self._rates = (0.0, 0.0, 0.0, 0.0)
+        self._rate_sample = (time.monotonic(), 0, 0, 0, 0)
+
+    #
+    # Hooks for the voice connection
+    #
+    def datagram_received(self, size: int):
+        self.packets_in += 1
+        self.bytes_in += size
+
+    def datagram_sent(self, size: int):
+        self.packets_out += 1
+        self.bytes_out += size
+
+    def ping_sent(self):
+        self._ping_sent_at = time.monotonic()
+        self._echoed.clear()
+
+    def echo_received(self):
+        now = time.monotonic()
+        self.last_echo = now
+        if self._ping_sent_at is not None:
+            self.rtt = now - self._ping_sent_at
+            if self.rtt_average is None:
+                self.rtt_average = self.rtt
+            else:
+                self.rtt_average += (self.rtt - self.rtt_average) / 8
+            self._ping_sent_at = None
+        self._echoed.set()
+
+        self.missed_echoes = 0
+        self.keepalive_period = min(2 * self.keepalive_period, self.max_keepalive)
+        if self.dead.is_set():
+            logger.info("Voice link is back")
+            self.dead.clear()
+
+    def echo_missed(self):
+        self._ping_sent_at = None
+        self.missed_echoes += 1
+        self.keepalive_period = self.min_keepalive
+        if self.missed_echoes >= self.dead_after_missed and not self.dead.is_set():
+            logger.warning(
+                f"Voice link looks dead, {self.missed_echoes} keepalives unanswered"
+            )
+            self.dead.set()
+
+    def voice_received(self, guid: Guid, packet_id: int):
+        stats = self.transmitters.get(guid)
+        if stats is None:
+            stats = self.transmitters[guid] = TransmitterStats()
+        stats.received += 1
+        stats.last_heard = time.monotonic()
+
+        highest = stats.highest_packet_id
+        if packet_id > highest or packet_id < highest - PACKET_ID_RESTART:
+            if highest >= 0 and packet_id > highest:
+                stats.lost += packet_id - highest - 1
+            stats.highest_packet_id = packet_id
+        elif packet_id < highest:
+            stats.reordered += 1
+            # Most likely fills in a gap counted as lost
+            if stats.lost:
+                stats.lost -= 1
+
+    def reset(self):
+        """Start over on a new connection, keeping the traffic counters"""
+        self.keepalive_period = self.min_keepalive
+        self.missed_echoes = 0
+        self._ping_sent_at = None
+        self._echoed.clear()
+        self.dead.clear()
+
+    async def wait_for_echo(self) -> bool:
+        """Wait up to echo_timeout for an echo of the last ping"""
+        try:
+            await asyncio.wait_for(self._echoed.wait(), self.echo_timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    #
+    # Reporting
+    #
+    def update(self):
+        """Recompute rates over the time since the last update"""
+        now = time.monotonic()
+        then, packets_in, bytes_in, packets_out, bytes_out = self._rate_sample
+        elapsed = now - then
+        if elapsed > 0:
+            self._rates = (
+                (self.packets_in - packets_in) / elapsed,
+                (self.bytes_in - bytes_in) / elapsed,
+                (self.packets_out - packets_out) / elapsed,
+                (self.bytes_out - bytes_out) / elapsed,
+            )
+        self._rate_sample = (
+            now,
+            self.packets_in,
+            self.bytes_in,
+            self.packets_out,
+            self.bytes_out,
+        )
+
+        for guid, stats in list(self.transmitters.items()):
+            if now - stats.last_heard > TRANSMITTER_TIMEOUT:
+                del self.transmitters[guid]
+
+    def snapshot(self) -> LinkSnapshot:
+        packets_in_rate, bytes_in_rate, packets_out_rate, bytes_out_rate = self._rates
+        return LinkSnapshot(
+            alive=not self.dead.is_set(),
+            rtt=self.rtt,
+            rtt_average=self.rtt_average,
+            since_last_echo=(
+                None if self.last_echo is None else time.monotonic() - self.last_echo
+            ),
+            keepalive_period=self.keepalive_period,
+            missed_echoes=self.missed_echoes,
+            packets_in=self.packets_in,
+            bytes_in=self.bytes_in,
+            packets_out=self.packets_out,
+            bytes_out=self.bytes_out,
+            packets_in_per_second=packets_in_rate,
+            bytes_in_per_second=bytes_in_rate,
+            packets_out_per_second=packets_out_rate,
+            bytes_out_per_second=bytes_out_rate,
+            transmitters={
+                guid: replace(stats) for guid, stats in self.transmitters.items()
+            },
+        )
+
+
+async def report_link_health(health: LinkHealth):
+    """Update rates and hand snapshots to the metrics callback, forever"""
+    while True:
+        await asyncio.sleep(health.metrics_interval)
+        health.update()
+        if health.metrics_callback is not None:
+            try:
+                health.metrics_callback(health.snapshot())
+            except Exception:
+                logger.exception("Error in link metrics callback")
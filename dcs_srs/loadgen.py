@@ -0,0 +1,226 @@
+"""
+Load generator for capacity testing SRS servers.
+
+Runs many simulated clients built on SrsClient. Clients are sharded across
+worker processes and all clients of one worker share that worker's event loop.
+Each client follows a scripted mix of connecting, retuning, transmitting voice
+bursts and disconnecting/reconnecting until the test duration is up.
+
+    python -m dcs_srs.loadgen 127.0.0.1 --clients 400 --workers 4 --duration 60
+"""
+
+import argparse
+import asyncio
+from dataclasses import asdict, dataclass, field
+import json
+import logging
+import multiprocessing
+import random
+import statistics
+import time
+
+from .client import SrsClient
+from .client_info import Modulation
+from .utils import run
+
+logger = logging.getLogger(__name__)
+
+
+# An Opus frame of silence, enough to exercise the voice path
+SILENT_OPUS_FRAME = b"\xf8\xff\xfe"
+
+
+@dataclass
+class LoadScript:
+    duration: float = 60.0
+    ramp_up: float = 10.0  # Spread client start times over this long
+    tune_interval: float = 10.0  # Mean seconds between retunes
+    voice_interval: float = 20.0  # Mean seconds between voice bursts
+    voice_burst_frames: int = 50
+    reconnect_probability: float = 0.05  # Chance per action to drop and reconnect
+    frequencies: list[float] = field(
+        default_factory=lambda: [251e6, 243e6, 260e6, 305e6, 121.5e6]
+    )
+
+
+@dataclass
+class WorkerResults:
+    connect_latencies: list[float] = field(default_factory=list)
+    connect_failures: int = 0
+    session_failures: int = 0
+    messages_sent: int = 0
+    messages_received: int = 0
+    voice_packets_sent: int = 0
+    voice_packets_received: int = 0
+    elapsed: float = 0.0
+
+
+async def silent_audio(frames: int):
+    for _ in range(frames):
+        yield SILENT_OPUS_FRAME
+
+
+async def simulate_client(
+    name: str,
+    host: str,
+    port: int,
+    script: LoadScript,
+    results: WorkerResults,
+    stop_at: float,
+):
+    # Whatever goes wrong with one client (refused, version mismatch, a bad
+    # message) is counted and retried, it mustn't end the rest of the shard
+    while time.monotonic() < stop_at:
+        client = SrsClient(name, print_updates=False)
+        start = time.monotonic()
+        try:
+            await client.connect(host, port)
+        except Exception as err:
+            logger.warning("%s failed to connect: %r", name, err)
+            results.connect_failures += 1
+            await client.disconnect()
+            await asyncio.sleep(1)
+            continue
+        results.connect_latencies.append(time.monotonic() - start)
+
+        try:
+            await client.tune_radio(1, random.choice(script.frequencies), Modulation.AM)
+            await _run_actions(client, script, stop_at)
+        except Exception as err:
+            logger.warning("%s failed: %r", name, err)
+            results.session_failures += 1
+            await asyncio.sleep(1)
+        finally:
+            await client.disconnect()
+            results.messages_sent += client.messages_sent
+            results.messages_received += client.messages_received
+            results.voice_packets_sent += client.voice_packets_sent
+            results.voice_packets_received += client.voice_packets_received
+
+
+async def _run_actions(client: SrsClient, script: LoadScript, stop_at: float):
+    """Retune and transmit at random until it's time to stop or reconnect"""
+    action_rate = 1 / script.tune_interval + 1 / script.voice_interval
+    tune_share = (1 / script.tune_interval) / action_rate
+    while True:
+        delay = random.expovariate(action_rate)
+        if time.monotonic() + delay >= stop_at:
+            await asyncio.sleep(max(0.0, stop_at - time.monotonic()))
+            return
+        await asyncio.sleep(delay)
+
+        if random.random() < script.reconnect_probability:
+            return
+
+        if random.random() < tune_share:
+            await client.tune_radio(1, random.choice(script.frequencies), Modulation.AM)
+        else:
+            await client.transmit_audio(silent_audio(script.voice_burst_frames), 1)
+
+
+async def run_clients(
+    first_index: int, count: int, host: str, port: int, script: LoadScript
+) -> WorkerResults:
+    """Run a shard of simulated clients on the current event loop"""
+    results = WorkerResults()
+    start = time.monotonic()
+    stop_at = start + script.duration
+
+    async def delayed_client(index: int):
+        await asyncio.sleep(random.uniform(0, script.ramp_up))
+        await simulate_client(f"LoadGen-{index}", host, port, script, results, stop_at)
+
+    await asyncio.gather(*(delayed_client(first_index + i) for i in range(count)))
+    results.elapsed = time.monotonic() - start
+    return results
+
+
+def _worker(
+    first_index: int, count: int, host: str, port: int, script: LoadScript
+) -> WorkerResults:
+    logging.basicConfig(level=logging.WARNING)
+    return run(run_clients(first_index, count, host, port, script))
+
+
+def run_load(
+    host: str, port: int, clients: int, workers: int, script: LoadScript
+) -> dict:
+    """Run the load test across worker processes and summarize the results"""
+    if workers < 1 or clients < 1:
+        raise ValueError(f"Can't run {clients} clients on {workers} workers")
+    shards = [clients // workers + (i < clients % workers) for i in range(workers)]
+    starts = [sum(shards[:i]) for i in range(workers)]
+    with multiprocessing.Pool(workers) as pool:
+        worker_results = pool.starmap(
+            _worker,
+            [
+                (start, count, host, port, script)
+                for start, count in zip(starts, shards)
+                if count
+            ],
+        )
+    return summarize(worker_results)
+
+
+def summarize(worker_results: list[WorkerResults]) -> dict:
+    latencies = [t for r in worker_results for t in r.connect_latencies]
+    elapsed = max(r.elapsed for r in worker_results)
+
+    def total(field_name: str) -> int:
+        return sum(getattr(r, field_name) for r in worker_results)
+
+    summary = {
+        "connects": len(latencies),
+        "connect_failures": total("connect_failures"),
+        "session_failures": total("session_failures"),
+        "elapsed_s": elapsed,
+        "messages_per_s": (total("messages_sent") + total("messages_received"))
+        / elapsed,
+        "udp_sent_per_s": total("voice_packets_sent") / elapsed,
+        "udp_received_per_s": total("voice_packets_received") / elapsed,
+    }
+    if len(latencies) >= 2:
+        percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        summary["connect_p50_ms"] = percentiles[49] * 1000
+        summary["connect_p90_ms"] = percentiles[89] * 1000
+        summary["connect_p99_ms"] = percentiles[98] * 1000
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run many simulated SRS clients against a server"
+    )
+    parser.add_argument("host", help="Hostname or IP address of the SRS server")
+    parser.add_argument("--port", "-p", type=int, default=5002)
+    parser.add_argument("--clients", "-n", type=int, default=100)
+    parser.add_argument("--workers", "-w", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=LoadScript.duration)
+    parser.add_argument("--ramp-up", type=float, default=LoadScript.ramp_up)
+    parser.add_argument("--tune-interval", type=float, default=LoadScript.tune_interval)
+    parser.add_argument(
+        "--voice-interval", type=float, default=LoadScript.voice_interval
+    )
+    parser.add_argument(
+        "--reconnect-probability",
+        type=float,
+        default=LoadScript.reconnect_probability,
+    )
+    args = parser.parse_args()
+    if args.workers < 1 or args.clients < 1:
+        parser.error("--workers and --clients must be at least 1")
+
+    script = LoadScript(
+        duration=args.duration,
+        ramp_up=args.ramp_up,
+        tune_interval=args.tune_interval,
+        voice_interval=args.voice_interval,
+        reconnect_probability=args.reconnect_probability,
+    )
+    print(json.dumps(asdict(script), indent=2))
+    print(
+        json.dumps(
+            run_load(args.host, args.port, args.clients, args.workers, script),
+            indent=2,
+        )
+    )
@@ -93,6 +93,13 @@ def sync_message(client_info: ClientInfo) -> NetworkMessage:
     }
 
 
+def update_message(client_info: ClientInfo) -> NetworkMessage:
+    return {
+        "MsgType": MessageType.UPDATE,
+        "Client": client_info,
+    }
+
+
 def radio_update_message(client_info: ClientInfo) -> NetworkMessage:
     return {
         "MsgType": MessageType.RADIO_UPDATE,
@@ -0,0 +1,264 @@
+"""
+Mixing of decoded voice into one PCM stream per frequency.
+
+Several clients can talk on a frequency at once, and each arrives as its own
+stream of decoded frames. `MixerStage` takes `DecodedFrame`s (see
+`audio_codec.DecodeStage`), files them per (frequency, modulation) and per
+talker, and on a fixed playout clock releases one frame from every talker,
+sums them and puts the result on that frequency's `MixedChannel`.
+
+Each tick is a handful of NumPy calls no matter how many frequencies and
+talkers there are: every talker's frame goes into one 2D array, rows are
+summed per channel with `np.add.reduceat`, and the automatic gain control and
+clipping run on the whole result at once. The AGC drops the gain right away
+when the mix would clip and lets it recover slowly. Needs NumPy.
+
+Frames are mixed in the order they arrive. A talker's frames that are older
+than one already queued (late or repeated packet_ids) are dropped, but gaps
+aren't concealed or waited for: reordering and loss are left to what feeds the
+mixer, e.g. decoding what a `JitterBufferStage` plays out.
+
+When mixing every frequency heard, a channel that's had nobody talking on it
+for channel_timeout is removed and its iteration ends.
+"""
+
+import asyncio
+from collections import deque
+from collections.abc import Iterable
+import logging
+
+from .audio_codec import SRS_SAMPLE_RATE, DecodedFrame
+from .client_info import Modulation
+from .pacing import AUDIO_FRAME_DURATION, FramePacer
+from .queues import BoundedQueue, OverflowPolicy
+from .utils import Guid
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+ChannelKey = tuple[float, Modulation]
+
+# Peak level the AGC aims to keep the mix under
+AGC_LIMIT = 0.9 * 32767
+
+
+class _Talker:
+    __slots__ = ("frames", "wait_ticks", "idle_ticks", "last_id")
+
+    def __init__(self, max_frames: int, wait_ticks: int):
+        self.frames: deque[bytes] = deque(maxlen=max_frames)
+        self.wait_ticks = wait_ticks
+        self.idle_ticks = 0
+        self.last_id = -1
+
+
+class MixedChannel:
+    """One frequency's mixed PCM, a frame per playout tick"""
+
+    def __init__(self, frequency: float, modulation: Modulation, max_pending: int):
+        self.frequency = frequency
+        self.modulation = modulation
+        self.gain = 1.0
+        self.frames = 0
+        self.clipped = 0  # Samples clipped even after gain control
+        self.late = 0  # Frames older than one already queued from their talker
+        self.ended = False
+
+        self._talkers: dict[Guid, _Talker] = {}
+        self._idle_ticks = 0
+        # Drop the oldest mixed audio if the consumer doesn't keep up
+        self._output = BoundedQueue(max_pending, OverflowPolicy.DROP_OLDEST)
+
+    @property
+    def talkers(self) -> int:
+        return len(self._talkers)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> bytes:
+        pcm = await self._output.get()
+        if pcm is None:
+            raise StopAsyncIteration
+        return pcm
+
+    def _emit(self, pcm: bytes):
+        self._output.put_nowait(pcm)
+        self.frames += 1
+
+    def _end(self):
+        self.ended = True
+        self._output.put_nowait(None)
+
+
+class MixerStage:
+    def __init__(
+        self,
+        decoded_queue: asyncio.Queue[DecodedFrame],
+        frequencies: Iterable[ChannelKey] | None = None,
+        target_delay: float = 2 * AUDIO_FRAME_DURATION,
+        max_frames: int = 25,
+        idle_timeout: float = 0.5,
+        frame_duration: float = AUDIO_FRAME_DURATION,
+        sample_rate: int = SRS_SAMPLE_RATE,
+        agc: bool = True,
+        agc_release: float = 0.05,
+        channel_timeout: float = 30.0,
+        max_new_channels: int = 64,
+    ):
+        """
+        Mix the given (frequency, modulation)s, or every frequency heard if
+        None. New channels are announced on `new_channels` either way, which
+        drops the oldest announcements past max_new_channels if nobody takes
+        them.
+        """
+        if np is None:
+            raise ImportError("MixerStage needs NumPy")
+
+        self.decoded_queue = decoded_queue
+        self.frame_duration = frame_duration
+        self.frame_samples = round(sample_rate * frame_duration)
+        self.max_frames = max_frames
+        self.target_ticks = max(0, round(target_delay / frame_duration))
+        self.idle_ticks = max(1, round(idle_timeout / frame_duration))
+        self.agc = agc
+        self.agc_release = agc_release
+        self.channel_idle_ticks = max(1, round(channel_timeout / frame_duration))
+
+        self.channels: dict[ChannelKey, MixedChannel] = {}
+        self.new_channels = BoundedQueue(
+            max_new_channels, OverflowPolicy.DROP_OLDEST, "new_channels"
+        )
+        # Channels asked for with monitor, which are never removed
+        self._monitored: set[ChannelKey] = set()
+        self._monitor_all = frequencies is None
+        for frequency, modulation in frequencies or ():
+            self.monitor(frequency, modulation)
+
+        self._frame_bytes = 2 * self.frame_samples
+        self._silence = bytes(self._frame_bytes)
+
+    def monitor(self, frequency: float, modulation: Modulation) -> MixedChannel:
+        """Start mixing a frequency if not already, and return its channel"""
+        key = (frequency, Modulation(modulation))
+        self._monitored.add(key)
+        return self._channel(key)
+
+    def _channel(self, key: ChannelKey) -> MixedChannel:
+        channel = self.channels.get(key)
+        if channel is None:
+            channel = MixedChannel(*key, self.max_frames)
+            self.channels[key] = channel
+            self.new_channels.put_nowait(channel)
+        return channel
+
+    async def run(self):
+        """Receive decoded frames and run the playout clock until cancelled"""
+        receive_task = asyncio.create_task(self._receive())
+        try:
+            pacer = FramePacer(self.frame_duration)
+            while True:
+                await pacer.wait()
+                self.tick()
+        finally:
+            receive_task.cancel()
+
+    async def _receive(self):
+        while True:
+            self.push(await self.decoded_queue.get())
+
+    def push(self, frame: DecodedFrame):
+        """File a decoded frame under each of its frequencies"""
+        pcm = frame.pcm
+        if len(pcm) != self._frame_bytes:
+            pcm = bytes(pcm[: self._frame_bytes]).ljust(self._frame_bytes, b"\0")
+
+        for frequency in frame.frequencies:
+            key = (frequency.frequency, frequency.modulation)
+            channel = self.channels.get(key)
+            if channel is None:
+                if not self._monitor_all:
+                    continue
+                channel = self._channel(key)
+
+            talker = channel._talkers.get(frame.guid)
+            if talker is None:
+                talker = _Talker(self.max_frames, self.target_ticks)
+                channel._talkers[frame.guid] = talker
+            elif frame.packet_id <= talker.last_id:
+                channel.late += 1
+                continue
+            elif not talker.frames and talker.idle_ticks:
+                # Ran dry and started again, buffer up before playing on
+                talker.wait_ticks = self.target_ticks
+            talker.last_id = frame.packet_id
+            talker.frames.append(pcm)
+
+    def tick(self):
+        """Mix and emit one frame on every channel"""
+        active: list[MixedChannel] = []
+        rows: list[bytes] = []
+        counts: list[int] = []
+        for key, channel in list(self.channels.items()):
+            frames = self._next_frames(channel)
+            if frames:
+                active.append(channel)
+                rows.extend(frames)
+                counts.append(len(frames))
+            else:
+                channel._emit(self._silence)
+
+            if channel._talkers:
+                channel._idle_ticks = 0
+            elif key not in self._monitored:
+                channel._idle_ticks += 1
+                if channel._idle_ticks >= self.channel_idle_ticks:
+                    logger.debug("Nobody on %s %s any more", *key)
+                    channel._end()
+                    del self.channels[key]
+
+        if not active:
+            return
+
+        frames = np.frombuffer(b"".join(rows), "<i2").reshape(-1, self.frame_samples)
+        starts = np.zeros(len(counts), np.intp)
+        np.cumsum(counts[:-1], out=starts[1:])
+        mixed = np.add.reduceat(frames, starts, axis=0, dtype=np.float32)
+
+        if self.agc:
+            peaks = np.abs(mixed).max(axis=1)
+            gains = np.fromiter((c.gain for c in active), np.float32, len(active))
+            wanted = np.minimum(1.0, AGC_LIMIT / np.maximum(peaks, 1.0))
+            gains = np.where(
+                wanted < gains, wanted, gains + (wanted - gains) * self.agc_release
+            )
+            mixed *= gains[:, None]
+            for channel, gain in zip(active, gains.tolist()):
+                channel.gain = gain
+
+        clipped = np.count_nonzero(np.abs(mixed) > 32767, axis=1)
+        np.clip(mixed, -32768, 32767, out=mixed)
+        pcm = mixed.astype("<i2")
+        for channel, row, row_clipped in zip(active, pcm, clipped.tolist()):
+            channel.clipped += row_clipped
+            channel._emit(row.tobytes())
+
+    def _next_frames(self, channel: MixedChannel) -> list[bytes]:
+        frames = []
+        for guid, talker in list(channel._talkers.items()):
+            if talker.wait_ticks > 0:
+                talker.wait_ticks -= 1
+            elif talker.frames:
+                frames.append(talker.frames.popleft())
+                talker.idle_ticks = 0
+            else:
+                talker.idle_ticks += 1
+                if talker.idle_ticks >= self.idle_ticks:
+                    logger.debug("%s stopped talking", guid)
+                    del channel._talkers[guid]
+        return frames
@@ -0,0 +1,58 @@
+"""
+Fixed-rate scheduling for outgoing audio frames.
+
+Sleeping for one frame duration after each send drifts: every iteration adds
+the time spent doing the work plus whatever the event loop was busy with. The
+pacer here instead keeps an absolute schedule on the monotonic clock, so a late
+frame is followed by an early one and the long run rate stays exact. If the
+loop stalls for long enough that catching up would mean a noticeable burst,
+the schedule is rebased to now instead.
+"""
+
+import asyncio
+import time
+
+
+# SRS sends Opus audio in 40 ms frames
+AUDIO_FRAME_DURATION = 0.04
+
+
+class FramePacer:
+    def __init__(
+        self,
+        period: float = AUDIO_FRAME_DURATION,
+        max_lag: float = 5 * AUDIO_FRAME_DURATION,
+    ):
+        self.period = period
+        self.max_lag = max_lag
+        self.frames = 0
+        self.rebases = 0
+        self._next_deadline: float | None = None
+
+    def reset(self):
+        """Start a new schedule with the next frame going out immediately"""
+        self._next_deadline = None
+
+    async def wait(self) -> float:
+        """
+        Wait for the next frame slot. Returns how late the slot was hit in
+        seconds, which is what a caller should track as send jitter.
+        """
+        now = time.monotonic()
+        if self._next_deadline is None:
+            self._next_deadline = now
+
+        delay = self._next_deadline - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+            now = time.monotonic()
+
+        lateness = now - self._next_deadline
+        if lateness > self.max_lag:
+            # Too far behind to catch up without a burst, start over from now
+            self._next_deadline = now
+            self.rebases += 1
+
+        self._next_deadline += self.period
+        self.frames += 1
+        return lateness
@@ -0,0 +1,141 @@
+"""
+Opt-in timing of the hot paths.
+
+Call `enable()` and the transport modules and SrsClient start timing each
+stage (datagram receive, voice packet decode, time spent waiting in each
+pipeline queue, message handling, JSON encode/decode) into a `Histogram` per
+stage on the monotonic clock. While disabled, each instrumented spot costs one
+module attribute check.
+
+Histograms use log spaced buckets, four per doubling, so percentiles are
+accurate to within 25% and recording is a couple of integer operations.
+
+    profiling.enable()
+    ...
+    print(profiling.format_summary(profiling.active.take()))
+"""
+
+import asyncio
+from dataclasses import dataclass
+import time
+
+# The profiler when profiling is on, else None. Checked on every hot path.
+active: "Profiler | None" = None
+
+_BUCKETS = 8 + 4 * 60
+
+
+def _bucket(ns: int) -> int:
+    if ns < 8:
+        return max(ns, 0)
+    bits = ns.bit_length()
+    return 8 + 4 * (bits - 4) + ((ns >> (bits - 3)) & 3)
+
+
+def _bucket_floor(bucket: int) -> int:
+    if bucket < 8:
+        return bucket
+    octave, sub = divmod(bucket - 8, 4)
+    return (4 + sub) << (octave + 1)
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total_ns")
+
+    def __init__(self):
+        self.counts = [0] * _BUCKETS
+        self.count = 0
+        self.total_ns = 0
+
+    def add(self, ns: int):
+        self.counts[_bucket(ns)] += 1
+        self.count += 1
+        self.total_ns += ns
+
+    def percentile(self, fraction: float) -> int:
+        """Approximate duration in ns under which `fraction` of samples fall"""
+        if not self.count:
+            return 0
+        target = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return _bucket_floor(bucket)
+        return _bucket_floor(_BUCKETS - 1)
+
+
+@dataclass(frozen=True, slots=True)
+class StageSummary:
+    stage: str
+    count: int
+    per_second: float
+    p50_us: float
+    p99_us: float
+    mean_us: float
+
+
+class Profiler:
+    def __init__(self):
+        self.histograms: dict[str, Histogram] = {}
+        self._since = time.monotonic()
+
+    def record(self, stage: str, start_ns: int):
+        """Record the time from start_ns (from perf_counter_ns) until now"""
+        self.record_ns(stage, time.perf_counter_ns() - start_ns)
+
+    def record_ns(self, stage: str, ns: int):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.add(ns)
+
+    def take(self) -> list[StageSummary]:
+        """Summarize every stage since the last take, and start over"""
+        now = time.monotonic()
+        elapsed = max(now - self._since, 1e-9)
+        histograms = self.histograms
+        self.histograms = {}
+        self._since = now
+
+        return [
+            StageSummary(
+                stage,
+                histogram.count,
+                histogram.count / elapsed,
+                histogram.percentile(0.5) / 1000,
+                histogram.percentile(0.99) / 1000,
+                histogram.total_ns / histogram.count / 1000,
+            )
+            for stage, histogram in sorted(histograms.items())
+        ]
+
+
+def enable() -> Profiler:
+    global active
+    if active is None:
+        active = Profiler()
+    return active
+
+
+def disable():
+    global active
+    active = None
+
+
+def format_summary(summaries: list[StageSummary]) -> str:
+    lines = [f"{'stage':<28} {'count':>8} {'per s':>9} {'p50 us':>9} {'p99 us':>9}"]
+    for s in summaries:
+        lines.append(
+            f"{s.stage:<28} {s.count:>8} {s.per_second:>9.1f}"
+            f" {s.p50_us:>9.1f} {s.p99_us:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+async def print_summaries(interval: float = 5.0):
+    """Print and reset the stage summaries every interval until cancelled"""
+    profiler = enable()
+    while True:
+        await asyncio.sleep(interval)
+        print(format_summary(profiler.take()), flush=True)
@@ -0,0 +1,134 @@
+"""
+Bounded queues with explicit overflow policies for the pipeline stages.
+
+Every stage between the sockets and the client hands data over through an
+asyncio queue. Unbounded, a stalled consumer turns into unbounded memory growth
+and latency. Each stage instead gets a maximum size and a policy for what
+happens when it's full:
+
+- BLOCK: the producer waits, which for TCP pushes back on the socket. Used for
+  control messages where nothing may be lost.
+- DROP_OLDEST: the oldest queued item is thrown away. Used for voice, where
+  fresh audio matters more than complete audio.
+- DROP_NEWEST: the new item is thrown away.
+
+Each queue counts what it drops, and when profiling is on, how long items
+wait in it.
+"""
+
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+import time
+
+from . import profiling
+
+
+class OverflowPolicy(Enum):
+    BLOCK = "block"
+    DROP_OLDEST = "drop-oldest"
+    DROP_NEWEST = "drop-newest"
+
+
+class BoundedQueue(asyncio.Queue):
+    def __init__(
+        self,
+        maxsize: int = 0,
+        policy: OverflowPolicy = OverflowPolicy.BLOCK,
+        stage: str = "queue",
+    ):
+        super().__init__(maxsize)
+        self.policy = policy
+        self.dropped = 0
+        self.wait_stage = f"queue_wait.{stage}"
+
+    async def put(self, item):
+        if self.policy is OverflowPolicy.BLOCK:
+            await super().put(item)
+        else:
+            self.put_nowait(item)
+
+    def put_nowait(self, item):
+        """
+        Add an item without waiting. Only a BLOCK queue raises QueueFull, the
+        others apply their drop policy instead.
+        """
+        if self.full():
+            if self.policy is OverflowPolicy.DROP_NEWEST:
+                self.dropped += 1
+                return
+            if self.policy is OverflowPolicy.DROP_OLDEST:
+                self.get_nowait()
+                self.task_done()
+                self.dropped += 1
+        super().put_nowait(item)
+
+    # asyncio.Queue storage hooks, extended to keep each item's put time
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._put_times = deque()
+
+    def _put(self, item):
+        super()._put(item)
+        self._put_times.append(
+            0 if profiling.active is None else time.perf_counter_ns()
+        )
+
+    def _get(self):
+        put_time = self._put_times.popleft()
+        if put_time and profiling.active is not None:
+            profiling.active.record(self.wait_stage, put_time)
+        return super()._get()
+
+
+@dataclass
+class QueueLimit:
+    maxsize: int = 0
+    policy: OverflowPolicy = OverflowPolicy.BLOCK
+
+
+def _default_limits() -> dict[str, QueueLimit]:
+    return {
+        # Control messages must all arrive, so block and push back on TCP
+        "tcp_send": QueueLimit(1024, OverflowPolicy.BLOCK),
+        "tcp_receive": QueueLimit(1024, OverflowPolicy.BLOCK),
+        # Voice prefers fresh audio over complete audio
+        "voice_datagram": QueueLimit(2048, OverflowPolicy.DROP_OLDEST),
+        "voice_receive": QueueLimit(2048, OverflowPolicy.DROP_OLDEST),
+        "voice_send": QueueLimit(64, OverflowPolicy.DROP_OLDEST),
+        # Voice from every client on a shared voice transport
+        "shared_voice_send": QueueLimit(4096, OverflowPolicy.DROP_OLDEST),
+    }
+
+
+@dataclass
+class StageQueues:
+    """
+    Makes the queue for each named pipeline stage according to its configured
+    limit, and keeps hold of them so their sizes and drop counts can be read.
+    """
+
+    limits: dict[str, QueueLimit] = field(default_factory=_default_limits)
+    queues: dict[str, BoundedQueue] = field(default_factory=dict)
+
+    def make(self, stage: str) -> BoundedQueue:
+        limit = self.limits.get(stage, QueueLimit())
+        queue = BoundedQueue(limit.maxsize, limit.policy, stage)
+        self.queues[stage] = queue
+        return queue
+
+    def get_or_make(self, stage: str) -> BoundedQueue:
+        """The queue already made for the stage, if any, else a new one"""
+        queue = self.queues.get(stage)
+        return queue if queue is not None else self.make(stage)
+
+    def stats(self) -> dict[str, dict[str, int]]:
+        return {
+            stage: {
+                "size": queue.qsize(),
+                "maxsize": queue.maxsize,
+                "dropped": queue.dropped,
+            }
+            for stage, queue in self.queues.items()
+        }
@@ -0,0 +1,342 @@
+"""
+Recording of received voice to disk.
+
+`VoiceRecorder` sits on the voice receive queue and files every packet under
+a stream per (frequency, modulation, transmitter GUID). Each stream collects
+its frames in a small buffer that's cut into a block once it's big enough or
+every flush interval. Blocks are handed to a `BatchedWriter` thread in batches,
+and whatever batches are waiting go to disk in one write, so file I/O never
+runs on the event loop. Memory is bounded: once more than max_buffered bytes
+are waiting to be written, new packets are counted in `dropped` instead of
+buffered, as are malformed ones.
+
+Recordings are split into segment files, rotated by size or age. A segment is
+
+    FILE_MAGIC
+    block*
+    index entry* (written when the segment is closed)
+    index trailer
+
+and a block is one stream's frames:
+
+    block header: b"BLK1", frequency, modulation, GUID, frame count, audio size
+    frame entry*: packet_id, arrival time, audio offset, audio length
+    audio
+
+The index at the end lists every block's offset and stream so a stream can be
+found without reading through the audio. A segment cut short by a crash has no
+index but can still be read block by block. `RecordingFile` reads segments.
+"""
+
+from array import array
+import asyncio
+from collections.abc import Iterator
+from dataclasses import dataclass
+from itertools import accumulate
+import logging
+import mmap
+import os
+from pathlib import Path
+import struct
+import time
+
+from .batched_writer import BatchedWriter
+from .client_info import Modulation
+from .utils import Guid
+from .voice_batch import get_batch
+from .voice_packet import VoicePacketView, guid_length
+
+logger = logging.getLogger(__name__)
+
+
+FILE_MAGIC = b"SRSREC01"
+BLOCK_MAGIC = b"BLK1"
+INDEX_MAGIC = b"SRSIDX01"
+
+block_header_struct = struct.Struct(f"<4sdB{guid_length}sII")
+frame_entry_struct = struct.Struct("<QdIH")
+index_entry_struct = struct.Struct(f"<QdB{guid_length}s")
+index_trailer_struct = struct.Struct("<I8s")
+
+StreamKey = tuple[float, Modulation, Guid]
+
+
+class _StreamBuffer:
+    __slots__ = ("key", "packet_ids", "arrivals", "lengths", "audio")
+
+    def __init__(self, key: StreamKey):
+        self.key = key
+        self.packet_ids = array("Q")
+        self.arrivals = array("d")
+        self.lengths = array("H")
+        self.audio = bytearray()
+
+    def append(self, packet_id: int, arrival: float, audio: memoryview):
+        self.packet_ids.append(packet_id)
+        self.arrivals.append(arrival)
+        self.lengths.append(len(audio))
+        self.audio += audio
+
+    @property
+    def size(self) -> int:
+        return len(self.audio) + len(self.packet_ids) * frame_entry_struct.size
+
+    def to_bytes(self) -> bytes:
+        frequency, modulation, guid = self.key
+        offsets = accumulate(self.lengths, initial=0)
+        parts = [
+            block_header_struct.pack(
+                BLOCK_MAGIC,
+                frequency,
+                modulation,
+                guid.encode(),
+                len(self.packet_ids),
+                len(self.audio),
+            )
+        ]
+        parts.extend(
+            frame_entry_struct.pack(*entry)
+            for entry in zip(self.packet_ids, self.arrivals, offsets, self.lengths)
+        )
+        parts.append(self.audio)
+        return b"".join(parts)
+
+
+class VoiceRecorder:
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        prefix: str = "srs",
+        rotate_bytes: int = 256 * 1024 * 1024,
+        rotate_seconds: float = 3600,
+        block_bytes: int = 64 * 1024,
+        flush_interval: float = 1.0,
+        max_buffered: int = 64 * 1024 * 1024,
+    ):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.block_bytes = block_bytes
+        self.flush_interval = flush_interval
+        self.max_buffered = max_buffered
+
+        self.recorded = 0
+        self.dropped = 0
+        self.segments: list[Path] = []
+
+        self._streams: dict[StreamKey, _StreamBuffer] = {}
+        self._cut_blocks: list[_StreamBuffer] = []
+
+        # Current segment, only touched by the writer thread
+        self._file = None
+        self._index: list[bytes] = []
+        self._opened_at = 0.0
+        self._writer = BatchedWriter[list[_StreamBuffer]](
+            "voice-recorder", self._write_batches, self._finish, max_buffered
+        )
+
+    @property
+    def buffered_bytes(self) -> int:
+        """Bytes received but not yet written to disk"""
+        return self._writer.buffered_bytes
+
+    async def run(self, voice_receive_queue: asyncio.Queue[VoicePacketView]):
+        """Record everything from the queue until cancelled"""
+        flusher = asyncio.create_task(self._flush_periodically())
+        try:
+            while True:
+                for packet in await get_batch(voice_receive_queue):
+                    self.record(packet)
+        finally:
+            flusher.cancel()
+            await asyncio.to_thread(self.close)
+
+    def record(self, packet: VoicePacketView, arrival: float | None = None):
+        """Buffer one packet, once for every frequency it was sent on"""
+        if arrival is None:
+            arrival = time.time()
+        try:
+            audio = packet.audio_data
+            frequencies = packet.frequencies
+            guid = packet.guid
+            packet_id = packet.packet_id
+        except (struct.error, ValueError):
+            # Malformed, e.g. an unknown modulation. Dropped rather than
+            # ending the recording.
+            self.dropped += 1
+            return
+        size = (len(audio) + frame_entry_struct.size) * len(frequencies)
+        if not self._writer.reserve(size):
+            self.dropped += 1
+            return
+
+        for frequency in frequencies:
+            key = (frequency.frequency, frequency.modulation, guid)
+            buffer = self._streams.get(key)
+            if buffer is None:
+                buffer = self._streams[key] = _StreamBuffer(key)
+            buffer.append(packet_id, arrival, audio)
+            if len(buffer.audio) >= self.block_bytes:
+                self._cut_blocks.append(self._streams.pop(key))
+
+        self.recorded += 1
+
+    def flush(self):
+        """Hand everything buffered so far to the writer thread"""
+        batch = self._cut_blocks
+        batch.extend(self._streams.values())
+        self._streams = {}
+        self._cut_blocks = []
+        if batch:
+            self._writer.submit(batch, sum(buffer.size for buffer in batch))
+
+    def close(self):
+        """Write out what's buffered and close the current segment. Blocks."""
+        self.flush()
+        self._writer.close()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    #
+    # Writer thread
+    #
+    def _write_batches(self, batches: list[list[_StreamBuffer]]):
+        file = self._file
+        if file is not None and (
+            file.tell() >= self.rotate_bytes
+            or time.monotonic() - self._opened_at >= self.rotate_seconds
+        ):
+            self._file = None
+            self._close_segment(file, self._index)
+        if self._file is None:
+            self._file = self._open_segment()
+            self._index = []
+            self._opened_at = time.monotonic()
+
+        file = self._file
+        offset = file.tell()
+        blocks = []
+        for batch in batches:
+            for buffer in batch:
+                block = buffer.to_bytes()
+                frequency, modulation, guid = buffer.key
+                self._index.append(
+                    index_entry_struct.pack(
+                        offset, frequency, modulation, guid.encode()
+                    )
+                )
+                offset += len(block)
+                blocks.append(block)
+        file.write(b"".join(blocks))
+        file.flush()
+
+    def _finish(self):
+        if self._file is not None:
+            self._close_segment(self._file, self._index)
+
+    def _open_segment(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        path = self.directory / f"{self.prefix}-{stamp}-{len(self.segments):04d}.rec"
+        logger.info(f"Recording voice to {path}")
+        self.segments.append(path)
+        file = open(path, "wb")
+        file.write(FILE_MAGIC)
+        return file
+
+    def _close_segment(self, file, index: list[bytes]):
+        try:
+            file.write(b"".join(index))
+            file.write(index_trailer_struct.pack(len(index), INDEX_MAGIC))
+        finally:
+            file.close()
+
+
+@dataclass(slots=True)
+class RecordedFrame:
+    packet_id: int
+    arrival: float
+    audio: memoryview
+
+
+class RecordingFile:
+    """
+    Read access to one recorded segment. Frame audio is a view into the
+    mapped file, so it has to be let go of before closing.
+    """
+
+    def __init__(self, path: str | os.PathLike):
+        with open(path, "rb") as file:
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data = memoryview(self._mmap)
+        if self._data[: len(FILE_MAGIC)] != FILE_MAGIC:
+            raise ValueError(f"{path} is not a voice recording")
+        self.blocks = self._read_index() or list(self._scan_blocks())
+
+    def streams(self) -> set[StreamKey]:
+        return {key for _, key in self.blocks}
+
+    def frames(self, stream: StreamKey | None = None) -> Iterator[RecordedFrame]:
+        """Frames of one stream, or of all streams, in the order written"""
+        for offset, key in self.blocks:
+            if stream is None or key == stream:
+                yield from self._block_frames(offset)
+
+    def close(self):
+        self._data.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _read_index(self) -> list[tuple[int, StreamKey]] | None:
+        if len(self._data) < len(FILE_MAGIC) + index_trailer_struct.size:
+            return None
+        count, magic = index_trailer_struct.unpack_from(
+            self._data, len(self._data) - index_trailer_struct.size
+        )
+        if magic != INDEX_MAGIC:
+            return None
+        start = len(self._data) - index_trailer_struct.size
+        start -= count * index_entry_struct.size
+        return [
+            (offset, (frequency, Modulation(modulation), guid.decode()))
+            for offset, frequency, modulation, guid in index_entry_struct.iter_unpack(
+                self._data[start : len(self._data) - index_trailer_struct.size]
+            )
+        ]
+
+    def _scan_blocks(self) -> Iterator[tuple[int, StreamKey]]:
+        offset = len(FILE_MAGIC)
+        while offset + block_header_struct.size <= len(self._data):
+            magic, frequency, modulation, guid, count, audio_size = (
+                block_header_struct.unpack_from(self._data, offset)
+            )
+            end = (
+                offset
+                + block_header_struct.size
+                + count * frame_entry_struct.size
+                + audio_size
+            )
+            if magic != BLOCK_MAGIC or end > len(self._data):
+                # The index or a block cut short
+                return
+            yield offset, (frequency, Modulation(modulation), guid.decode())
+            offset = end
+
+    def _block_frames(self, offset: int) -> Iterator[RecordedFrame]:
+        _, _, _, _, count, _ = block_header_struct.unpack_from(self._data, offset)
+        entries = offset + block_header_struct.size
+        audio_start = entries + count * frame_entry_struct.size
+        for packet_id, arrival, audio_offset, length in frame_entry_struct.iter_unpack(
+            self._data[entries:audio_start]
+        ):
+            start = audio_start + audio_offset
+            yield RecordedFrame(packet_id, arrival, self._data[start : start + length])
@@ -0,0 +1,323 @@
+"""
+Small stand-in for an SRS server, for testing and benchmarking without a real
+one.
+
+It speaks the same newline delimited JSON over TCP and voice datagrams over UDP
+as the real server, but only covers what this library uses: SYNC, UPDATE and
+RADIO_UPDATE broadcasts, SERVER_SETTINGS, CLIENT_DISCONNECT, external AWACS
+log in, UDP keepalive echoes and voice relay to clients tuned to a packet's
+frequencies. It can be seeded with any number of synthetic clients which show
+up in SYNC replies but never connect.
+
+    python -m dcs_srs.server_emulator --port 5002 --seed-clients 1000
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import struct
+
+from .client_info import (
+    ClientInfo,
+    Coalition,
+    Modulation,
+    default_client_info,
+    make_radio_information,
+)
+from .frequency_index import FrequencyIndex
+from . import messages
+from .messages import MessageType, NetworkMessage
+from .tcp_json_connection import MAX_MESSAGE_SIZE, receive_messages, send_messages
+from .utils import Guid, make_short_guid
+from .voice_packet import VoicePacket
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_SERVER_SETTINGS: messages.ServerSettings = {
+    "ALLOW_RADIO_ENCRYPTION": "true",
+    "CLIENT_EXPORT_ENABLED": "false",
+    "COALITION_AUDIO_SECURITY": "false",
+    "DISTANCE_ENABLED": "False",
+    "EXTERNAL_AWACS_MODE": "True",
+    "GLOBAL_LOBBY_FREQUENCIES": "248.22",
+    "IRL_RADIO_RX_INTERFERENCE": "false",
+    "IRL_RADIO_TX": "false",
+    "LOS_ENABLED": "False",
+    "LOTATC_EXPORT_ENABLED": "False",
+    "LOTATC_EXPORT_IP": "127.0.0.1",
+    "LOTATC_EXPORT_PORT": "10712",
+    "RADIO_EFFECT_OVERRIDE": "false",
+    "RADIO_EXPANSION": "false",
+    "RETRANSMISSION_NODE_LIMIT": "0",
+    "SHOW_TRANSMITTER_NAME": "True",
+    "SHOW_TUNED_COUNT": "true",
+    "SPECTATORS_AUDIO_DISABLED": "false",
+    "STRICT_RADIO_ENCRYPTION": "false",
+    "TEST_FREQUENCIES": "247.2,120.3",
+    "TRANSMISSION_LOG_ENABLED": "false",
+    "TRANSMISSION_LOG_RETENTION": "2",
+}
+
+# Frequencies synthetic clients are most likely to be tuned to
+COMMON_FREQUENCIES = [
+    (251e6, Modulation.AM),
+    (243e6, Modulation.AM),
+    (121.5e6, Modulation.AM),
+    (30e6, Modulation.FM),
+    (260e6, Modulation.AM),
+    (305e6, Modulation.AM),
+]
+
+
+def synthetic_client(name: str = "") -> ClientInfo:
+    """A client with a random mix of common, random and unused radios"""
+    client = default_client_info(make_short_guid())
+    client["Name"] = name
+    client["Coalition"] = random.choice(list(Coalition))
+    client["RadioInfo"]["radios"] = [synthetic_radio() for _ in range(11)]
+    return client
+
+
+def synthetic_radio():
+    if random.random() < 0.5:
+        return make_radio_information(*random.choice(COMMON_FREQUENCIES))
+    if random.random() < 0.5:
+        return make_radio_information(
+            random.randrange(225_000, 400_000) * 1000, Modulation.AM
+        )
+    return make_radio_information()
+
+
+class _ConnectedClient:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.guid: Guid | None = None
+        self.send_queue = asyncio.Queue[NetworkMessage]()
+        self.sender = asyncio.create_task(send_messages(writer, self.send_queue))
+
+
+class SrsServerEmulator:
+    def __init__(
+        self,
+        seed_clients: int = 0,
+        awacs_passwords: dict[str, Coalition] | None = None,
+        server_settings: messages.ServerSettings | None = None,
+    ):
+        self.clients: dict[Guid, ClientInfo] = {}
+        self.server_settings = dict(server_settings or DEFAULT_SERVER_SETTINGS)
+        self.awacs_passwords = awacs_passwords or {"blue": Coalition.BLUE}
+        self.frequency_index = FrequencyIndex()
+
+        self.datagrams_received = 0
+        self.datagrams_relayed = 0
+
+        self._connected: dict[Guid, _ConnectedClient] = {}
+        self._connections: dict[asyncio.Task, _ConnectedClient] = {}
+        self._udp_addrs: dict[Guid, tuple[str, int]] = {}
+        self._tcp_server: asyncio.Server | None = None
+        self._udp_transport: asyncio.DatagramTransport | None = None
+
+        self.seed(seed_clients)
+
+    def seed(self, count: int):
+        """Add synthetic clients that appear in SYNC but never connect"""
+        for i in range(count):
+            client = synthetic_client(f"Synthetic-{i}")
+            self.clients[client["ClientGuid"]] = client
+            self.frequency_index.update_client(client)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        """Start listening on TCP and UDP, returns the port used"""
+        loop = asyncio.get_running_loop()
+        self._tcp_server = await asyncio.start_server(
+            self._handle_tcp, host, port, limit=MAX_MESSAGE_SIZE
+        )
+        port = self._tcp_server.sockets[0].getsockname()[1]
+        self._udp_transport, _ = await loop.create_datagram_endpoint(
+            lambda: _UdpServerProtocol(self), local_addr=(host, port)
+        )
+        logger.info(f"SRS server emulator listening on {host}:{port}")
+        return port
+
+    async def stop(self):
+        if self._udp_transport is not None:
+            self._udp_transport.close()
+        if self._tcp_server is not None:
+            self._tcp_server.close()
+        # Closing each connection's writer lets its handler finish normally
+        for connected in self._connections.values():
+            connected.sender.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        if self._tcp_server is not None:
+            await self._tcp_server.wait_closed()
+
+    #
+    # TCP
+    #
+    async def _handle_tcp(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        connected = _ConnectedClient(writer)
+        self._connections[asyncio.current_task()] = connected
+        receive_queue = asyncio.Queue[NetworkMessage]()
+        receiver = asyncio.create_task(receive_messages(reader, receive_queue))
+        handler = asyncio.create_task(self._handle_messages(connected, receive_queue))
+        try:
+            await receiver
+        except (RuntimeError, ConnectionError):
+            pass
+        finally:
+            handler.cancel()
+            connected.sender.cancel()
+            del self._connections[asyncio.current_task()]
+            if connected.guid is not None:
+                self._disconnect(connected.guid)
+
+    async def _handle_messages(
+        self, connected: _ConnectedClient, receive_queue: asyncio.Queue[NetworkMessage]
+    ):
+        while True:
+            msg = await receive_queue.get()
+            msg_type = MessageType(msg["MsgType"])
+            match msg_type:
+                case MessageType.SYNC:
+                    client = msg["Client"]
+                    connected.guid = client["ClientGuid"]
+                    self._connected[connected.guid] = connected
+                    self._update_client(client)
+                    connected.send_queue.put_nowait(
+                        {
+                            "Version": messages.SRS_VERSION,
+                            "MsgType": MessageType.SYNC,
+                            "Clients": list(self.clients.values()),
+                            "ServerSettings": self.server_settings,
+                        }
+                    )
+                    self._broadcast(
+                        {"MsgType": MessageType.UPDATE, "Client": client},
+                        connected.guid,
+                    )
+
+                case MessageType.UPDATE | MessageType.RADIO_UPDATE:
+                    client = self._update_client(msg["Client"])
+                    self._broadcast(
+                        {"MsgType": msg_type, "Client": client}, client["ClientGuid"]
+                    )
+
+                case MessageType.SERVER_SETTINGS:
+                    connected.send_queue.put_nowait(
+                        {
+                            "MsgType": MessageType.SERVER_SETTINGS,
+                            "ServerSettings": self.server_settings,
+                        }
+                    )
+
+                case MessageType.EXTERNAL_AWACS_MODE_PASSWORD:
+                    client = self._update_client(msg["Client"])
+                    coalition = self.awacs_passwords.get(
+                        msg.get("ExternalAwacsModePassword"), Coalition.SPECTATOR
+                    )
+                    client["Coalition"] = coalition
+                    connected.send_queue.put_nowait(
+                        {
+                            "MsgType": MessageType.EXTERNAL_AWACS_MODE_PASSWORD,
+                            "Client": client,
+                        }
+                    )
+
+                case MessageType.EXTERNAL_AWACS_MODE_DISCONNECT:
+                    client = self._update_client(msg["Client"])
+                    client["Coalition"] = Coalition.SPECTATOR
+
+                case _:
+                    logger.warning("Emulator ignoring %r message", msg_type)
+
+    def _update_client(self, client: ClientInfo) -> ClientInfo:
+        guid = client["ClientGuid"]
+        if guid in self.clients:
+            self.clients[guid].update(client)
+        else:
+            self.clients[guid] = client
+        self.frequency_index.update_client(self.clients[guid])
+        return self.clients[guid]
+
+    def _disconnect(self, guid: Guid):
+        self._connected.pop(guid, None)
+        self._udp_addrs.pop(guid, None)
+        self.frequency_index.remove_client(guid)
+        client = self.clients.pop(guid, None)
+        if client is not None:
+            self._broadcast(
+                {"MsgType": MessageType.CLIENT_DISCONNECT, "Client": client}, guid
+            )
+
+    def _broadcast(self, msg: NetworkMessage, from_guid: Guid | None = None):
+        for guid, connected in self._connected.items():
+            if guid != from_guid:
+                connected.send_queue.put_nowait(msg)
+
+    #
+    # UDP
+    #
+    def _datagram_received(self, data: bytes, addr: tuple[str, int]):
+        self.datagrams_received += 1
+        if len(data) == 22:
+            # Keepalive, remember where this client is and echo it back
+            self._udp_addrs[data.decode()] = addr
+            self._udp_transport.sendto(data, addr)
+            return
+
+        try:
+            packet = VoicePacket.deserialize_lazy(data)
+            sender = packet.guid
+            frequencies = packet.frequencies
+        except (struct.error, ValueError):
+            return
+        self._udp_addrs.setdefault(sender, addr)
+
+        receivers = set()
+        for frequency in frequencies:
+            receivers |= self.frequency_index.clients_on(
+                frequency.frequency, frequency.modulation
+            )
+        receivers.discard(sender)
+        for guid in receivers:
+            receiver_addr = self._udp_addrs.get(guid)
+            if receiver_addr is not None:
+                self._udp_transport.sendto(data, receiver_addr)
+                self.datagrams_relayed += 1
+
+
+class _UdpServerProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: SrsServerEmulator):
+        self.server = server
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
+        self.server._datagram_received(data, addr)
+
+
+async def main(host: str, port: int, seed_clients: int):
+    server = SrsServerEmulator(seed_clients)
+    await server.start(host, port)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Run a stand-in SRS server")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", "-p", type=int, default=5002)
+    parser.add_argument(
+        "--seed-clients",
+        type=int,
+        default=0,
+        help="Number of synthetic clients to include in SYNC",
+    )
+    args = parser.parse_args()
+
+    asyncio.run(main(args.host, args.port, args.seed_clients))
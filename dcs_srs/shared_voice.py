@@ -0,0 +1,299 @@
+"""
+One UDP voice socket shared by many SrsClients in a process.
+
+Normally each client has its own socket with keepalive, send and receive
+tasks, which for a fleet of bots means hundreds of sockets and tasks doing the
+same thing. `SharedVoiceTransport` is a `BatchedUdpSocket` that clients attach
+to instead (SrsClient's voice_transport argument):
+
+- one send loop serializes every attached client's voice from one queue,
+  keeping a packet template per client
+- one keepalive loop pings every client on its own adaptive period, sending
+  the pings that are due together each tick, and handles echo timeouts
+- the socket's reader hands keepalive echoes, which are just the GUID, to the
+  client they're for
+
+The server learns one address for all the GUIDs, so it sends a received
+packet to it once per attached client it's relaying to, and the copies don't
+say which client they were for. The transport looks up the attached clients
+tuned to one of the packet's frequencies (except its sender) and hands each
+copy to the next of them, so no more clients get a packet than the server sent
+copies of it. Copies past that are dropped as duplicates.
+
+A server with coalition security on only relays to the sender's coalition,
+so the tuned clients are lined up by coalition, with the sender's (as their
+client stores know it) first in line. Whether the server sends copies to just
+that group or to everyone tuned, each copy goes to a client it was meant for.
+Routing the transport can't see (line of sight, encryption keys) can still
+hand a copy to the wrong client within the group, so clients the server may
+route differently that way should be on separate transports.
+"""
+
+import asyncio
+from collections.abc import Iterable
+from dataclasses import dataclass
+import logging
+import socket
+import struct
+import time
+
+from .capture import RecordKind, TrafficCapture
+from .client_info import Modulation
+from .client_state import ClientStore
+from .frequency_index import FrequencyIndex
+from .link_health import LinkHealth
+from .queues import StageQueues
+from .udp_receiver import DEFAULT_RECEIVE_BUFFER, BatchedUdpSocket, open_udp_socket
+from .utils import Guid
+from .voice_batch import get_batch, min_packet_length
+from .voice_packet import (
+    PacketTemplate,
+    VoicePacket,
+    VoicePacketView,
+    guid_length,
+    trailer_length,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class _Member:
+    guid: Guid
+    ping: bytes
+    health: LinkHealth
+    voice_receive_queue: asyncio.Queue[VoicePacketView]
+    clients: ClientStore
+    ping_sent_at: float | None = None
+    next_ping_at: float = 0.0
+    reported_at: float = 0.0
+
+
+class SharedVoiceTransport(BatchedUdpSocket):
+    def __init__(
+        self,
+        sock: socket.socket,
+        queues: StageQueues | None = None,
+        max_batch: int = 1024,
+        capture: TrafficCapture | None = None,
+        tick: float = 0.1,
+        dedupe_window: int = 4096,
+    ):
+        # Traffic for the whole socket is counted in self.health, each
+        # client's own in its LinkHealth
+        super().__init__(sock, None, LinkHealth(), max_batch, capture)
+        self.tick = tick
+        self.dedupe_window = dedupe_window
+
+        if queues is None:
+            queues = StageQueues()
+        self.send_queue = queues.make("shared_voice_send")
+        self.members: dict[Guid, _Member] = {}
+        self.frequency_index = FrequencyIndex()
+        self.duplicates = 0
+
+        # Trailers of recently received packets, oldest first, with the packet
+        # and the clients still in line for a copy while there are any
+        self._seen: dict[bytes, tuple[VoicePacketView, list[Guid]] | None] = {}
+        self._closed = self._loop.create_future()
+        self._tasks = [
+            asyncio.create_task(self._keep_alive()),
+            asyncio.create_task(self._send()),
+        ]
+
+    @classmethod
+    async def connect(
+        cls,
+        addr: tuple[str, int],
+        receive_buffer: int = DEFAULT_RECEIVE_BUFFER,
+        **transport_args,
+    ) -> "SharedVoiceTransport":
+        sock = await open_udp_socket(addr, receive_buffer)
+        return cls(sock, **transport_args)
+
+    async def serve(
+        self,
+        guid: Guid,
+        health: LinkHealth,
+        voice_receive_queue: asyncio.Queue[VoicePacketView],
+        tuned: Iterable[tuple[float, Modulation]],
+        clients: ClientStore,
+    ):
+        """
+        Attach a client until cancelled or the transport is closed. Its voice
+        goes out from `send_queue`, and received voice on the frequencies it's
+        tuned to (kept up to date with `retune`) comes in on its queue.
+        Coalitions are looked up in its client store.
+        """
+        if guid in self.members:
+            raise ValueError(f"{guid} is already attached")
+        self.members[guid] = _Member(
+            guid, guid.encode(), health, voice_receive_queue, clients
+        )
+        self.frequency_index.update_tuned(guid, tuned)
+        try:
+            await asyncio.shield(self._closed)
+        finally:
+            del self.members[guid]
+            self.frequency_index.remove_client(guid)
+
+    def retune(self, guid: Guid, tuned: Iterable[tuple[float, Modulation]]):
+        if guid in self.members:
+            self.frequency_index.update_tuned(guid, tuned)
+
+    def close(self):
+        if not self._closed.done():
+            self._closed.set_result(None)
+        for task in self._tasks:
+            task.cancel()
+        super().close()
+
+    def _deliver(self, data: memoryview) -> bool:
+        size = len(data)
+        self.health.datagram_received(size)
+        if size == guid_length:
+            member = self.members.get(bytes(data).decode())
+            if member is not None:
+                member.health.datagram_received(size)
+                self._echo_received(member)
+            return False
+        if size < min_packet_length:
+            return False
+
+        trailer = bytes(data[-trailer_length:])
+        if trailer in self._seen:
+            # Another copy, for the next client in line. It's given the view
+            # of the first copy, so this one isn't kept.
+            fanout = self._seen[trailer]
+            if fanout is None or not self._hand_to_next(*fanout, size):
+                self.duplicates += 1
+            elif not fanout[1]:
+                self._seen[trailer] = None
+            return False
+
+        try:
+            packet = VoicePacketView(data)
+            sender = packet.guid
+            frequencies = packet.frequencies
+        except (struct.error, ValueError):
+            logger.debug(f"Dropped a malformed {size} byte voice datagram")
+            return False
+
+        receivers = set()
+        for frequency in frequencies:
+            receivers |= self.frequency_index.clients_on(
+                frequency.frequency, frequency.modulation
+            )
+        receivers.discard(sender)
+
+        waiting = self._line_up(sender, receivers)
+        kept = self._hand_to_next(packet, waiting, size)
+        self._seen[trailer] = (packet, waiting) if waiting else None
+        if len(self._seen) > self.dedupe_window:
+            del self._seen[next(iter(self._seen))]
+        return kept
+
+    def _line_up(self, sender: Guid, receivers: set[Guid]) -> list[Guid]:
+        """Order receivers for copies, the sender's coalition first (last popped)"""
+        if len(receivers) < 2:
+            return list(receivers)
+        # Any receiver's store knows every client on the server
+        clients = self.members[next(iter(receivers))].clients
+        sender_state = clients.state(sender)
+        if sender_state is None:
+            return list(receivers)
+
+        same, other = [], []
+        for guid in receivers:
+            state = clients.state(guid)
+            if state is not None and state.coalition == sender_state.coalition:
+                same.append(guid)
+            else:
+                other.append(guid)
+        return other + same
+
+    def _hand_to_next(
+        self, packet: VoicePacketView, waiting: list[Guid], size: int
+    ) -> bool:
+        """Deliver a copy to the next client in line still attached, if any"""
+        while waiting:
+            member = self.members.get(waiting.pop())
+            if member is None:
+                continue
+            member.health.datagram_received(size)
+            member.health.voice_received(packet.guid, packet.packet_id)
+            queue = member.voice_receive_queue
+            try:
+                queue.put_nowait(packet)
+            except asyncio.QueueFull:
+                queue.dropped += 1
+            return True
+        return False
+
+    def _echo_received(self, member: _Member):
+        health = member.health
+        health.echo_received()
+        if member.ping_sent_at is not None:
+            member.next_ping_at = member.ping_sent_at + health.keepalive_period
+            member.ping_sent_at = None
+
+    def _send_datagram(self, data: bytes | memoryview, member: _Member | None):
+        self.sendto(data)
+        self.health.datagram_sent(len(data))
+        if member is not None:
+            member.health.datagram_sent(len(data))
+        if self.capture is not None:
+            self.capture.record(RecordKind.UDP_OUT, data)
+
+    async def _keep_alive(self):
+        """Send every client's keepalives and link health updates as due"""
+        while True:
+            await asyncio.sleep(self.tick)
+            now = time.monotonic()
+            due = []
+            for member in self.members.values():
+                health = member.health
+                if (
+                    member.ping_sent_at is not None
+                    and now - member.ping_sent_at >= health.echo_timeout
+                ):
+                    health.echo_missed()
+                    member.next_ping_at = member.ping_sent_at + health.keepalive_period
+                    member.ping_sent_at = None
+                if member.ping_sent_at is None and now >= member.next_ping_at:
+                    due.append(member)
+
+                if now - member.reported_at >= health.metrics_interval:
+                    member.reported_at = now
+                    health.update()
+                    if health.metrics_callback is not None:
+                        try:
+                            health.metrics_callback(health.snapshot())
+                        except Exception:
+                            logger.exception("Error in link metrics callback")
+
+            for member in due:
+                member.health.ping_sent()
+                member.ping_sent_at = now
+                self._send_datagram(member.ping, member)
+
+    async def _send(self):
+        # A template per client, as their packets are interleaved
+        templates: dict[Guid, PacketTemplate] = {}
+        while True:
+            voice_packet: VoicePacket
+            for voice_packet in await get_batch(self.send_queue):
+                guid = voice_packet.guid
+                template = templates.get(guid)
+                if template is None or not template.matches(voice_packet):
+                    template = templates[guid] = PacketTemplate.for_packet(
+                        voice_packet
+                    )
+                data = template.serialize(
+                    voice_packet.audio_data, voice_packet.packet_id
+                )
+                self._send_datagram(data, self.members.get(guid))
+
+            if len(templates) > len(self.members):
+                for guid in [guid for guid in templates if guid not in self.members]:
+                    del templates[guid]
@@ -0,0 +1,162 @@
+"""
+Single-producer single-consumer ring buffer of byte records in shared memory.
+
+Used to hand raw voice datagrams from the I/O process to worker processes
+without pickling or locks. The shared memory block starts with a header of
+64 bit counters, with the producer's and the consumer's on separate cache
+lines:
+
+    0    head: bytes ever written (producer)
+    8    closed: set by the producer when no more records are coming
+    64   tail: bytes ever consumed (consumer)
+    72   records consumed (consumer)
+
+followed by the data area, where each record is a 32 bit length, 4 bytes of
+padding and the payload, padded to 8 bytes. A record that doesn't fit before
+the end of the data area is preceded by a wrap marker and starts over at the
+beginning.
+
+Each counter is only ever written by one side, as a single aligned 8 byte
+store, and the producer publishes head only after the record is written. That
+relies on the consumer seeing the producer's stores in the order they were
+made, as Python has no memory barriers to enforce it. x86-64 guarantees that
+(total store order), but weakly ordered hosts like ARM64 can make head visible
+before the record it covers, so rings refuse to be made anywhere else.
+"""
+
+from multiprocessing import shared_memory
+import platform
+import struct
+
+_HEAD = 0
+_CLOSED = 1
+_TAIL = 8
+_RECORDS = 9
+HEADER_SIZE = 128
+
+_length_struct = struct.Struct("<I4x")
+_WRAP = 0xFFFFFFFF
+
+# Hosts whose stores are seen in program order. 32 bit x86 is left out as it
+# can split the 8 byte counter stores.
+SUPPORTED_MACHINES = {"x86_64", "amd64"}
+
+
+def _check_machine():
+    machine = platform.machine()
+    if machine.lower() not in SUPPORTED_MACHINES:
+        raise RuntimeError(
+            f"ShmRing needs an x86-64 host for its memory ordering, not {machine}"
+        )
+
+
+def _record_size(length: int) -> int:
+    return _length_struct.size + ((length + 7) & ~7)
+
+
+class ShmRing:
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self.shm = shm
+        self.name = shm.name
+        self.capacity = (shm.size - HEADER_SIZE) & ~7
+        self._owner = owner
+        self._counters = shm.buf[:HEADER_SIZE].cast("Q")
+        self._data = shm.buf[HEADER_SIZE : HEADER_SIZE + self.capacity]
+        # Each side's own counter, kept locally as only it writes it
+        self._head = self._counters[_HEAD]
+        self._tail = self._counters[_TAIL]
+        self._pending_tail = self._tail
+        self._pending_records = 0
+
+    @classmethod
+    def create(cls, capacity: int) -> "ShmRing":
+        _check_machine()
+        shm = shared_memory.SharedMemory(create=True, size=HEADER_SIZE + capacity)
+        shm.buf[:HEADER_SIZE] = bytes(HEADER_SIZE)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> "ShmRing":
+        _check_machine()
+        return cls(shared_memory.SharedMemory(name), owner=False)
+
+    #
+    # Producer side
+    #
+    def write(self, record: bytes | memoryview) -> bool:
+        """Append a record, or return False if there isn't room for it"""
+        length = len(record)
+        size = _record_size(length)
+        capacity = self.capacity
+        if size > capacity:
+            raise ValueError(f"{length} byte record can't fit in the ring")
+
+        head = self._head
+        free = capacity - (head - self._counters[_TAIL])
+        position = head % capacity
+        wrap = capacity - position if position + size > capacity else 0
+        if wrap + size > free:
+            return False
+
+        if wrap:
+            _length_struct.pack_into(self._data, position, _WRAP)
+            head += wrap
+            position = 0
+        _length_struct.pack_into(self._data, position, length)
+        start = position + _length_struct.size
+        self._data[start : start + length] = record
+
+        self._head = head + size
+        self._counters[_HEAD] = self._head
+        return True
+
+    def close_writing(self):
+        """Tell the consumer nothing more is coming"""
+        self._counters[_CLOSED] = 1
+
+    #
+    # Consumer side
+    #
+    @property
+    def closed(self) -> bool:
+        return bool(self._counters[_CLOSED])
+
+    @property
+    def records_consumed(self) -> int:
+        return self._counters[_RECORDS]
+
+    def read_batch(self, max_records: int = 256) -> list[memoryview]:
+        """
+        Up to max_records records as views into the ring. They stay valid
+        until `commit`, which frees their space for the producer.
+        """
+        records = []
+        tail = self._pending_tail
+        head = self._counters[_HEAD]
+        capacity = self.capacity
+        while tail < head and len(records) < max_records:
+            position = tail % capacity
+            (length,) = _length_struct.unpack_from(self._data, position)
+            if length == _WRAP:
+                tail += capacity - position
+                continue
+            start = position + _length_struct.size
+            records.append(self._data[start : start + length])
+            tail += _record_size(length)
+        self._pending_tail = tail
+        self._pending_records += len(records)
+        return records
+
+    def commit(self):
+        self._tail = self._pending_tail
+        self._counters[_RECORDS] += self._pending_records
+        self._counters[_TAIL] = self._tail
+        self._pending_records = 0
+
+    def close(self):
+        """Detach, and free the shared memory if this side created it"""
+        self._counters.release()
+        self._data.release()
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
@@ -0,0 +1,101 @@
+"""
+Keeps an SrsClient connected.
+
+Without supervision a broken TCP connection just ends a background task, and
+the client stays dead until someone notices. `ConnectionSupervisor` connects
+the client, waits for the connection to be lost (the TCP connection closing
+or failing, or the voice link missing keepalive echoes), then closes what's
+left and connects again. Failed attempts are retried with exponential backoff
+and jitter, so a server restart isn't met by every client at once.
+
+Reconnecting keeps the client's state: the SYNC carries its radios, an AWACS
+log in is redone, the known clients are reconciled against the new SYNC, and
+voice consumers and transmissions carry on with the same queues. The first
+attempt after losing a connection comes within min_backoff, so after a server
+blip voice resumes as soon as the server is back.
+
+    supervisor = ConnectionSupervisor(client, host, port)
+    task = asyncio.create_task(supervisor.run())
+    await supervisor.connected.wait()
+"""
+
+import asyncio
+import logging
+import random
+
+from .client import SrsClient, VersionMismatchError
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionSupervisor:
+    def __init__(
+        self,
+        client: SrsClient,
+        host: str,
+        port: int,
+        min_backoff: float = 0.1,
+        max_backoff: float = 30.0,
+        connect_timeout: float = 10.0,
+    ):
+        self.client = client
+        self.host = host
+        self.port = port
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+
+        # Set while the client is connected
+        self.connected = asyncio.Event()
+        self.reconnects = 0
+        self.failed_attempts = 0
+        self.last_error: str | None = None
+
+    def backoff(self, attempt: int) -> float:
+        """Delay before the given retry, doubling each time, with jitter"""
+        delay = min(self.min_backoff * 2**attempt, self.max_backoff)
+        return random.uniform(delay / 2, delay)
+
+    async def run(self):
+        """
+        Keep the client connected until cancelled, then disconnect it. Only
+        gives up on a version mismatch, which retrying won't fix.
+        """
+        attempt = 0
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(
+                        self.client.connect(self.host, self.port),
+                        self.connect_timeout,
+                    )
+                except VersionMismatchError:
+                    raise
+                except Exception as err:
+                    await self.client.close_connection()
+                    self.failed_attempts += 1
+                    self.last_error = str(err) or type(err).__name__
+                    delay = self.backoff(attempt)
+                    attempt += 1
+                    logger.warning(
+                        f"Couldn't connect to {self.host}:{self.port}"
+                        f" ({self.last_error}), retrying in {delay:.1f}s"
+                    )
+                    await asyncio.sleep(delay)
+                    continue
+
+                attempt = 0
+                self.connected.set()
+                self.last_error = await self.client.wait_connection_lost()
+                self.connected.clear()
+
+                logger.warning(
+                    f"Lost connection to {self.host}:{self.port}"
+                    f" ({self.last_error}), reconnecting"
+                )
+                self.reconnects += 1
+                await self.client.close_connection()
+                await asyncio.sleep(self.backoff(0))
+        finally:
+            self.connected.clear()
+            await self.client.disconnect()
@@ -8,60 +8,131 @@ added to the receive queue for some other code to pop and process. 👌
 """
 
 import asyncio
-import json
 import logging
+import time
 
+from . import profiling
+from .capture import RecordKind, TrafficCapture
+from .json_codec import JsonCodec, get_codec
 from .messages import NetworkMessage, MessageType
+from .queues import StageQueues
 
 logger = logging.getLogger(__name__)
 
 
+# SYNC messages from busy servers are way over asyncio's default 64 KiB line limit
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+
+
 async def connect_tcp_json(
     host: str,
     port: int,
-) -> tuple[asyncio.Queue[NetworkMessage], asyncio.Queue[NetworkMessage]]:
+    queues: StageQueues | None = None,
+    codec: JsonCodec | None = None,
+    capture: TrafficCapture | None = None,
+) -> tuple[
+    asyncio.Queue[NetworkMessage], asyncio.Queue[NetworkMessage], list[asyncio.Task]
+]:
     """
     Form a TCP connection and just send and receive single-line JSON data
     objects. Messages are forwarded in and out via the send and received queues.
+    Cancelling the returned tasks closes the connection. Queue sizes and
+    overflow policies come from the "tcp_send" and "tcp_receive" stages of
+    `queues`. Messages are encoded with `codec`, by default the fastest JSON
+    library installed. Every line sent and received is logged to `capture`,
+    if given.
     """
     logger.info(f"Opening TCP connection to {host}:{port}")
-    reader, writer = await asyncio.open_connection(host, port)
+    reader, writer = await asyncio.open_connection(host, port, limit=MAX_MESSAGE_SIZE)
 
-    send_queue = asyncio.Queue[NetworkMessage]()
-    receive_queue = asyncio.Queue[NetworkMessage]()
+    if queues is None:
+        queues = StageQueues()
+    send_queue = queues.make("tcp_send")
+    receive_queue = queues.make("tcp_receive")
 
-    asyncio.create_task(send_messages(writer, send_queue))
-    asyncio.create_task(receive_messages(reader, receive_queue))
+    if codec is None:
+        codec = get_codec()
 
-    return receive_queue, send_queue
+    tasks = [
+        asyncio.create_task(send_messages(writer, send_queue, codec, capture)),
+        asyncio.create_task(
+            receive_messages(reader, receive_queue, codec, capture)
+        ),
+    ]
+
+    return receive_queue, send_queue, tasks
 
 
 async def send_messages(
-    writer: asyncio.StreamWriter, send_queue: asyncio.Queue[NetworkMessage]
+    writer: asyncio.StreamWriter,
+    send_queue: asyncio.Queue[NetworkMessage],
+    codec: JsonCodec | None = None,
+    capture: TrafficCapture | None = None,
 ):
     """Send messages from the queue to the TCP socket"""
     logger.info("Starting TCP message sender")
-    while True:
-        # Get the next message to be sent
-        msg = await send_queue.get()
+    if codec is None:
+        codec = get_codec()
+    try:
+        while True:
+            # Get the next message to be sent, plus any others already waiting
+            batch = [await send_queue.get()]
+            while not send_queue.empty():
+                batch.append(send_queue.get_nowait())
 
-        # And serialize and send it
-        logger.debug("Sending %r message", MessageType(msg["MsgType"]))
-        writer.write(json.dumps(msg).encode() + b"\n")
+            if logger.isEnabledFor(logging.DEBUG):
+                for msg in batch:
+                    logger.debug("Sending %r message", MessageType(msg["MsgType"]))
+
+            # And serialize and send them in one write
+            profiler = profiling.active
+            if profiler is None:
+                lines = [codec.dumps(msg) for msg in batch]
+            else:
+                lines = []
+                for msg in batch:
+                    start = time.perf_counter_ns()
+                    lines.append(codec.dumps(msg))
+                    profiler.record("json_encode", start)
+            if capture is not None:
+                for line in lines:
+                    capture.record(RecordKind.TCP_OUT, line)
+            lines.append(b"")
+            writer.write(b"\n".join(lines))
+
+            # Let a slow connection push back rather than buffering forever
+            await writer.drain()
+    finally:
+        writer.close()
 
 
 async def receive_messages(
-    reader: asyncio.StreamReader, receive_queue: asyncio.Queue[NetworkMessage]
+    reader: asyncio.StreamReader,
+    receive_queue: asyncio.Queue[NetworkMessage],
+    codec: JsonCodec | None = None,
+    capture: TrafficCapture | None = None,
 ):
     """Receive messages from the TCP socket and put them on the receive queue"""
     logger.info("Starting TCP message receiver")
+    if codec is None:
+        codec = get_codec()
     while True:
         # Get the next line of data
-        line = (await reader.readline()).decode()
-        if not line.endswith("\n"):
+        line = await reader.readline()
+        if not line.endswith(b"\n"):
             raise RuntimeError("Client TCP connection broken")
+        if capture is not None:
+            capture.record(RecordKind.TCP_IN, line)
+
+        # And deserialize it (trailing newline is just JSON whitespace) and
+        # place it on the receive queue
+        profiler = profiling.active
+        if profiler is not None:
+            start = time.perf_counter_ns()
+        msg: NetworkMessage = codec.loads(line)
+        if profiler is not None:
+            profiler.record("json_decode", start)
 
-        # And deserialize it and place it on the receive queue
-        msg: NetworkMessage = json.loads(line.rstrip())
-        logger.debug("Received %r message", MessageType(msg["MsgType"]))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Received %r message", MessageType(msg["MsgType"]))
         await receive_queue.put(msg)
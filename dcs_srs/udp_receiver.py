@@ -0,0 +1,194 @@
+"""
+Batched receive engine for the UDP voice connection.
+
+With a datagram endpoint every received datagram costs a protocol callback, a
+put on the datagram queue and a wakeup of the task that decodes it, before it
+even gets to the voice receive queue. `BatchedUdpSocket` instead registers a
+plain non-blocking socket with `loop.add_reader` and, on each readiness event,
+reads every pending datagram (up to max_batch) with `recv_into` straight into
+a preallocated arena. Each datagram is checked, counted and wrapped in a
+`VoicePacketView` over the arena on the spot, and the lot go onto the voice
+receive queue together, so a consumer using `get_batch` wakes once per burst.
+
+Arenas are only ever appended to, and a fresh one is started when the current
+one can't fit another datagram, so views stay valid for as long as they're
+held. A consumer holding on to packets for a long time pins their arena, so it
+should copy them (`to_packet`) instead.
+
+The socket also asks for a bigger kernel receive buffer than the default, so
+bursts of voice wait in the kernel rather than being dropped there. Linux caps
+it at net.core.rmem_max.
+"""
+
+import asyncio
+import logging
+import socket
+import struct
+import time
+
+from . import profiling
+from .capture import RecordKind, TrafficCapture
+from .link_health import LinkHealth
+from .voice_batch import min_packet_length
+from .voice_packet import VoicePacketView
+
+logger = logging.getLogger(__name__)
+
+
+# Kernel receive buffer asked for by default
+DEFAULT_RECEIVE_BUFFER = 4 * 1024 * 1024
+# Largest possible UDP payload, so a read never truncates
+MAX_DATAGRAM_SIZE = 65535
+ARENA_SIZE = 1024 * 1024
+
+
+async def open_udp_socket(
+    addr: tuple[str, int], receive_buffer: int = DEFAULT_RECEIVE_BUFFER
+) -> socket.socket:
+    """A non-blocking UDP socket connected to addr"""
+    loop = asyncio.get_running_loop()
+    host, port = addr
+    infos = await loop.getaddrinfo(host, port, type=socket.SOCK_DGRAM)
+    family, type_, proto, _, address = infos[0]
+
+    sock = socket.socket(family, type_, proto)
+    try:
+        sock.setblocking(False)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        granted = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        # Linux reports double the size asked for, to allow for its own
+        # bookkeeping, so this only catches a buffer capped by the kernel
+        if granted < receive_buffer:
+            logger.info(
+                f"Asked for a {receive_buffer} byte UDP receive buffer,"
+                f" got {granted}"
+            )
+        await loop.sock_connect(sock, address)
+    except BaseException:
+        sock.close()
+        raise
+    return sock
+
+
+class BatchedUdpSocket:
+    """
+    Connected UDP socket that drains everything pending on each readiness
+    event. Stands in for the datagram transport on the sending side, so it
+    has `sendto` and `close`.
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        voice_receive_queue: asyncio.Queue[VoicePacketView],
+        health: LinkHealth,
+        max_batch: int = 1024,
+        capture: TrafficCapture | None = None,
+    ):
+        self.sock = sock
+        self.voice_receive_queue = voice_receive_queue
+        self.health = health
+        self.max_batch = max_batch
+        self.capture = capture
+
+        self.batches = 0
+        # Datagrams the socket buffer was too full to send
+        self.send_dropped = 0
+
+        self._loop = asyncio.get_running_loop()
+        self._new_arena()
+        self._loop.add_reader(sock.fileno(), self._read_ready)
+
+    @classmethod
+    async def connect(
+        cls,
+        addr: tuple[str, int],
+        voice_receive_queue: asyncio.Queue[VoicePacketView],
+        health: LinkHealth,
+        receive_buffer: int = DEFAULT_RECEIVE_BUFFER,
+        max_batch: int = 1024,
+        capture: TrafficCapture | None = None,
+    ) -> "BatchedUdpSocket":
+        sock = await open_udp_socket(addr, receive_buffer)
+        return cls(sock, voice_receive_queue, health, max_batch, capture)
+
+    def _new_arena(self):
+        self._arena = memoryview(bytearray(ARENA_SIZE))
+        self._offset = 0
+
+    def _read_ready(self):
+        profiler = profiling.active
+        if profiler is not None:
+            start = time.perf_counter_ns()
+
+        capture = self.capture
+        deliver = self._deliver
+        recv_into = self.sock.recv_into
+        count = 0
+        while count < self.max_batch:
+            if ARENA_SIZE - self._offset < MAX_DATAGRAM_SIZE:
+                self._new_arena()
+            offset = self._offset
+            try:
+                size = recv_into(self._arena[offset:])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as e:
+                # E.g. connection refused, from an ICMP error for an earlier send
+                logger.debug(f"UDP receive error: {e}")
+                break
+            count += 1
+            data = self._arena[offset : offset + size]
+            if capture is not None:
+                capture.record(RecordKind.UDP_IN, data)
+            if deliver(data):
+                # Keep the next datagram 8 byte aligned
+                self._offset = offset + ((size + 7) & ~7)
+
+        if count:
+            self.batches += 1
+            if profiler is not None:
+                profiler.record("datagram_batch_receive", start)
+
+    def _deliver(self, data: memoryview) -> bool:
+        """
+        Handle one datagram, viewed in the arena. Returns whether a view of it
+        was kept, so its space in the arena can't be reused.
+        """
+        size = len(data)
+        self.health.datagram_received(size)
+        if size == 22:
+            # Keepalive echo
+            self.health.echo_received()
+            return False
+        if size < min_packet_length:
+            return False
+
+        try:
+            packet = VoicePacketView(data)
+            # Decoded up front so a bad modulation is dropped here, not in
+            # every consumer
+            packet.frequencies
+            self.health.voice_received(packet.guid, packet.packet_id)
+        except (struct.error, ValueError):
+            logger.debug(f"Dropped a malformed {size} byte voice datagram")
+            return False
+        try:
+            self.voice_receive_queue.put_nowait(packet)
+        except asyncio.QueueFull:
+            # Can't block in a reader callback, so a full blocking queue drops
+            self.voice_receive_queue.dropped += 1
+        return True
+
+    def sendto(self, data: bytes | memoryview, addr=None):
+        try:
+            self.sock.send(data)
+        except (BlockingIOError, InterruptedError):
+            self.send_dropped += 1
+        except OSError as e:
+            logger.debug(f"UDP send error: {e}")
+
+    def close(self):
+        if self.sock.fileno() != -1:
+            self._loop.remove_reader(self.sock.fileno())
+            self.sock.close()
@@ -0,0 +1,87 @@
+"""
+Coalescing of outbound client updates.
+
+Every UPDATE and RADIO_UPDATE carries the whole ClientInfo, so a script that
+retunes three radios in a row would otherwise send three full copies of its
+state where the last one alone says everything. The scheduler instead notes
+that an update is due and sends a single message once the debounce window has
+passed, built from the newest state at send time. Callers that need the server
+to have the change right away can flush.
+"""
+
+import asyncio
+from collections.abc import Awaitable, Callable
+
+from .client_info import ClientInfo
+from . import messages
+from .messages import MessageType, NetworkMessage
+
+
+MESSAGE_BUILDERS = {
+    MessageType.UPDATE: messages.update_message,
+    MessageType.RADIO_UPDATE: messages.radio_update_message,
+}
+
+
+class UpdateScheduler:
+    def __init__(
+        self,
+        send: Callable[[NetworkMessage], Awaitable[None]],
+        client_info: Callable[[], ClientInfo],
+        window: float = 0.05,
+    ):
+        self.window = window
+        self.requested = 0
+        self.sent = 0
+
+        self._send = send
+        self._client_info = client_info
+        self._pending: set[MessageType] = set()
+        self._timer: asyncio.Task | None = None
+
+    async def request(self, message_type: MessageType, flush: bool = False):
+        """
+        Note that the server needs an UPDATE or RADIO_UPDATE. It's sent when
+        the window closes, or now if flush is set.
+        """
+        self.requested += 1
+        self._pending.add(message_type)
+        if flush or self.window <= 0:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._send_after_window())
+
+    async def flush(self):
+        """Send anything pending right now"""
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
+
+        pending = sorted(self._pending)
+        self._pending = set()
+        # Each carries the full client info, always the newest
+        for index, message_type in enumerate(pending):
+            try:
+                await self._send(MESSAGE_BUILDERS[message_type](self._client_info()))
+            except BaseException:
+                # E.g. cancelled while waiting to send. Whatever wasn't sent
+                # is still due.
+                self._pending.update(pending[index:])
+                if self._timer is None:
+                    self._timer = asyncio.create_task(self._send_after_window())
+                raise
+            self.sent += 1
+
+    def cancel(self):
+        """Forget anything pending, e.g. because a SYNC will carry it instead"""
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
+        self._pending.clear()
+
+    async def _send_after_window(self):
+        await asyncio.sleep(self.window)
+        # Once it has taken the pending set it's no longer cancelled by a
+        # flush, which would lose the types it hasn't sent yet
+        self._timer = None
+        await self.flush()
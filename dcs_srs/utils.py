@@ -1,12 +1,27 @@
+import asyncio
 import base64
-from typing import NewType
+from collections.abc import Coroutine
+from typing import Any, NewType, TypeVar
 import uuid
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 
 Guid = NewType("Guid", str)
+T = TypeVar("T")
 
 
 def make_short_guid() -> Guid:
     guid = uuid.uuid4()
     b64guid = base64.b64encode(guid.bytes, altchars=b"-_")
     return b64guid[0:22].decode()
+
+
+def run(main: Coroutine[Any, Any, T]) -> T:
+    """Like asyncio.run, but on uvloop's faster event loop if it's installed"""
+    loop_factory = uvloop.new_event_loop if uvloop is not None else None
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        return runner.run(main)
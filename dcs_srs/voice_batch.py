@@ -0,0 +1,291 @@
+"""
+Batch decoding of many voice datagrams at once.
+
+Decoding packets one at a time costs a handful of Python objects per packet,
+which adds up quickly for consumers like recorders and analytics that look at
+every packet from every transmitter. `decode_batch` instead takes a list of raw
+datagrams and returns one column-oriented `VoiceBatch`:
+
+- one entry per packet in `packet_id`, `unit_id`, `hop_count`, `guid`,
+  `original_client_guid`, `audio_offset` and `audio_length`
+- a flat frequency table (`frequency`, `modulation`, `encryption`) where the
+  entries of packet i are `frequency_offset[i]:frequency_offset[i + 1]`
+- all datagrams concatenated into one shared `buffer` that the audio offsets
+  point into, so no audio is copied out per packet
+
+If NumPy is installed the columns are NumPy arrays and the whole batch is
+decoded with vectorized gathers. Otherwise the standard library `array` module
+is used with a plain struct loop. Either way GUIDs come out as str: a list of
+them, or a fixed width `U22` array whose items are str.
+"""
+
+from array import array
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Sequence
+
+from .client_info import Modulation
+from .voice_packet import (
+    Frequency,
+    fixed_struct,
+    frequency_struct,
+    guid_length,
+    header_length,
+    header_struct,
+    single_frequency_length,
+    trailer_length,
+)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Anything shorter than this can't be a voice packet (e.g. 22 byte pings)
+min_packet_length = header_length + trailer_length
+
+if np is not None:
+    PACKET_DTYPE = np.dtype(
+        [
+            ("packet_id", "<u8"),
+            ("unit_id", "<u4"),
+            ("hop_count", "u1"),
+            ("guid", f"S{guid_length}"),
+            ("original_client_guid", f"S{guid_length}"),
+            ("audio_offset", "<i8"),
+            ("audio_length", "<i8"),
+        ]
+    )
+    FREQUENCY_DTYPE = np.dtype(
+        [("frequency", "<f8"), ("modulation", "u1"), ("encryption", "u1")]
+    )
+
+
+@dataclass(slots=True)
+class VoiceBatch:
+    """Column-oriented decode of several voice datagrams"""
+
+    buffer: bytes
+    packet_id: Any
+    unit_id: Any
+    hop_count: Any
+    guid: Any
+    original_client_guid: Any
+    audio_offset: Any
+    audio_length: Any
+    frequency: Any
+    modulation: Any
+    encryption: Any
+    frequency_offset: Any
+
+    def __len__(self) -> int:
+        return len(self.packet_id)
+
+    def audio(self, index: int) -> memoryview:
+        """Zero-copy view of one packet's audio"""
+        start = int(self.audio_offset[index])
+        return memoryview(self.buffer)[start : start + int(self.audio_length[index])]
+
+    def frequencies(self, index: int) -> list[Frequency]:
+        """Frequencies of one packet, in the same form as VoicePacket"""
+        start = int(self.frequency_offset[index])
+        end = int(self.frequency_offset[index + 1])
+        return [
+            Frequency(
+                float(self.frequency[i]),
+                Modulation(int(self.modulation[i])),
+                int(self.encryption[i]),
+            )
+            for i in range(start, end)
+        ]
+
+
+def decode_batch(
+    datagrams: Sequence[bytes], use_numpy: bool | None = None
+) -> VoiceBatch:
+    """
+    Decode a list of voice datagrams in one pass. Datagrams too short to be a
+    voice packet (ping responses) are skipped, as are malformed ones.
+    """
+    datagrams = [data for data in datagrams if len(data) >= min_packet_length]
+    if use_numpy is None:
+        use_numpy = np is not None
+    if use_numpy:
+        if np is None:
+            raise RuntimeError("NumPy is not installed")
+        return _decode_batch_numpy(datagrams)
+    return _decode_batch_python(datagrams)
+
+
+async def get_batch(queue: asyncio.Queue, max_batch: int = 256) -> list:
+    """
+    Wait for at least one item on the queue, then take whatever else is already
+    waiting (up to max_batch) without yielding back to the loop.
+    """
+    batch = [await queue.get()]
+    while len(batch) < max_batch:
+        try:
+            batch.append(queue.get_nowait())
+        except asyncio.QueueEmpty:
+            break
+    return batch
+
+
+def _decode_batch_python(datagrams: Sequence[bytes]) -> VoiceBatch:
+    kept = []
+    packet_ids = array("Q")
+    unit_ids = array("I")
+    hop_counts = array("B")
+    guids: list[str] = []
+    original_client_guids: list[str] = []
+    audio_offsets = array("q")
+    audio_lengths = array("q")
+    frequencies = array("d")
+    modulations = array("B")
+    encryptions = array("B")
+    frequency_offsets = array("q", [0])
+
+    start = 0
+    for data in datagrams:
+        _, audio_length, frequency_length = header_struct.unpack_from(data, 0)
+        frequency_start = header_length + audio_length
+        fixed_offset = frequency_start + frequency_length
+        guid_offset = fixed_offset + fixed_struct.size
+        guid_bytes = data[guid_offset : guid_offset + 2 * guid_length]
+        if (
+            frequency_length % single_frequency_length
+            or len(guid_bytes) < 2 * guid_length
+            or not guid_bytes.isascii()
+        ):
+            # Malformed, left out as in _decode_batch_numpy
+            continue
+        kept.append(data)
+        audio_offsets.append(start + header_length)
+        audio_lengths.append(audio_length)
+
+        for offset in range(
+            frequency_start,
+            frequency_start + frequency_length,
+            single_frequency_length,
+        ):
+            freq, modulation, encryption = frequency_struct.unpack_from(data, offset)
+            frequencies.append(freq)
+            modulations.append(modulation)
+            encryptions.append(encryption)
+        frequency_offsets.append(len(frequencies))
+
+        unit_id, packet_id, hop_count = fixed_struct.unpack_from(data, fixed_offset)
+        unit_ids.append(unit_id)
+        packet_ids.append(packet_id)
+        hop_counts.append(hop_count)
+
+        original_client_guids.append(guid_bytes[:guid_length].decode())
+        guids.append(guid_bytes[guid_length:].decode())
+
+        start += len(data)
+
+    return VoiceBatch(
+        b"".join(kept),
+        packet_ids,
+        unit_ids,
+        hop_counts,
+        guids,
+        original_client_guids,
+        audio_offsets,
+        audio_lengths,
+        frequencies,
+        modulations,
+        encryptions,
+        frequency_offsets,
+    )
+
+
+def _gather(buf, offsets, width: int):
+    """Pull `width` bytes from each offset into an (n, width) uint8 array"""
+    return buf[offsets[:, None] + np.arange(width)]
+
+
+def _decode_batch_numpy(datagrams: Sequence[bytes]) -> VoiceBatch:
+    count = len(datagrams)
+    buffer = b"".join(datagrams)
+    buf = np.frombuffer(buffer, dtype=np.uint8)
+
+    lengths = np.fromiter(map(len, datagrams), dtype=np.int64, count=count)
+    starts = np.zeros(count, dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+
+    # HEADER SEGMENT
+    header = _gather(buf, starts, header_length).view("<u2").astype(np.int64)
+    audio_lengths = header[:, 1]
+    frequency_lengths = header[:, 2]
+
+    # Leave out datagrams without room for the segments their header gives, or
+    # with partial frequency entries or non-ASCII GUIDs, as the Python decode
+    # does
+    guid_offsets = starts + header_length + audio_lengths + frequency_lengths
+    guid_offsets += fixed_struct.size
+    valid = (frequency_lengths % single_frequency_length == 0) & (
+        guid_offsets + 2 * guid_length <= starts + lengths
+    )
+    if valid.all():
+        valid &= _gather(buf, guid_offsets, 2 * guid_length).max(axis=1) < 0x80
+    if not valid.all():
+        return _decode_batch_numpy(
+            [data for data, ok in zip(datagrams, valid.tolist()) if ok]
+        )
+
+    packets = np.empty(count, dtype=PACKET_DTYPE)
+    packets["audio_offset"] = starts + header_length
+    packets["audio_length"] = audio_lengths
+
+    # FREQUENCY SEGMENT
+    frequency_counts = frequency_lengths // single_frequency_length
+    frequency_offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(frequency_counts, out=frequency_offsets[1:])
+    total_frequencies = int(frequency_offsets[-1])
+    entry_index = np.arange(total_frequencies) - np.repeat(
+        frequency_offsets[:-1], frequency_counts
+    )
+    entry_starts = (
+        np.repeat(starts + header_length + audio_lengths, frequency_counts)
+        + entry_index * single_frequency_length
+    )
+    frequency_table = (
+        _gather(buf, entry_starts, single_frequency_length)
+        .view(FREQUENCY_DTYPE)
+        .reshape(total_frequencies)
+    )
+
+    # FIXED SEGMENT
+    fixed_offsets = starts + header_length + audio_lengths + frequency_lengths
+    packets["unit_id"] = _gather(buf, fixed_offsets, 4).view("<u4").reshape(count)
+    packets["packet_id"] = (
+        _gather(buf, fixed_offsets + 4, 8).view("<u8").reshape(count)
+    )
+    packets["hop_count"] = buf[fixed_offsets + 12]
+    guid_offsets = fixed_offsets + fixed_struct.size
+    packets["original_client_guid"] = (
+        _gather(buf, guid_offsets, guid_length).view(f"S{guid_length}").reshape(count)
+    )
+    packets["guid"] = (
+        _gather(buf, guid_offsets + guid_length, guid_length)
+        .view(f"S{guid_length}")
+        .reshape(count)
+    )
+
+    return VoiceBatch(
+        buffer,
+        packets["packet_id"],
+        packets["unit_id"],
+        packets["hop_count"],
+        # Same str items as the plain Python decode
+        packets["guid"].astype(f"U{guid_length}"),
+        packets["original_client_guid"].astype(f"U{guid_length}"),
+        packets["audio_offset"],
+        packets["audio_length"],
+        frequency_table["frequency"],
+        frequency_table["modulation"],
+        frequency_table["encryption"],
+        frequency_offsets,
+    )
@@ -1,74 +1,195 @@
 import asyncio
 import logging
-
+import struct
+import time
+
+from . import profiling
+from .capture import RecordKind, TrafficCapture
+from .link_health import LinkHealth, report_link_health
+from .queues import StageQueues
+from .udp_receiver import DEFAULT_RECEIVE_BUFFER, BatchedUdpSocket
 from .utils import Guid
-from .voice_packet import VoicePacket
+from .voice_batch import min_packet_length
+from .voice_packet import PacketTemplate, VoicePacket, VoicePacketView
 
 logger = logging.getLogger(__name__)
 
 
-VOICE_KEEPALIVE_PERIOD = 15
-
-
-async def connect_voice(addr: tuple[str, int], guid: Guid):
+async def connect_voice(
+    addr: tuple[str, int],
+    guid: Guid,
+    queues: StageQueues | None = None,
+    health: LinkHealth | None = None,
+    batched: bool = False,
+    receive_buffer: int = DEFAULT_RECEIVE_BUFFER,
+    capture: TrafficCapture | None = None,
+) -> tuple[
+    asyncio.Queue[VoicePacketView], asyncio.Queue[VoicePacket], list[asyncio.Task]
+]:
+    """
+    Open the UDP voice connection. Cancelling the returned tasks closes the
+    connection. Queue sizes and overflow policies come from the
+    "voice_datagram", "voice_receive" and "voice_send" stages of `queues`.
+    Voice receive and send queues already in `queues` are reused, so whatever
+    consumes and produces voice carries on across a reconnect. Keepalives,
+    traffic and loss are tracked in `health`. Every datagram sent and received
+    is logged to `capture`, if given.
+
+    With `batched`, datagrams are read by a `BatchedUdpSocket` with a
+    receive_buffer byte kernel buffer, which drains the socket on each wakeup
+    and puts packets straight onto the voice receive queue, skipping the
+    "voice_datagram" stage.
+    """
     loop = asyncio.get_running_loop()
 
-    receive_datagram_queue = asyncio.Queue[bytes]()
-
-    transport, protocol = await loop.create_datagram_endpoint(
-        lambda: UdpProtocol(receive_datagram_queue), remote_addr=addr
-    )
-
-    voice_receive_queue = asyncio.Queue[VoicePacket]()
-    voice_send_queue = asyncio.Queue[VoicePacket]()
-
-    asyncio.create_task(keep_voice_alive(transport, guid))
-    asyncio.create_task(send_voice(transport, voice_send_queue))
-    asyncio.create_task(receive_voice(receive_datagram_queue, voice_receive_queue))
-
-    return voice_receive_queue, voice_send_queue
+    if queues is None:
+        queues = StageQueues()
+    if health is None:
+        health = LinkHealth()
+    voice_receive_queue = queues.get_or_make("voice_receive")
+    voice_send_queue = queues.get_or_make("voice_send")
+
+    tasks = []
+    if batched:
+        transport = await BatchedUdpSocket.connect(
+            addr, voice_receive_queue, health, receive_buffer, capture=capture
+        )
+    else:
+        receive_datagram_queue = queues.make("voice_datagram")
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: UdpProtocol(receive_datagram_queue, health, capture),
+            remote_addr=addr,
+        )
+        tasks.append(
+            asyncio.create_task(
+                receive_voice(receive_datagram_queue, voice_receive_queue, health)
+            )
+        )
+
+    tasks += [
+        asyncio.create_task(keep_voice_alive(transport, guid, health, capture)),
+        asyncio.create_task(
+            send_voice(transport, voice_send_queue, health, capture)
+        ),
+        asyncio.create_task(report_link_health(health)),
+    ]
+
+    return voice_receive_queue, voice_send_queue, tasks
 
 
 class UdpProtocol(asyncio.DatagramProtocol):
     def __init__(
         self,
         receive_queue: asyncio.Queue[bytes],
+        health: LinkHealth,
+        capture: TrafficCapture | None = None,
     ):
         self.receive_queue = receive_queue
+        self.health = health
+        self.capture = capture
 
     def connection_made(self, transport: asyncio.DatagramTransport) -> None:
         pass
 
     def datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
-        self.receive_queue.put_nowait(data)
+        profiler = profiling.active
+        if profiler is not None:
+            start = time.perf_counter_ns()
+
+        self.health.datagram_received(len(data))
+        if self.capture is not None:
+            self.capture.record(RecordKind.UDP_IN, data)
+        try:
+            self.receive_queue.put_nowait(data)
+        except asyncio.QueueFull:
+            # Can't block in a protocol callback, so a full blocking queue drops
+            self.receive_queue.dropped += 1
 
+        if profiler is not None:
+            profiler.record("datagram_receive", start)
 
-async def keep_voice_alive(transport: asyncio.DatagramTransport, guid: Guid):
+
+async def keep_voice_alive(
+    transport: asyncio.DatagramTransport,
+    guid: Guid,
+    health: LinkHealth,
+    capture: TrafficCapture | None = None,
+):
+    """Ping the server on the adaptive keepalive period, timing each echo"""
     ping_data = guid.encode()
-    while True:
-        transport.sendto(ping_data)
-        await asyncio.sleep(VOICE_KEEPALIVE_PERIOD)
+    try:
+        while True:
+            sent_at = asyncio.get_running_loop().time()
+            health.ping_sent()
+            transport.sendto(ping_data)
+            health.datagram_sent(len(ping_data))
+            if capture is not None:
+                capture.record(RecordKind.UDP_OUT, ping_data)
+            if not await health.wait_for_echo():
+                health.echo_missed()
+
+            elapsed = asyncio.get_running_loop().time() - sent_at
+            await asyncio.sleep(max(0.0, health.keepalive_period - elapsed))
+    finally:
+        transport.close()
 
 
 async def send_voice(
-    transport: asyncio.DatagramTransport,
+    transport: asyncio.DatagramTransport | BatchedUdpSocket,
     voice_send_queue: asyncio.Queue[VoicePacket],
+    health: LinkHealth,
+    capture: TrafficCapture | None = None,
 ):
+    # Consecutive packets of a transmission only differ in audio and packet id,
+    # so serialize them with a template until something else changes
+    template = None
+    # The template reuses its buffer for the next packet. BatchedUdpSocket
+    # sends synchronously, so the kernel has copied it by then, but a datagram
+    # transport can keep data it couldn't send right away (uvloop's does
+    # without copying it), so it gets its own bytes.
+    copy = not isinstance(transport, BatchedUdpSocket)
     while True:
         voice_packet = await voice_send_queue.get()
-        transport.sendto(voice_packet)
+        if template is None or not template.matches(voice_packet):
+            template = PacketTemplate.for_packet(voice_packet)
+        data = template.serialize(voice_packet.audio_data, voice_packet.packet_id)
+        if copy:
+            data = bytes(data)
+        transport.sendto(data)
+        health.datagram_sent(len(data))
+        if capture is not None:
+            capture.record(RecordKind.UDP_OUT, data)
 
 
 async def receive_voice(
     receive_datagram_queue: asyncio.Queue[bytes],
-    voice_receive_queue: asyncio.Queue[VoicePacket],
+    voice_receive_queue: asyncio.Queue[VoicePacketView],
+    health: LinkHealth,
 ):
     while True:
         data = await receive_datagram_queue.get()
 
         if len(data) == 22:
-            # Ping response
-            # TODO track udp connection health with timeout
+            # Keepalive echo
+            health.echo_received()
+            continue
+        if len(data) < min_packet_length:
+            continue
+
+        profiler = profiling.active
+        if profiler is not None:
+            start = time.perf_counter_ns()
+
+        try:
+            packet = VoicePacket.deserialize_lazy(data)
+            # Decoded up front so a bad modulation is dropped here, not in
+            # every consumer
+            packet.frequencies
+            health.voice_received(packet.guid, packet.packet_id)
+        except (struct.error, ValueError):
+            logger.debug(f"Dropped a malformed {len(data)} byte voice datagram")
             continue
 
-        await voice_receive_queue.put(VoicePacket.deserialize(data))
+        if profiler is not None:
+            profiler.record("packet_decode", start)
+        await voice_receive_queue.put(packet)
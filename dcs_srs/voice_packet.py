@@ -30,14 +30,21 @@ from .utils import Guid
 class Frequency(NamedTuple):
     frequency: float
     modulation: Modulation
+    encryption: int = 0  # Key number if the radio is encrypted
 
 
 header_length = 2 + 2 + 2
 trailer_length = 4 + 8 + 1 + 22 + 22
 single_frequency_length = 8 + 1 + 1
+guid_length = 22
 
+# Precompiled layouts for each segment
+header_struct = struct.Struct("<HHH")
+frequency_struct = struct.Struct("<dBB")
+fixed_struct = struct.Struct("<IQB")
 
-@dataclass
+
+@dataclass(slots=True)
 class VoicePacket:
     audio_data: bytes
     frequencies: list[Frequency]
@@ -57,16 +64,17 @@ class VoicePacket:
         packet_length = header_length + audio_length + frequency_length + trailer_length
 
         # HEADER SEGMENT
-        header = struct.pack("<HHH", packet_length, audio_length, frequency_length)
+        header = header_struct.pack(packet_length, audio_length, frequency_length)
 
         # FREQUENCY SEGMENT
         frequency_segment = b"".join(
-            struct.pack("<dBB", f.frequency, f.modulation, 0) for f in self.frequencies
+            frequency_struct.pack(f.frequency, f.modulation, f.encryption)
+            for f in self.frequencies
         )
 
         # FIXED SEGMENT
-        trailer_segment = struct.pack(
-            "<IQB", self.unit_id, self.packet_id, self.hop_count
+        trailer_segment = fixed_struct.pack(
+            self.unit_id, self.packet_id, self.hop_count
         )
 
         return (
@@ -78,11 +86,16 @@ class VoicePacket:
             + self.guid.encode()
         )
 
+    @classmethod
+    def deserialize_lazy(cls, data: bytes) -> "VoicePacketView":
+        """Wrap a datagram without copying it, decoding fields on first access"""
+        return VoicePacketView(data)
+
     @classmethod
     def deserialize(cls, data: bytes) -> Self:
         # HEADER SEGMENT
-        packet_length, audio_length, frequency_length = struct.unpack_from(
-            "<HHH", data, offset=0
+        packet_length, audio_length, frequency_length = header_struct.unpack_from(
+            data, 0
         )
 
         # AUDIO SEGMENT
@@ -91,14 +104,14 @@ class VoicePacket:
         # FREQUENCY SEGMENT
         frequencies = []
         for offset in range(0, frequency_length, single_frequency_length):
-            freq, modulation, encryption = struct.unpack_from(
-                "<dBB", data, header_length + audio_length + offset
+            freq, modulation, encryption = frequency_struct.unpack_from(
+                data, header_length + audio_length + offset
             )
-            frequencies.append(Frequency(freq, Modulation(modulation)))
+            frequencies.append(Frequency(freq, Modulation(modulation), encryption))
 
         # FIXED SEGMENT
-        unit_id, packet_id, hop_count = struct.unpack_from(
-            "<IQB", data, offset=header_length + audio_length + frequency_length
+        unit_id, packet_id, hop_count = fixed_struct.unpack_from(
+            data, header_length + audio_length + frequency_length
         )
         original_client_guid = data[-44:-22].decode()
         guid = data[-22:].decode()
@@ -112,3 +125,257 @@ class VoicePacket:
             hop_count,
             original_client_guid,
         )
+
+
+class VoicePacketView:
+    """
+    Read-only view over a received voice datagram.
+
+    Only the header is parsed up front. Every other field is unpacked from the
+    underlying buffer the first time it's read and cached after that, so a
+    packet that only ever has its `guid` looked at costs one struct unpack and
+    one 22 byte decode. `audio_data` is a zero-copy memoryview into the
+    datagram.
+
+    A datagram too short for the segment lengths in its header raises
+    struct.error or ValueError.
+    """
+
+    __slots__ = (
+        "_data",
+        "_audio_length",
+        "_frequency_length",
+        "_frequencies",
+        "_fixed",
+        "_guid",
+        "_original_client_guid",
+    )
+
+    def __init__(self, data: bytes | bytearray | memoryview):
+        self._data = memoryview(data)
+        _, self._audio_length, self._frequency_length = header_struct.unpack_from(
+            self._data, 0
+        )
+        if self._fixed_offset + trailer_length > len(self._data):
+            raise ValueError(
+                f"Voice packet segments don't fit in {len(self._data)} bytes"
+            )
+        self._frequencies: list[Frequency] | None = None
+        self._fixed: tuple[int, int, int] | None = None
+        self._guid: Guid | None = None
+        self._original_client_guid: Guid | None = None
+
+    @property
+    def _fixed_offset(self) -> int:
+        return header_length + self._audio_length + self._frequency_length
+
+    @property
+    def datagram(self) -> memoryview:
+        """The whole packet as received"""
+        return self._data
+
+    @property
+    def audio_data(self) -> memoryview:
+        return self._data[header_length : header_length + self._audio_length]
+
+    @property
+    def frequencies(self) -> list[Frequency]:
+        if self._frequencies is None:
+            start = header_length + self._audio_length
+            self._frequencies = [
+                Frequency(freq, Modulation(modulation), encryption)
+                for freq, modulation, encryption in frequency_struct.iter_unpack(
+                    self._data[start : start + self._frequency_length]
+                )
+            ]
+        return self._frequencies
+
+    def _unpack_fixed(self) -> tuple[int, int, int]:
+        if self._fixed is None:
+            self._fixed = fixed_struct.unpack_from(self._data, self._fixed_offset)
+        return self._fixed
+
+    @property
+    def unit_id(self) -> int:
+        return self._unpack_fixed()[0]
+
+    @property
+    def packet_id(self) -> int:
+        return self._unpack_fixed()[1]
+
+    @property
+    def hop_count(self) -> int:
+        return self._unpack_fixed()[2]
+
+    @property
+    def original_client_guid(self) -> Guid:
+        if self._original_client_guid is None:
+            start = self._fixed_offset + fixed_struct.size
+            self._original_client_guid = str(
+                self._data[start : start + guid_length], "ascii"
+            )
+        return self._original_client_guid
+
+    @property
+    def guid(self) -> Guid:
+        if self._guid is None:
+            start = self._fixed_offset + fixed_struct.size + guid_length
+            self._guid = str(self._data[start : start + guid_length], "ascii")
+        return self._guid
+
+    def to_packet(self) -> VoicePacket:
+        """Copy out into a regular, fully decoded VoicePacket"""
+        return VoicePacket(
+            bytes(self.audio_data),
+            list(self.frequencies),
+            self.unit_id,
+            self.packet_id,
+            self.guid,
+            self.hop_count,
+            self.original_client_guid,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(guid={self.guid!r}, packet_id={self.packet_id}, "
+            f"audio_length={self._audio_length}, frequencies={self.frequencies!r})"
+        )
+
+
+class PacketTemplate:
+    """
+    Serializer for a run of packets that only differ in audio and packet id.
+
+    The frequency segment and GUIDs are packed once up front, and so is a
+    struct layout for the whole packet per audio length seen. Each `serialize`
+    is then a single `pack_into` into a buffer reused from packet to packet,
+    copying the audio once. (Audio that isn't bytes, like a memoryview, is
+    copied in with a slice assignment instead, as struct only takes bytes.)
+    """
+
+    __slots__ = (
+        "frequencies",
+        "unit_id",
+        "guid",
+        "hop_count",
+        "original_client_guid",
+        "_frequency_segment",
+        "_guids",
+        "_tail_struct",
+        "_layouts",
+        "_buffer",
+        "_view",
+    )
+
+    # Distinct audio lengths to keep a packed layout for
+    max_layouts = 256
+
+    def __init__(
+        self,
+        frequencies: list[Frequency],
+        unit_id: int,
+        guid: Guid,
+        hop_count: int = 0,
+        original_client_guid: Guid = "",
+        max_audio_length: int = 1024,
+    ):
+        self.frequencies = list(frequencies)
+        self.unit_id = unit_id
+        self.guid = guid
+        self.hop_count = hop_count
+        self.original_client_guid = original_client_guid or guid
+
+        self._frequency_segment = b"".join(
+            frequency_struct.pack(f.frequency, f.modulation, f.encryption)
+            for f in self.frequencies
+        )
+        self._guids = self.original_client_guid.encode() + guid.encode()
+        # Everything after the audio
+        self._tail_struct = struct.Struct(
+            f"<{len(self._frequency_segment)}sIQB{2 * guid_length}s"
+        )
+        self._layouts: dict[int, struct.Struct] = {}
+        self._allocate(max_audio_length)
+
+    @classmethod
+    def for_packet(cls, packet: VoicePacket) -> "PacketTemplate":
+        return cls(
+            packet.frequencies,
+            packet.unit_id,
+            packet.guid,
+            packet.hop_count,
+            packet.original_client_guid,
+        )
+
+    def matches(self, packet: VoicePacket) -> bool:
+        """Whether the packet can be serialized with this template"""
+        return (
+            packet.guid == self.guid
+            and packet.unit_id == self.unit_id
+            and packet.hop_count == self.hop_count
+            and packet.original_client_guid in ("", self.original_client_guid)
+            and packet.frequencies == self.frequencies
+        )
+
+    def serialize(self, audio_data: bytes, packet_id: int) -> memoryview:
+        """
+        Serialize a packet into the template's buffer. The result is only
+        valid until the next call.
+        """
+        audio_length = len(audio_data)
+        packet_length = header_length + audio_length + self._tail_struct.size
+        if packet_length > len(self._buffer):
+            self._allocate(audio_length)
+
+        if isinstance(audio_data, (bytes, bytearray)):
+            layout = self._layouts.get(audio_length)
+            if layout is None:
+                layout = self._layout(audio_length)
+            layout.pack_into(
+                self._buffer,
+                0,
+                packet_length,
+                audio_length,
+                len(self._frequency_segment),
+                audio_data,
+                self._frequency_segment,
+                self.unit_id,
+                packet_id,
+                self.hop_count,
+                self._guids,
+            )
+        else:
+            header_struct.pack_into(
+                self._buffer,
+                0,
+                packet_length,
+                audio_length,
+                len(self._frequency_segment),
+            )
+            self._buffer[header_length : header_length + audio_length] = audio_data
+            self._tail_struct.pack_into(
+                self._buffer,
+                header_length + audio_length,
+                self._frequency_segment,
+                self.unit_id,
+                packet_id,
+                self.hop_count,
+                self._guids,
+            )
+        return self._view[:packet_length]
+
+    def _layout(self, audio_length: int) -> struct.Struct:
+        if len(self._layouts) >= self.max_layouts:
+            self._layouts.clear()
+        layout = struct.Struct(
+            header_struct.format + f"{audio_length}s" + self._tail_struct.format[1:]
+        )
+        self._layouts[audio_length] = layout
+        return layout
+
+    def _allocate(self, max_audio_length: int):
+        # A new buffer rather than resizing, results handed out earlier may
+        # still be holding on to the old one
+        size = header_length + max_audio_length + self._tail_struct.size
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
@@ -0,0 +1,192 @@
+"""
+Optional multi-process voice processing.
+
+The event loop process keeps the sockets, and `VoiceWorkerPool` hands every
+received voice datagram, as raw bytes, to one of several worker processes
+through a shared memory `ShmRing` per worker. Datagrams are sharded by
+transmitter GUID (read straight off the end of the datagram) or by first
+frequency, so each worker sees all of a stream and can keep per stream state.
+
+Workers wrap datagrams in `VoicePacketView`s over the ring, without copying,
+and pass them in batches to a `PacketSink` made in the worker by the pool's
+sink factory. The factory is called with the worker index and has to be
+picklable, e.g. a module level function or class. Views are only valid during
+`handle_batch`, so a sink must copy whatever it keeps.
+
+If a worker falls behind and its ring fills up, datagrams for it are dropped
+and counted in `dropped`. The rings only run on x86-64 hosts, see shm_ring.
+"""
+
+import asyncio
+from collections.abc import Callable
+from enum import Enum
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import time
+from typing import Protocol
+import zlib
+
+from .recorder import VoiceRecorder
+from .shm_ring import ShmRing
+from .voice_batch import get_batch
+from .voice_packet import (
+    VoicePacketView,
+    guid_length,
+    header_length,
+    header_struct,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PacketSink(Protocol):
+    def handle_batch(self, packets: list[VoicePacketView]):
+        ...
+
+    def close(self):
+        ...
+
+
+SinkFactory = Callable[[int], PacketSink]
+
+
+class ShardBy(Enum):
+    GUID = "guid"
+    FREQUENCY = "frequency"
+
+
+def _guid_shard_key(datagram: memoryview) -> bytes:
+    return datagram[-guid_length:]
+
+
+def _frequency_shard_key(datagram: memoryview) -> bytes:
+    _, audio_length, _ = header_struct.unpack_from(datagram, 0)
+    start = header_length + audio_length
+    return datagram[start : start + 8]
+
+
+def _run_worker(
+    ring_name: str,
+    sink_factory: SinkFactory,
+    index: int,
+    batch_size: int,
+    poll_interval: float,
+):
+    ring = ShmRing.attach(ring_name)
+    sink = sink_factory(index)
+    try:
+        while True:
+            # Closing comes after the last write, so if the ring was closed
+            # before this read, the read gets everything that's left
+            closed = ring.closed
+            datagrams = ring.read_batch(batch_size)
+            if datagrams:
+                sink.handle_batch([VoicePacketView(d) for d in datagrams])
+                del datagrams
+                ring.commit()
+            elif closed:
+                break
+            else:
+                time.sleep(poll_interval)
+    finally:
+        sink.close()
+        ring.close()
+
+
+class VoiceWorkerPool:
+    def __init__(
+        self,
+        sink_factory: SinkFactory,
+        workers: int = 4,
+        ring_bytes: int = 8 * 1024 * 1024,
+        shard_by: ShardBy = ShardBy.GUID,
+        batch_size: int = 256,
+        poll_interval: float = 0.002,
+    ):
+        self.sink_factory = sink_factory
+        self.shard_by = shard_by
+        self.dropped = 0
+        self.submitted = 0
+
+        self._shard_key = (
+            _guid_shard_key if shard_by is ShardBy.GUID else _frequency_shard_key
+        )
+        self._rings = [ShmRing.create(ring_bytes) for _ in range(workers)]
+        # Spawn rather than fork, the parent has an event loop and threads
+        context = multiprocessing.get_context("spawn")
+        self._processes = [
+            context.Process(
+                target=_run_worker,
+                args=(ring.name, sink_factory, index, batch_size, poll_interval),
+                name=f"voice-worker-{index}",
+                daemon=True,
+            )
+            for index, ring in enumerate(self._rings)
+        ]
+
+    def start(self):
+        for process in self._processes:
+            process.start()
+
+    def submit(self, datagram: bytes | memoryview) -> bool:
+        """Queue a raw voice datagram for its worker, False if it was dropped"""
+        key = self._shard_key(datagram)
+        ring = self._rings[zlib.crc32(key) % len(self._rings)]
+        self.submitted += 1
+        if not ring.write(datagram):
+            self.dropped += 1
+            return False
+        return True
+
+    async def forward(self, voice_receive_queue: asyncio.Queue[VoicePacketView]):
+        """Submit everything from the voice receive queue until cancelled"""
+        while True:
+            for packet in await get_batch(voice_receive_queue):
+                self.submit(packet.datagram)
+
+    def processed(self) -> int:
+        """Datagrams the workers have finished with"""
+        return sum(ring.records_consumed for ring in self._rings)
+
+    def close(self, timeout: float = 5.0):
+        """Let the workers finish what's queued, then stop them. Blocks."""
+        for ring in self._rings:
+            ring.close_writing()
+        for process in self._processes:
+            if process.is_alive():
+                process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"{process.name} didn't stop, terminating it")
+                process.terminate()
+        for ring in self._rings:
+            ring.close()
+
+
+class RecorderSink:
+    """Records in a worker process, to a segment series per worker"""
+
+    def __init__(
+        self,
+        directory: str | os.PathLike,
+        index: int,
+        flush_interval: float = 1.0,
+        **recorder_args,
+    ):
+        self.recorder = VoiceRecorder(
+            Path(directory), prefix=f"srs-worker{index}", **recorder_args
+        )
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+
+    def handle_batch(self, packets: list[VoicePacketView]):
+        arrival = time.time()
+        for packet in packets:
+            self.recorder.record(packet, arrival)
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.recorder.flush()
+            self._last_flush = time.monotonic()
+
+    def close(self):
+        self.recorder.close()
@@ -0,0 +1,81 @@
+import asyncio
+import ctypes
+import math
+import struct
+import sys
+import types
+import wave
+
+import pytest
+
+from dcs_srs.audio_codec import CodecPool, OpusCodec
+from dcs_srs.audio_source import AudioFileSource
+
+
+class FakeOpusEncoder:
+    """Takes its PCM like opuslib does, through a ctypes cast"""
+
+    def __init__(self, sample_rate, channels, application):
+        pass
+
+    def encode(self, pcm, frame_size):
+        pointer = ctypes.cast(pcm, ctypes.POINTER(ctypes.c_int16))
+        return struct.pack("<h", pointer[0])
+
+
+@pytest.fixture
+def fake_opuslib(monkeypatch):
+    module = types.ModuleType("opuslib")
+    module.APPLICATION_VOIP = 2048
+    module.Encoder = FakeOpusEncoder
+    monkeypatch.setitem(sys.modules, "opuslib", module)
+
+
+def write_wav(path, rate: int, samples: list[int]):
+    with wave.open(str(path), "wb") as file:
+        file.setnchannels(1)
+        file.setsampwidth(2)
+        file.setframerate(rate)
+        file.writeframes(struct.pack(f"<{len(samples)}h", *samples))
+
+
+def test_mapped_file_through_opus_thread_pool(tmp_path, fake_opuslib):
+    path = tmp_path / "counting.wav"
+    frame_samples = 640
+    # Each frame starts with its own number
+    write_wav(path, 16000, [i // frame_samples for i in range(frame_samples * 10)])
+
+    async def encode_file():
+        pool = CodecPool(OpusCodec(), workers=2)
+        try:
+            with AudioFileSource(path) as source:
+                return [frame async for frame in pool.encode_stream("key", source)]
+        finally:
+            pool.shutdown()
+
+    encoded = asyncio.run(encode_file())
+    assert [struct.unpack("<h", frame)[0] for frame in encoded] == list(range(10))
+
+
+def rms(pcm: bytes) -> float:
+    samples = struct.unpack(f"<{len(pcm) // 2}h", pcm)
+    return math.sqrt(sum(sample * sample for sample in samples) / len(samples))
+
+
+@pytest.mark.parametrize("tone, passes", [(3000, True), (12000, False)])
+def test_downsampling_filters_out_aliases(tmp_path, tone, passes):
+    pytest.importorskip("numpy")
+    path = tmp_path / "tone.wav"
+    rate = 48000
+    step = 2 * math.pi * tone / rate
+    samples = [int(10000 * math.sin(step * i)) for i in range(rate)]
+    write_wav(path, rate, samples)
+
+    with AudioFileSource(path) as source:
+        # Skip the edges, where the filter runs off the ends of the file
+        pcm = b"".join(bytes(frame) for frame in list(source)[2:-2])
+    if passes:
+        assert rms(pcm) > 0.9 * 10000 / math.sqrt(2)
+    else:
+        # A 12 kHz tone would alias to 4 kHz
+        assert rms(pcm) < 0.05 * 10000 / math.sqrt(2)
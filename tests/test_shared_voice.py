@@ -0,0 +1,67 @@
+import asyncio
+import socket
+
+import pytest
+
+from dcs_srs.client_info import Coalition, Modulation, default_client_info
+from dcs_srs.client_state import ClientStore
+from dcs_srs.link_health import LinkHealth
+from dcs_srs.queues import BoundedQueue
+from dcs_srs.shared_voice import SharedVoiceTransport
+from dcs_srs.voice_packet import Frequency, VoicePacket
+
+SENDER = "S" * 22
+RED = ["R" * 21 + str(i) for i in range(2)]
+BLUE = ["B" * 21 + str(i) for i in range(2)]
+
+
+def client_store() -> ClientStore:
+    clients = ClientStore()
+    for guid, coalition in [
+        (SENDER, Coalition.RED),
+        *((guid, Coalition.RED) for guid in RED),
+        *((guid, Coalition.BLUE) for guid in BLUE),
+    ]:
+        info = default_client_info(guid)
+        info["Coalition"] = coalition
+        clients.merge(info)
+    return clients
+
+
+@pytest.mark.parametrize(
+    "relayed_to, receive",
+    [(RED, {*RED}), (RED + BLUE, {*RED, *BLUE})],
+    ids=["coalition-security", "everyone"],
+)
+def test_copies_go_to_the_senders_coalition_first(relayed_to, receive):
+    async def relay() -> set[str]:
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        server.bind(("127.0.0.1", 0))
+        transport = await SharedVoiceTransport.connect(server.getsockname())
+        clients = client_store()
+        queues = {guid: BoundedQueue() for guid in RED + BLUE}
+        tasks = [
+            asyncio.create_task(
+                transport.serve(
+                    guid, LinkHealth(), queue, [(251e6, Modulation.AM)], clients
+                )
+            )
+            for guid, queue in queues.items()
+        ]
+        await asyncio.sleep(0)
+
+        # The server sends one copy per client it relays to
+        data = VoicePacket(
+            b"audio", [Frequency(251e6, Modulation.AM, 0)], 1, 1, SENDER
+        ).serialize()
+        for _ in relayed_to:
+            server.sendto(data, transport.sock.getsockname())
+        while sum(queue.qsize() for queue in queues.values()) < len(relayed_to):
+            await asyncio.sleep(0.01)
+
+        transport.close()
+        await asyncio.gather(*tasks)
+        server.close()
+        return {guid for guid, queue in queues.items() if not queue.empty()}
+
+    assert asyncio.run(asyncio.wait_for(relay(), 5)) == receive
@@ -0,0 +1,131 @@
+from collections import deque
+import platform
+
+import pytest
+
+from dcs_srs import shm_ring
+from dcs_srs.shm_ring import ShmRing
+
+pytestmark = pytest.mark.skipif(
+    platform.machine().lower() not in shm_ring.SUPPORTED_MACHINES,
+    reason="ShmRing only runs on x86-64",
+)
+
+
+@pytest.fixture
+def rings():
+    """A producer's ring and a consumer attached to it"""
+    producer = ShmRing.create(256)
+    consumer = ShmRing.attach(producer.name)
+    yield producer, consumer
+    consumer.close()
+    producer.close()
+
+
+def read_all(ring: ShmRing) -> list[bytes]:
+    records = [bytes(record) for record in ring.read_batch(1024)]
+    ring.commit()
+    return records
+
+
+def test_round_trip(rings):
+    producer, consumer = rings
+    assert producer.write(b"abc")
+    assert producer.write(b"")
+    assert producer.write(bytes(range(40)))
+    assert read_all(consumer) == [b"abc", b"", bytes(range(40))]
+    assert consumer.records_consumed == 3
+    assert read_all(consumer) == []
+
+
+def test_full_ring_refuses_until_committed(rings):
+    producer, consumer = rings
+    # 8 byte length plus 24 bytes of payload
+    record = bytes(24)
+    count = producer.capacity // 32
+    for _ in range(count):
+        assert producer.write(record)
+    assert not producer.write(record)
+    assert not producer.write(b"")
+
+    # Read but not committed yet, so the space is still taken
+    assert len(consumer.read_batch(1)) == 1
+    assert not producer.write(record)
+    consumer.commit()
+    assert producer.write(record)
+    assert not producer.write(record)
+
+    assert len(read_all(consumer)) == count
+
+
+def test_wraparound(rings):
+    producer, consumer = rings
+    capacity = producer.capacity
+    # Leave 48 bytes at the end of the data area
+    assert producer.write(bytes(capacity - 48 - 8))
+    assert len(read_all(consumer)) == 1
+
+    # Exactly fills the end, so no wrap marker, and the next starts over
+    assert producer.write(b"a" * 40)
+    assert producer.write(b"b" * 60)
+    assert read_all(consumer) == [b"a" * 40, b"b" * 60]
+
+    # Leave 16 bytes at the end, too few for the next record, which goes past
+    # a wrap marker to the beginning
+    position = producer._head % capacity
+    assert producer.write(bytes(capacity - position - 16 - 8))
+    assert producer.write(b"c" * 30)
+    assert producer._head % capacity == 40
+    assert read_all(consumer) == [bytes(capacity - position - 24), b"c" * 30]
+
+
+def test_wrap_needs_room_for_the_skipped_space(rings):
+    producer, consumer = rings
+    capacity = producer.capacity
+    assert producer.write(bytes(capacity // 2 - 8))
+    assert len(read_all(consumer)) == 1
+    # Not read, and leaves a gap of 32 bytes at the end
+    unread = bytes(capacity - capacity // 2 - 32 - 8)
+    assert producer.write(unread)
+
+    # A record that wraps needs the gap as well as its own size
+    free = capacity - (len(unread) + 8)
+    assert not producer.write(bytes(free - 16 - 8))
+    assert producer.write(bytes(free - 32 - 8))
+    assert not producer.write(b"")
+    assert read_all(consumer) == [unread, bytes(free - 40)]
+
+
+def test_many_laps_keep_order(rings):
+    producer, consumer = rings
+    expected = deque()
+    for i in range(2000):
+        record = bytes([i % 256]) * (i * 7 % 90)
+        if not producer.write(record):
+            assert read_all(consumer) == list(expected)
+            expected.clear()
+            assert producer.write(record)
+        expected.append(record)
+    assert read_all(consumer) == list(expected)
+    assert consumer.records_consumed == 2000
+
+
+def test_oversized_record(rings):
+    producer, _ = rings
+    with pytest.raises(ValueError):
+        producer.write(bytes(producer.capacity))
+
+
+def test_close_writing(rings):
+    producer, consumer = rings
+    assert not consumer.closed
+    producer.write(b"last")
+    producer.close_writing()
+    assert consumer.closed
+    assert read_all(consumer) == [b"last"]
+
+
+def test_refuses_weakly_ordered_hosts(monkeypatch):
+    monkeypatch.setattr(platform, "machine", lambda: "aarch64")
+    with pytest.raises(RuntimeError):
+        ShmRing.create(256)
@@ -0,0 +1,65 @@
+import pytest
+
+from dcs_srs.client_info import Modulation
+from dcs_srs.voice_batch import decode_batch
+from dcs_srs.voice_packet import Frequency, VoicePacket
+
+
+@pytest.fixture(params=[False, True], ids=["python", "numpy"])
+def use_numpy(request):
+    if request.param:
+        pytest.importorskip("numpy")
+    return request.param
+
+
+def packet(packet_id: int) -> bytes:
+    return VoicePacket(
+        b"audio",
+        [Frequency(251e6, Modulation.AM, 0), Frequency(30e6, Modulation.FM, 2)],
+        7,
+        packet_id,
+        "G" * 22,
+    ).serialize()
+
+
+def with_header(data: bytes, audio_length: int, frequency_length: int) -> bytes:
+    header = (
+        len(data).to_bytes(2, "little")
+        + audio_length.to_bytes(2, "little")
+        + frequency_length.to_bytes(2, "little")
+    )
+    return header + data[6:]
+
+
+def test_decodes_packets(use_numpy):
+    batch = decode_batch([packet(1), bytes(22), packet(2)], use_numpy)
+    assert len(batch) == 2
+    assert list(batch.packet_id) == [1, 2]
+    assert list(batch.unit_id) == [7, 7]
+    assert list(batch.guid) == ["G" * 22] * 2
+    assert bytes(batch.audio(1)) == b"audio"
+    assert batch.frequencies(0) == [
+        Frequency(251e6, Modulation.AM, 0),
+        Frequency(30e6, Modulation.FM, 2),
+    ]
+
+
+@pytest.mark.parametrize(
+    "malformed",
+    [
+        # Header claims more audio than there is
+        with_header(packet(0), 200, 20),
+        # Or more frequencies
+        with_header(packet(0), 5, 30),
+        # Part of a frequency entry
+        with_header(packet(0), 6, 19),
+        packet(0)[:-1] + b"\xff",
+    ],
+    ids=["audio-overrun", "frequency-overrun", "partial-frequency", "non-ascii-guid"],
+)
+def test_drops_malformed_datagrams(use_numpy, malformed):
+    batch = decode_batch([packet(1), malformed, packet(2)], use_numpy)
+    assert list(batch.packet_id) == [1, 2]
+    assert list(batch.guid) == ["G" * 22] * 2
+    assert list(batch.frequency_offset) == [0, 2, 4]
+    assert bytes(batch.audio(1)) == b"audio"